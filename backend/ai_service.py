@@ -1,119 +1,294 @@
-import os
-from emergentintegrations.llm.chat import LlmChat, UserMessage, FileContentWithMimeType
-from typing import List, Optional
+import asyncio
+from typing import AsyncIterator, Callable, List, Optional, Tuple
 from dotenv import load_dotenv
+from chunking import estimate_tokens, group_by_budget, split_into_chunks
+from context_builder import NOTE_CHUNK_TOKENS, rank_note_chunks
+from generated_items import flashcard_fields, parse_items, quiz_fields
+from llm_cache import LLMCache, make_cache_key
+from llm_gateway import LLMGateway
+from single_flight import SingleFlight
 
 load_dotenv()
 
+SUMMARY_SYSTEM_MESSAGE = "You are a helpful study assistant. Provide concise, clear summaries of study materials."
+
+
+def yields_items(fields: Callable[[dict], Optional[dict]]) -> Callable[[str], bool]:
+    """Cache check for generated items: at least one parsed item must be usable"""
+    return lambda raw: any(fields(item) is not None for item in parse_items(raw))
+
+
 class AIService:
-    def __init__(self):
-        self.api_key = os.environ.get('EMERGENT_LLM_KEY')
-        if not self.api_key:
-            raise ValueError("EMERGENT_LLM_KEY not found in environment")
-    
-    async def summarize_text(self, text: str) -> str:
+    def __init__(self, cache: Optional[LLMCache] = None, gateway: Optional[LLMGateway] = None,
+                 summary_chunk_tokens: int = 3000, summary_fanout: int = 4):
+        self._gateway = gateway
+        self.cache = cache
+        self.inflight = SingleFlight()
+        self.summary_chunk_tokens = summary_chunk_tokens
+        self.summary_fanout = summary_fanout
+
+    @property
+    def gateway(self) -> LLMGateway:
+        # Created on first use, so importing the app needs neither the provider SDK nor its key
+        if self._gateway is None:
+            self._gateway = LLMGateway.from_env()
+        return self._gateway
+
+    def stats(self) -> dict:
+        return {
+            "cache": self.cache.stats() if self.cache is not None else None,
+            "single_flight": self.inflight.stats(),
+            "gateway": self._gateway.stats() if self._gateway is not None else None,
+        }
+
+    def _prompt_hash(self, method: str, system_message: str, prompt: str) -> str:
+        return make_cache_key(method, self.gateway.backend.model, system_message, prompt)
+
+    async def _send_cached(self, method: str, session_id: str, system_message: str, prompt: str, bypass_cache: bool = False,
+                           cacheable: Optional[Callable[[str], bool]] = None) -> str:
+        """Send a single-turn prompt, serving repeated identical requests from the cache.
+
+        Concurrent identical requests that miss the cache share one upstream call.
+        Responses that fail `cacheable` are returned but never cached (nor served
+        from the cache), so unusable output is asked for again next time.
+        """
+        key = self._prompt_hash(method, system_message, prompt)
+        if self.cache is not None and not bypass_cache:
+            cached = await self.cache.get(key)
+            if cached is not None and (cacheable is None or cacheable(cached)):
+                return cached
+
+        async def call_upstream() -> str:
+            response = await self.gateway.complete(method, system_message, prompt, session_id)
+            if self.cache is not None and (cacheable is None or cacheable(response)):
+                await self.cache.set(key, response, method=method)
+            return response
+
+        return await self.inflight.do(key, call_upstream)
+
+    async def _stream_cached(self, method: str, session_id: str, system_message: str, prompt: str, bypass_cache: bool = False,
+                             cacheable: Optional[Callable[[str], bool]] = None) -> AsyncIterator[str]:
+        """Streaming counterpart of `_send_cached`: a cache hit is yielded in one piece,
+        a miss is streamed from the gateway and cached once it completes."""
+        key = self._prompt_hash(method, system_message, prompt)
+        if self.cache is not None and not bypass_cache:
+            cached = await self.cache.get(key)
+            if cached is not None and (cacheable is None or cacheable(cached)):
+                yield cached
+                return
+
+        pieces = []
+        upstream = self.gateway.stream(method, system_message, prompt, session_id)
+        try:
+            async for chunk in upstream:
+                pieces.append(chunk)
+                yield chunk
+        finally:
+            await upstream.aclose()
+        response = "".join(pieces)
+        if self.cache is not None and (cacheable is None or cacheable(response)):
+            await self.cache.set(key, response, method=method)
+
+    async def _summary_request(self, text: str, bypass_cache: bool = False) -> Tuple[str, str]:
+        """Return the (method, prompt) of the final summarization call.
+
+        Text that fits in one chunk is summarized in a single call. Longer text is
+        split on paragraph/heading boundaries, the chunks are summarized concurrently
+        (at most `summary_fanout` at a time, each cached by its own content), and the
+        partial summaries are merged hierarchically until one final merge remains.
+        """
+        if estimate_tokens(text) <= self.summary_chunk_tokens:
+            return "summarize", f"Summarize the following text in bullet points:\n\n{text}"
+
+        fanout = asyncio.Semaphore(self.summary_fanout)
+
+        async def summarize_chunk(chunk: str) -> str:
+            async with fanout:
+                return await self._send_cached(
+                    "summarize_chunk",
+                    session_id="summarize",
+                    system_message=SUMMARY_SYSTEM_MESSAGE,
+                    prompt=f"Summarize this section of a longer document in concise bullet points:\n\n{chunk}",
+                    bypass_cache=bypass_cache,
+                )
+
+        async def merge(partials: List[str]) -> str:
+            async with fanout:
+                return await self._send_cached(
+                    "summarize_reduce",
+                    session_id="summarize",
+                    system_message=SUMMARY_SYSTEM_MESSAGE,
+                    prompt="Merge these partial summaries of consecutive sections into one concise set of bullet points:\n\n"
+                           + "\n\n---\n\n".join(partials),
+                    bypass_cache=bypass_cache,
+                )
+
+        chunks = split_into_chunks(text, self.summary_chunk_tokens)
+        partials = await asyncio.gather(*[summarize_chunk(chunk) for chunk in chunks])
+        while True:
+            groups = group_by_budget(list(partials), self.summary_chunk_tokens)
+            if len(groups) == 1:
+                return "summarize_reduce", (
+                    "Combine these partial summaries of one document into a single, de-duplicated summary in bullet points:\n\n"
+                    + "\n\n---\n\n".join(groups[0])
+                )
+            partials = await asyncio.gather(*[merge(group) for group in groups])
+
+    async def summarize_text(self, text: str, bypass_cache: bool = False) -> str:
         """Summarize given text using Gemini AI"""
-        chat = LlmChat(
-            api_key=self.api_key,
-            session_id="summarize",
-            system_message="You are a helpful study assistant. Provide concise, clear summaries of study materials."
-        ).with_model("gemini", "gemini-2.0-flash")
-        
-        message = UserMessage(text=f"Summarize the following text in bullet points:\n\n{text}")
-        response = await chat.send_message(message)
-        return response
-    
-    async def generate_flashcards(self, text: str, count: int = 5) -> List[dict]:
+        method, prompt = await self._summary_request(text, bypass_cache)
+        return await self._send_cached(method, "summarize", SUMMARY_SYSTEM_MESSAGE, prompt, bypass_cache)
+
+    async def stream_summary(self, text: str, bypass_cache: bool = False) -> AsyncIterator[str]:
+        """Summarize given text, yielding the final summary as it is generated"""
+        method, prompt = await self._summary_request(text, bypass_cache)
+        chunks = self._stream_cached(method, "summarize", SUMMARY_SYSTEM_MESSAGE, prompt, bypass_cache)
+        try:
+            async for chunk in chunks:
+                yield chunk
+        finally:
+            await chunks.aclose()
+
+    @staticmethod
+    def _flashcards_prompt(text: str, count: int) -> Tuple[str, str]:
+        return (
+            "You are a helpful study assistant. Generate flashcard questions and answers from study material.",
+            f"Generate {count} flashcards (question and answer pairs) from this text. Return as JSON array with 'question' and 'answer' fields:\n\n{text}",
+        )
+
+    def flashcards_prompt_hash(self, text: str, count: int = 5) -> str:
+        """Provenance id stored on generated flashcards (the prompt's cache key)"""
+        return self._prompt_hash("flashcards", *self._flashcards_prompt(text, count))
+
+    async def generate_flashcards(self, text: str, count: int = 5, bypass_cache: bool = False) -> str:
         """Generate flashcards from text"""
-        chat = LlmChat(
-            api_key=self.api_key,
-            session_id="flashcards",
-            system_message="You are a helpful study assistant. Generate flashcard questions and answers from study material."
-        ).with_model("gemini", "gemini-2.0-flash")
-        
-        message = UserMessage(
-            text=f"Generate {count} flashcards (question and answer pairs) from this text. Return as JSON array with 'question' and 'answer' fields:\n\n{text}"
+        system_message, prompt = self._flashcards_prompt(text, count)
+        return await self._send_cached("flashcards", "flashcards", system_message, prompt, bypass_cache,
+                                       cacheable=yields_items(flashcard_fields))
+
+    async def stream_flashcards(self, text: str, count: int = 5, bypass_cache: bool = False) -> AsyncIterator[str]:
+        """Generate flashcards from text, yielding output as it is generated"""
+        system_message, prompt = self._flashcards_prompt(text, count)
+        chunks = self._stream_cached("flashcards", "flashcards", system_message, prompt, bypass_cache,
+                                     cacheable=yields_items(flashcard_fields))
+        try:
+            async for chunk in chunks:
+                yield chunk
+        finally:
+            await chunks.aclose()
+
+    @staticmethod
+    def _quiz_prompt(topic: str, difficulty: str, count: int) -> Tuple[str, str]:
+        return (
+            f"You are a quiz generator. Create {difficulty} difficulty multiple choice questions.",
+            f"Generate {count} {difficulty} difficulty multiple choice questions about: {topic}. Include 4 options and mark the correct answer. Return as JSON array.",
         )
-        response = await chat.send_message(message)
-        
-        # Parse the response (you may need to handle JSON parsing)
-        return response
-    
-    async def generate_quiz(self, topic: str, difficulty: str = "medium", count: int = 5) -> str:
+
+    def quiz_prompt_hash(self, topic: str, difficulty: str = "medium", count: int = 5) -> str:
+        """Provenance id stored on generated quiz questions (the prompt's cache key)"""
+        return self._prompt_hash("quiz", *self._quiz_prompt(topic, difficulty, count))
+
+    async def generate_quiz(self, topic: str, difficulty: str = "medium", count: int = 5, bypass_cache: bool = False) -> str:
         """Generate quiz questions on a topic"""
-        chat = LlmChat(
-            api_key=self.api_key,
-            session_id="quiz",
-            system_message=f"You are a quiz generator. Create {difficulty} difficulty multiple choice questions."
-        ).with_model("gemini", "gemini-2.0-flash")
-        
-        message = UserMessage(
-            text=f"Generate {count} {difficulty} difficulty multiple choice questions about: {topic}. Include 4 options and mark the correct answer. Return as JSON array."
-        )
-        response = await chat.send_message(message)
-        return response
-    
-    async def chat_doubt_solver(self, question: str, session_id: str, chat_history: Optional[str] = None) -> str:
-        """Answer student doubts with chat context"""
+        system_message, prompt = self._quiz_prompt(topic, difficulty, count)
+        return await self._send_cached("quiz", "quiz", system_message, prompt, bypass_cache,
+                                       cacheable=yields_items(quiz_fields))
+
+    async def stream_quiz(self, topic: str, difficulty: str = "medium", count: int = 5, bypass_cache: bool = False) -> AsyncIterator[str]:
+        """Generate quiz questions on a topic, yielding output as it is generated"""
+        system_message, prompt = self._quiz_prompt(topic, difficulty, count)
+        chunks = self._stream_cached("quiz", "quiz", system_message, prompt, bypass_cache,
+                                     cacheable=yields_items(quiz_fields))
+        try:
+            async for chunk in chunks:
+                yield chunk
+        finally:
+            await chunks.aclose()
+
+    @staticmethod
+    def _chat_system_message(context: Optional[str]) -> str:
         system_msg = "You are a helpful tutor. Answer student questions clearly and provide examples when needed."
-        
-        if chat_history:
-            system_msg += f"\n\nPrevious conversation:\n{chat_history}"
-        
-        chat = LlmChat(
-            api_key=self.api_key,
-            session_id=session_id,
-            system_message=system_msg
-        ).with_model("gemini", "gemini-2.0-flash")
-        
-        message = UserMessage(text=question)
-        response = await chat.send_message(message)
-        return response
-    
-    async def analyze_file(self, file_path: str, mime_type: str, query: str) -> str:
-        """Analyze uploaded file (PDF, DOCX, TXT) and answer questions about it"""
-        chat = LlmChat(
-            api_key=self.api_key,
-            session_id="file_analysis",
-            system_message="You are a document analysis assistant. Analyze documents and provide insights."
-        ).with_model("gemini", "gemini-2.0-flash")
-        
-        file_content = FileContentWithMimeType(
-            file_path=file_path,
-            mime_type=mime_type
+        if context:
+            system_msg += f"\n\n{context}"
+        return system_msg
+
+    async def chat_doubt_solver(self, question: str, session_id: str, context: Optional[str] = None) -> str:
+        """Answer student doubts with chat context (see context_builder.build_context)"""
+        return await self.gateway.complete("chat", self._chat_system_message(context), question, session_id)
+
+    async def stream_chat(self, question: str, session_id: str, context: Optional[str] = None) -> AsyncIterator[str]:
+        """Answer student doubts with chat context, yielding the answer as it is generated"""
+        chunks = self.gateway.stream("chat", self._chat_system_message(context), question, session_id)
+        try:
+            async for chunk in chunks:
+                yield chunk
+        finally:
+            await chunks.aclose()
+
+    async def summarize_conversation(self, summary: Optional[str], turns: List[str], max_words: int = 200,
+                                     bypass_cache: bool = False) -> str:
+        """Fold older tutoring turns into the session's rolling summary (see chat_compaction.py)"""
+        previous = f"Summary so far:\n{summary}\n\n" if summary else ""
+        return await self._send_cached(
+            "chat_summary",
+            session_id="chat_summary",
+            system_message="You summarize tutoring conversations so they can be continued later. Keep the topics "
+                           "covered, what the student understood or struggled with, and open questions.",
+            prompt=f"{previous}Update the summary with these later turns, in at most {max_words} words:\n\n"
+                   + "\n\n".join(turns),
+            bypass_cache=bypass_cache,
         )
-        
-        message = UserMessage(
-            text=query,
-            file_contents=[file_content]
+
+    async def analyze_document(self, filename: str, text: str, query: str,
+                               max_tokens: int = 30000, bypass_cache: bool = False) -> str:
+        """Answer a question about an uploaded document's extracted text.
+
+        Documents over `max_tokens` are cut down to the chunks that rank highest
+        against the query, kept in document order.
+        """
+        if estimate_tokens(text) > max_tokens:
+            chunks = split_into_chunks(text, NOTE_CHUNK_TOKENS)
+            ranked = [chunk for _, chunk in rank_note_chunks(query, [{"id": "document", "title": "", "content": text}])]
+            selected, used = set(), 0
+            # Best matches first, then the rest in document order until the budget is spent
+            for chunk in ranked + chunks:
+                cost = estimate_tokens(chunk)
+                if chunk not in selected and used + cost <= max_tokens:
+                    selected.add(chunk)
+                    used += cost
+            parts, skipped = [], False
+            for chunk in chunks:
+                if chunk not in selected:
+                    skipped = True
+                    continue
+                if skipped and parts:
+                    parts.append("[...]")
+                parts.append(chunk)
+                skipped = False
+            text = "\n\n".join(parts)
+        return await self._send_cached(
+            "file_analysis",
+            "file_analysis",
+            "You are a document analysis assistant. Analyze documents and provide insights.",
+            f"{query}\n\nDocument: {filename}\n\n{text}",
+            bypass_cache,
         )
-        response = await chat.send_message(message)
-        return response
-    
+
     async def suggest_study_plan(self, topics: List[str], exam_date: str, hours_per_day: int) -> str:
         """Generate personalized study plan"""
-        chat = LlmChat(
-            api_key=self.api_key,
-            session_id="study_plan",
-            system_message="You are a study planning assistant. Create realistic, achievable study schedules."
-        ).with_model("gemini", "gemini-2.0-flash")
-        
-        message = UserMessage(
-            text=f"Create a study plan for these topics: {', '.join(topics)}. Exam date: {exam_date}. Available study time: {hours_per_day} hours/day. Provide day-by-day breakdown."
+        return await self.gateway.complete(
+            "study_plan",
+            "You are a study planning assistant. Create realistic, achievable study schedules.",
+            f"Create a study plan for these topics: {', '.join(topics)}. Exam date: {exam_date}. Available study time: {hours_per_day} hours/day. Provide day-by-day breakdown.",
+            "study_plan",
         )
-        response = await chat.send_message(message)
-        return response
-    
-    async def generate_exam_questions(self, topics: List[str], question_count: int = 10) -> str:
+
+    async def generate_exam_questions(self, topics: List[str], question_count: int = 10, bypass_cache: bool = False) -> str:
         """Generate exam practice questions"""
-        chat = LlmChat(
-            api_key=self.api_key,
+        return await self._send_cached(
+            "exam",
             session_id="exam",
-            system_message="You are an exam creator. Generate realistic exam questions with detailed solutions."
-        ).with_model("gemini", "gemini-2.0-flash")
-        
-        message = UserMessage(
-            text=f"Generate {question_count} exam-style questions covering: {', '.join(topics)}. Include solutions and explanations."
+            system_message="You are an exam creator. Generate realistic exam questions with detailed solutions.",
+            prompt=f"Generate {question_count} exam-style questions covering: {', '.join(topics)}. Include solutions and explanations.",
+            bypass_cache=bypass_cache,
         )
-        response = await chat.send_message(message)
-        return response
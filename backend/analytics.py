@@ -0,0 +1,308 @@
+"""Incrementally maintained study analytics.
+
+Every study session adds its minutes, count and focus score to its user's
+per-subject daily and weekly rollup in `study_rollups`, and advances the streak
+on their progress document with a single pipeline update. Dashboards read rollups only,
+so their cost depends on the requested window, not on the length of the history.
+
+Run `python analytics.py --rebuild` to recompute all rollups and the streak
+from the raw sessions.
+"""
+import asyncio
+import logging
+import os
+import sys
+import uuid
+from datetime import date, datetime, timedelta, timezone
+from typing import Callable, Dict, List, Optional
+
+from pymongo.errors import DuplicateKeyError
+
+from versions import bump_versions
+
+logger = logging.getLogger(__name__)
+
+DAY, WEEK = "day", "week"
+ROLLUP_FIELDS = {"_id": 0, "period": 1, "start": 1, "subject": 1, "minutes": 1, "sessions": 1, "focus_total": 1}
+SESSION_FIELDS = {"_id": 0, "id": 1, "user_id": 1, "subject": 1, "date": 1, "duration": 1, "focus_score": 1, "created_at": 1}
+# A session is saved with rolled_up False and marked once recorded; one still
+# unmarked after this long belongs to a request that failed in between
+STRAGGLER_GRACE = timedelta(minutes=5)
+
+
+def session_day(session: dict) -> date:
+    """The calendar day a session counts towards: its `date`, else the day it was saved"""
+    try:
+        return date.fromisoformat(str(session.get("date", ""))[:10])
+    except ValueError:
+        created_at = session.get("created_at")
+        if isinstance(created_at, str):
+            created_at = datetime.fromisoformat(created_at)
+        return (created_at or datetime.now(timezone.utc)).date()
+
+
+def week_start(day: date) -> date:
+    # ISO weeks start on Monday
+    return day - timedelta(days=day.weekday())
+
+
+def _bucket_keys(session: dict) -> List[dict]:
+    day = session_day(session)
+    subject = session.get("subject") or "Other"
+    return [
+        {"user_id": session["user_id"], "period": DAY, "start": day.isoformat(), "subject": subject},
+        {"user_id": session["user_id"], "period": WEEK, "start": week_start(day).isoformat(), "subject": subject},
+    ]
+
+
+async def _add(collection, key: dict, inc: dict):
+    try:
+        await collection.update_one(key, {"$inc": inc}, upsert=True)
+    except DuplicateKeyError:
+        # Two first sessions in the same bucket raced to insert it; the document exists now
+        await collection.update_one(key, {"$inc": inc})
+
+
+def _streak_pipeline(day: date, defaults: dict, minutes: int) -> List[dict]:
+    today, yesterday = day.isoformat(), (day - timedelta(days=1)).isoformat()
+    return [
+        # Fill in a fresh progress document on upsert (user_id comes from the filter)
+        {"$set": {field: {"$ifNull": [f"${field}", {"$literal": value}]}
+                  for field, value in defaults.items() if field != "user_id"}},
+        {"$set": {
+            "streak_days": {"$switch": {
+                "branches": [
+                    {"case": {"$eq": ["$last_study_date", today]}, "then": {"$max": ["$streak_days", 1]}},
+                    {"case": {"$eq": ["$last_study_date", yesterday]}, "then": {"$add": ["$streak_days", 1]}},
+                    # A backdated session does not break or extend the current run
+                    {"case": {"$gt": ["$last_study_date", today]}, "then": "$streak_days"},
+                ],
+                "default": 1,
+            }},
+            "last_study_date": {"$max": ["$last_study_date", today]},
+            "total_study_hours": {"$add": ["$total_study_hours", minutes / 60.0]},
+            "xp": {"$add": ["$xp", minutes]},
+        }},
+    ]
+
+
+async def record_session(db, session: dict, progress_defaults: dict):
+    """Add a newly saved session to its rollups, the streak and the progress totals"""
+    inc = {"minutes": session["duration"], "sessions": 1, "focus_total": session.get("focus_score", 0)}
+    await asyncio.gather(
+        *(_add(db.study_rollups, key, inc) for key in _bucket_keys(session)),
+        db.user_progress.update_one(
+            {"user_id": session["user_id"]}, _streak_pipeline(session_day(session), progress_defaults, session["duration"]), upsert=True
+        ),
+    )
+
+
+def current_streak(progress: dict, today: Optional[date] = None) -> int:
+    """The stored streak, or 0 once a full day has passed without studying"""
+    today = today or datetime.now(timezone.utc).date()
+    last = progress.get("last_study_date")
+    if not last or last < (today - timedelta(days=1)).isoformat():
+        return 0
+    return progress.get("streak_days", 0)
+
+
+def _summary(minutes: int, sessions: int, focus_total: int) -> dict:
+    return {
+        "minutes": minutes,
+        "sessions": sessions,
+        "mean_focus": round(focus_total / sessions, 1) if sessions else None,
+    }
+
+
+def _series(rollups: List[dict], starts: List[str]) -> List[dict]:
+    by_start: Dict[str, List[dict]] = {start: [] for start in starts}
+    for rollup in rollups:
+        if rollup["start"] in by_start:
+            by_start[rollup["start"]].append(rollup)
+    series = []
+    for start in starts:
+        buckets = sorted(by_start[start], key=lambda r: -r["minutes"])
+        series.append({
+            "start": start,
+            **_summary(sum(r["minutes"] for r in buckets), sum(r["sessions"] for r in buckets),
+                       sum(r["focus_total"] for r in buckets)),
+            "subjects": [{"subject": r["subject"], **_summary(r["minutes"], r["sessions"], r["focus_total"])}
+                         for r in buckets],
+        })
+    return series
+
+
+async def study_analytics(db, user_id: str, days: int = 30, weeks: int = 12, today: Optional[date] = None) -> dict:
+    """Daily and weekly series (zero-filled, oldest first) plus per-subject totals over the daily window"""
+    today = today or datetime.now(timezone.utc).date()
+    day_starts = [(today - timedelta(days=i)).isoformat() for i in range(days - 1, -1, -1)]
+    this_week = week_start(today)
+    week_starts = [(this_week - timedelta(weeks=i)).isoformat() for i in range(weeks - 1, -1, -1)]
+
+    daily, weekly, progress = await asyncio.gather(
+        db.study_rollups.find({"user_id": user_id, "period": DAY, "start": {"$gte": day_starts[0]}},
+                              ROLLUP_FIELDS).to_list(None),
+        db.study_rollups.find({"user_id": user_id, "period": WEEK, "start": {"$gte": week_starts[0]}},
+                              ROLLUP_FIELDS).to_list(None),
+        db.user_progress.find_one({"user_id": user_id}, {"_id": 0, "streak_days": 1, "last_study_date": 1}),
+    )
+
+    subjects: Dict[str, List[int]] = {}
+    for rollup in daily:
+        totals = subjects.setdefault(rollup["subject"], [0, 0, 0])
+        totals[0] += rollup["minutes"]
+        totals[1] += rollup["sessions"]
+        totals[2] += rollup["focus_total"]
+
+    return {
+        "daily": _series(daily, day_starts),
+        "weekly": _series(weekly, week_starts),
+        "subjects": [{"subject": subject, **_summary(*totals)}
+                     for subject, totals in sorted(subjects.items(), key=lambda item: -item[1][0])],
+        "streak_days": current_streak(progress or {}, today),
+        "last_study_date": (progress or {}).get("last_study_date"),
+    }
+
+
+async def backfill_rollups(db, batch_size: int = 1000,
+                           progress_defaults: Optional[Callable[[str], dict]] = None,
+                           grace: timedelta = STRAGGLER_GRACE) -> int:
+    """Roll up sessions that are missing from the rollups; cheap when there are none.
+
+    Sessions saved before rollups existed (without `rolled_up`) are added to
+    their rollups and streak. Sessions saved with `rolled_up: False` whose
+    request did not get to record them within `grace` are recorded like a new
+    session, progress totals included (given `progress_defaults(user_id)`).
+
+    Sessions are claimed before their buckets are incremented, so concurrent
+    runs never count a session twice and a crash in between under-counts one
+    batch rather than double-counting it; `--rebuild` recomputes everything.
+    """
+    rolled, users = 0, set()
+    while True:
+        sessions = await db.study_sessions.find(
+            {"rolled_up": {"$exists": False}}, SESSION_FIELDS,
+        ).limit(batch_size).to_list(batch_size)
+        if not sessions:
+            break
+        ids, claim = [s["id"] for s in sessions], uuid.uuid4().hex
+        await db.study_sessions.update_many(
+            {"id": {"$in": ids}, "rolled_up": {"$exists": False}}, {"$set": {"rolled_up": True, "rollup_claim": claim}}
+        )
+        claimed = set(await db.study_sessions.distinct("id", {"id": {"$in": ids}, "rollup_claim": claim}))
+        await db.study_sessions.update_many({"id": {"$in": list(claimed)}}, {"$unset": {"rollup_claim": ""}})
+        buckets: Dict[tuple, List[int]] = {}
+        for session in sessions:
+            if session["id"] not in claimed:
+                continue  # rolled up by a concurrent run
+            users.add(session["user_id"])
+            for key in _bucket_keys(session):
+                totals = buckets.setdefault(tuple(key.values()), [0, 0, 0])
+                totals[0] += session.get("duration", 0)
+                totals[1] += 1
+                totals[2] += session.get("focus_score", 0)
+        await asyncio.gather(*(
+            _add(db.study_rollups, {"user_id": user_id, "period": period, "start": start, "subject": subject},
+                 {"minutes": minutes, "sessions": count, "focus_total": focus})
+            for (user_id, period, start, subject), (minutes, count, focus) in buckets.items()
+        ))
+        rolled += len(claimed)
+        await asyncio.sleep(0)
+    for user_id in users:
+        await recompute_streak(db, user_id)
+
+    if progress_defaults is not None:
+        cutoff = datetime.now(timezone.utc) - grace
+        while True:
+            sessions = await db.study_sessions.find(
+                {"rolled_up": False, "created_at": {"$lt": cutoff}}, SESSION_FIELDS,
+            ).limit(batch_size).to_list(batch_size)
+            if not sessions:
+                break
+            for session in sessions:
+                claim = await db.study_sessions.update_one({"id": session["id"], "rolled_up": False},
+                                                           {"$set": {"rolled_up": True}})
+                if claim.modified_count:
+                    await record_session(db, session, progress_defaults(session["user_id"]))
+                    users.add(session["user_id"])
+                    rolled += 1
+    for user_id in users:
+        await bump_versions(db, user_id, "study_rollups", "user_progress")
+    if rolled:
+        logger.info("Rolled up %d study sessions of %d users", rolled, len(users))
+    return rolled
+
+
+class RollupSweeper:
+    """Runs backfill_rollups every `interval` seconds, for sessions whose request
+    failed between saving and recording them"""
+
+    def __init__(self, progress_defaults: Callable[[str], dict], interval: float = 600):
+        self.progress_defaults = progress_defaults
+        self.interval = interval
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self, db):
+        if self._task is None and self.interval > 0:
+            self._task = asyncio.create_task(self._run(db))
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def _run(self, db):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await backfill_rollups(db, progress_defaults=self.progress_defaults)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Rollup sweep failed")
+
+
+async def recompute_streak(db, user_id: str):
+    """Set the user's streak from their daily rollups; reads only the days of the current run"""
+    days = []
+    cursor = db.study_rollups.find({"user_id": user_id, "period": DAY}, {"_id": 0, "start": 1}).sort("start", -1)
+    async for rollup in cursor.batch_size(100):
+        if days and rollup["start"] == days[-1]:
+            continue  # several subjects on the same day
+        if days and rollup["start"] != (date.fromisoformat(days[-1]) - timedelta(days=1)).isoformat():
+            break
+        days.append(rollup["start"])
+    if days:
+        await db.user_progress.update_one(
+            {"user_id": user_id}, {"$set": {"streak_days": len(days), "last_study_date": days[0]}}, upsert=True
+        )
+
+
+async def rebuild_rollups(db) -> int:
+    await db.study_rollups.delete_many({})
+    await db.study_sessions.update_many({}, {"$unset": {"rolled_up": ""}})
+    return await backfill_rollups(db)
+
+
+async def _main(argv: List[str]) -> int:
+    from dotenv import load_dotenv
+    from motor.motor_asyncio import AsyncIOMotorClient
+    from pathlib import Path
+
+    if "--rebuild" not in argv:
+        print(__doc__)
+        return 2
+    load_dotenv(Path(__file__).parent / '.env')
+    client = AsyncIOMotorClient(os.environ['MONGO_URL'])
+    db = client[os.environ['DB_NAME']]
+    try:
+        print(f"{await rebuild_rollups(db)} sessions rolled up")
+        return 0
+    finally:
+        client.close()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    sys.exit(asyncio.run(_main(sys.argv[1:])))
@@ -0,0 +1,101 @@
+"""Dashboard analytics latency as the study history grows. Needs a running MongoDB.
+
+    cd backend && MONGO_URL=mongodb://localhost:27017 python -m benchmarks.bench_analytics --years 1 5 10
+
+Each history (several sessions a day across a handful of subjects) is seeded into
+a scratch database (dropped afterwards) and rolled up with the backfill, then the
+30-day / 12-week analytics query is timed. Since it reads rollups only, latency
+should stay flat as the history grows; the raw-session scan it replaces is timed
+alongside for comparison.
+"""
+import argparse
+import asyncio
+import os
+import random
+import statistics
+import time
+import uuid
+from datetime import date, datetime, timedelta, timezone
+
+from motor.motor_asyncio import AsyncIOMotorClient
+
+from analytics import backfill_rollups, record_session, study_analytics
+from indexes import ensure_indexes
+
+from benchmarks.bench_search import percentile
+
+USER_ID = "bench"
+SUBJECTS = ["Math", "Biology", "Chemistry", "History", "Physics", "Literature"]
+
+
+def history(years: int, today: date, seed: int = 11):
+    rng = random.Random(seed)
+    now = datetime.now(timezone.utc)
+    for offset in range(years * 365, 0, -1):
+        day = (today - timedelta(days=offset)).isoformat()
+        for _ in range(rng.randint(0, 6)):
+            yield {
+                "id": str(uuid.uuid4()),
+                "user_id": USER_ID,
+                "subject": rng.choice(SUBJECTS),
+                "duration": rng.choice([15, 25, 25, 45, 60]),
+                "date": day,
+                "focus_score": rng.randint(40, 100),
+                "created_at": now,
+            }
+
+
+async def timed(fn, runs: int):
+    latencies = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        await fn()
+        latencies.append((time.perf_counter() - started) * 1000)
+    return statistics.median(latencies), percentile(latencies, 95)
+
+
+async def bench_history(db, years: int, runs: int):
+    await db.study_sessions.drop()
+    await db.study_rollups.drop()
+    await db.user_progress.drop()
+    await ensure_indexes(db)
+    today = datetime.now(timezone.utc).date()
+    sessions = list(history(years, today))
+    for start in range(0, len(sessions), 5000):
+        await db.study_sessions.insert_many(sessions[start:start + 5000])
+    started = time.perf_counter()
+    await backfill_rollups(db)
+    backfill = time.perf_counter() - started
+
+    defaults = {"id": USER_ID, "total_study_hours": 0.0, "streak_days": 0, "xp": 0, "last_study_date": None}
+    session = {"user_id": USER_ID, "subject": "Math", "duration": 25, "date": today.isoformat(), "focus_score": 80}
+    started = time.perf_counter()
+    for _ in range(runs):
+        await record_session(db, session, defaults)
+    record = (time.perf_counter() - started) * 1000 / runs
+
+    rollup_p50, rollup_p95 = await timed(lambda: study_analytics(db, USER_ID, 30, 12), runs)
+    raw_p50, raw_p95 = await timed(lambda: db.study_sessions.find({"user_id": USER_ID}, {"_id": 0}).to_list(None),
+                                   max(3, runs // 10))
+    print(f"{years:>3}y {len(sessions):>7} sessions: backfill {backfill:.1f}s | record {record:.2f}ms | "
+          f"analytics p50={rollup_p50:.2f}ms p95={rollup_p95:.2f}ms | raw scan p50={raw_p50:.1f}ms p95={raw_p95:.1f}ms")
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--years", type=int, nargs="+", default=[1, 5, 10])
+    parser.add_argument("--runs", type=int, default=50)
+    args = parser.parse_args()
+
+    client = AsyncIOMotorClient(os.environ.get("MONGO_URL", "mongodb://localhost:27017"))
+    db = client[f"bench_analytics_{uuid.uuid4().hex[:8]}"]
+    try:
+        for years in args.years:
+            await bench_history(db, years, args.runs)
+    finally:
+        await client.drop_database(db.name)
+        client.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
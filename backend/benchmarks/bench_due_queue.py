@@ -0,0 +1,91 @@
+"""Due-queue latency as the deck grows. Needs a running MongoDB.
+
+    cd backend && MONGO_URL=mongodb://localhost:27017 python -m benchmarks.bench_due_queue --decks 1000 10000 50000
+
+Each deck is seeded into a scratch database (dropped afterwards), then a review
+session pulls batches through DueQueue. With the due_queue index, per-batch
+latency should stay flat across deck sizes.
+"""
+import argparse
+import asyncio
+import os
+import random
+import statistics
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+
+from motor.motor_asyncio import AsyncIOMotorClient
+
+from due_queue import DueQueue
+from indexes import ensure_indexes
+
+from benchmarks.bench_search import percentile
+
+
+def deck(n: int, now: datetime, seed: int = 3):
+    """Cards with about two thirds due, spread over the last and next 90 days"""
+    rng = random.Random(seed)
+    cards = []
+    for i in range(n):
+        lapses = rng.choice([0, 0, 0, 0, 1, 2, 4])
+        cards.append({
+            "id": str(uuid.uuid4()),
+            "note_id": f"note-{i % 50}",
+            "question": f"Question {i}",
+            "answer": f"Answer {i}",
+            "difficulty": 1,
+            "lapses": lapses,
+            "priority": min(lapses, 3),
+            "next_review": now + timedelta(minutes=rng.randint(-90 * 1440, 45 * 1440)),
+            "created_at": now,
+        })
+    return cards
+
+
+async def bench_deck(db, size: int, batch: int, batches: int):
+    now = datetime.now(timezone.utc)
+    await db.flashcards.drop()
+    await ensure_indexes(db)
+    cards = deck(size, now)
+    for start in range(0, len(cards), 5000):
+        await db.flashcards.insert_many(cards[start:start + 5000])
+
+    def due_filter_for(cutoff):
+        return {"next_review": {"$lte": cutoff}}
+
+    queue = DueQueue(prefetch=batch)
+    first, rest = [], []
+    for _ in range(5):
+        session_id = None
+        for i in range(batches):
+            started = time.perf_counter()
+            served, session_id, cursor = await queue.next_batch(db, session_id, batch, due_filter_for)
+            (first if i == 0 else rest).append((time.perf_counter() - started) * 1000)
+            if not cursor:
+                break
+            # Give the background refill a chance to run, as a client reviewing cards would
+            await asyncio.sleep(0.005)
+    print(f"{size:>7} cards: first batch p50={statistics.median(first):.2f}ms | "
+          f"next batches p50={statistics.median(rest):.2f}ms p95={percentile(rest, 95):.2f}ms")
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--decks", type=int, nargs="+", default=[1000, 10000, 50000])
+    parser.add_argument("--batch", type=int, default=100)
+    parser.add_argument("--batches", type=int, default=20)
+    args = parser.parse_args()
+
+    client = AsyncIOMotorClient(os.environ.get("MONGO_URL", "mongodb://localhost:27017"))
+    db = client[f"bench_due_queue_{uuid.uuid4().hex[:8]}"]
+    try:
+        for size in args.decks:
+            await bench_deck(db, size, args.batch, args.batches)
+    finally:
+        await client.drop_database(db.name)
+        client.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,320 @@
+"""Mixed concurrent workload against the whole API, with reproducible data.
+
+    cd backend && python -m benchmarks.bench_load --concurrency 32 --duration 30 --out load.json
+    cd backend && python -m benchmarks.bench_load --out new.json --compare load.json
+
+The app runs in-process behind httpx's ASGI transport, with the fake LLM
+backend (LLM_BACKEND=fake, see llm_gateway.py) answering after --llm-latency
+seconds plus up to --llm-jitter. Mongo is either mongomock-motor (--mongo
+memory, the default; `pip install mongomock-motor`) or a real server
+(--mongo mongodb://localhost:27017), in which case a scratch database is
+seeded and dropped afterwards. mongomock scans in Python, so absolute numbers
+are only comparable between runs on the same stand-in.
+
+One user gets --notes notes with --cards-per-note flashcards each, a study
+history of --history-days days and --chat-sessions chat sessions of
+--chat-turns turns, all from --seed. Workers then pick requests from a
+weighted mix of reads and writes for --duration seconds (the first --warmup
+seconds are not counted). Per endpoint the p50/p95/p99 latency, throughput and
+error count are printed and written to --out; with --compare, endpoints whose
+p95 grew by more than --threshold over the baseline are listed and the exit
+status is 1.
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import time
+import uuid
+from collections import defaultdict
+from datetime import date, datetime, timedelta, timezone
+
+from benchmarks.bench_search import percentile, vocabulary
+
+USER_ID = "bench"
+SUBJECTS = ["Biology", "Chemistry", "Physics", "History", "Mathematics", "Literature"]
+
+
+def seeded_uuid(rng: random.Random) -> str:
+    return str(uuid.UUID(int=rng.getrandbits(128), version=4))
+
+
+def dataset(args, rng: random.Random, now: datetime):
+    """Notes, flashcards, study sessions and chat messages for USER_ID"""
+    vocab = vocabulary(5000, rng)
+
+    def words(k):
+        return " ".join(rng.choices(vocab, k=k))
+
+    data = defaultdict(list)
+    for i in range(args.notes):
+        note_id = seeded_uuid(rng)
+        created = now - timedelta(minutes=args.notes - i)
+        data["notes"].append({
+            "id": note_id, "user_id": USER_ID, "title": words(4).title(), "content": words(rng.randint(80, 400)),
+            "subject": rng.choice(SUBJECTS), "ai_summary": None, "created_at": created, "updated_at": created,
+        })
+        for _ in range(args.cards_per_note):
+            data["flashcards"].append({
+                "id": seeded_uuid(rng), "user_id": USER_ID, "note_id": note_id,
+                "question": f"What is {words(3)}?", "answer": words(12), "difficulty": 1,
+                "ease": 2.5, "interval": 0, "repetitions": 0, "lapses": 0, "priority": rng.choice([0, 0, 0, 1]),
+                "next_review": now + timedelta(minutes=rng.randint(-60 * 1440, 30 * 1440)),
+                "prompt_hash": None, "created_at": created,
+            })
+    today = now.date()
+    for offset in range(args.history_days, 0, -1):
+        day = (today - timedelta(days=offset)).isoformat()
+        for _ in range(rng.randint(0, 4)):
+            data["study_sessions"].append({
+                "id": seeded_uuid(rng), "user_id": USER_ID, "subject": rng.choice(SUBJECTS),
+                "duration": rng.choice([15, 25, 45, 60]), "date": day, "focus_score": rng.randint(40, 100),
+                "created_at": now,
+            })
+    for s in range(args.chat_sessions):
+        session_id = f"bench-chat-{s}"
+        for turn in range(args.chat_turns):
+            data["chat_messages"].append({
+                "id": seeded_uuid(rng), "user_id": USER_ID, "session_id": session_id,
+                "message": f"Can you explain {words(6)}?", "response": words(rng.randint(60, 200)),
+                "created_at": now - timedelta(minutes=args.chat_turns - turn),
+            })
+    return data, vocab
+
+
+class Workload:
+    """Weighted request mix; each call issues one request and returns its label"""
+
+    def __init__(self, data, vocab, rng: random.Random):
+        self.note_ids = [n["id"] for n in data["notes"]]
+        self.card_ids = [c["id"] for c in data["flashcards"]]
+        self.chat_sessions = sorted({m["session_id"] for m in data["chat_messages"]}) or ["bench-chat-0"]
+        self.vocab = vocab
+        self.rng = rng
+        self.mix = [
+            (20, "GET /api/notes", self.list_notes),
+            (15, "GET /api/notes/{note_id}", self.get_note),
+            (15, "GET /api/search", self.search),
+            (10, "GET /api/flashcards/due", self.due_cards),
+            (8, "POST /api/flashcards/reviews", self.review_cards),
+            (5, "POST /api/chat", self.chat),
+            (8, "GET /api/chat/history/{session_id}", self.chat_history),
+            (5, "POST /api/notes", self.create_note),
+            (5, "POST /api/sessions", self.create_session),
+            (9, "GET /api/progress/analytics", self.analytics),
+        ]
+        self.weights = [weight for weight, _, _ in self.mix]
+
+    def pick(self):
+        _, name, request = self.rng.choices(self.mix, self.weights)[0]
+        return name, request
+
+    def list_notes(self, client):
+        return client.get("/api/notes", params={"limit": 50})
+
+    def get_note(self, client):
+        return client.get(f"/api/notes/{self.rng.choice(self.note_ids)}")
+
+    def search(self, client):
+        return client.get("/api/search", params={"q": " ".join(self.rng.choices(self.vocab[:500], k=2))})
+
+    def due_cards(self, client):
+        return client.get("/api/flashcards/due", params={"batch": 50})
+
+    def review_cards(self, client):
+        reviews = [{"review_id": seeded_uuid(self.rng), "flashcard_id": card_id, "grade": self.rng.randint(0, 5)}
+                   for card_id in self.rng.sample(self.card_ids, min(10, len(self.card_ids)))]
+        return client.post("/api/flashcards/reviews", json={"reviews": reviews})
+
+    def chat(self, client):
+        message = f"Can you explain {' '.join(self.rng.choices(self.vocab[:500], k=4))}?"
+        return client.post("/api/chat", json={"session_id": self.rng.choice(self.chat_sessions), "message": message})
+
+    def chat_history(self, client):
+        return client.get(f"/api/chat/history/{self.rng.choice(self.chat_sessions)}", params={"limit": 20})
+
+    def create_note(self, client):
+        content = " ".join(self.rng.choices(self.vocab, k=150))
+        return client.post("/api/notes", json={"title": "Load test", "content": content,
+                                               "subject": self.rng.choice(SUBJECTS)})
+
+    def create_session(self, client):
+        return client.post("/api/sessions", json={"subject": self.rng.choice(SUBJECTS), "duration": 25,
+                                                  "date": date.today().isoformat(), "focus_score": 80})
+
+    def analytics(self, client):
+        return client.get("/api/progress/analytics")
+
+
+def use_memory_mongo():
+    """Point Motor at mongomock-motor before the app creates its client"""
+    import motor.motor_asyncio
+    from mongomock_motor import AsyncMongoMockClient
+
+    class MemoryClient(AsyncMongoMockClient):
+        def __init__(self, *args, **kwargs):
+            kwargs.pop("event_listeners", None)  # no command monitoring in mongomock
+            super().__init__(*args, **kwargs)
+
+    motor.motor_asyncio.AsyncIOMotorClient = MemoryClient
+
+
+async def worker(client, workload: Workload, measure_from: float, deadline: float, samples):
+    while True:
+        started = time.perf_counter()
+        if started >= deadline:
+            return
+        name, request = workload.pick()
+        try:
+            ok = (await request(client)).status_code < 400
+        except Exception:
+            ok = False
+        if started >= measure_from:
+            samples[name].append(((time.perf_counter() - started) * 1000, ok))
+
+
+def summarize(samples, elapsed: float) -> dict:
+    endpoints = {}
+    for name, results in sorted(samples.items()):
+        latencies = [ms for ms, _ in results]
+        endpoints[name] = {
+            "requests": len(results),
+            "errors": sum(not ok for _, ok in results),
+            "throughput_rps": round(len(results) / elapsed, 2),
+            "mean_ms": round(statistics.fmean(latencies), 3),
+            "p50_ms": round(percentile(latencies, 50), 3),
+            "p95_ms": round(percentile(latencies, 95), 3),
+            "p99_ms": round(percentile(latencies, 99), 3),
+        }
+    total = sum(e["requests"] for e in endpoints.values())
+    return {
+        "endpoints": endpoints,
+        "total": {
+            "requests": total,
+            "errors": sum(e["errors"] for e in endpoints.values()),
+            "throughput_rps": round(total / elapsed, 2),
+        },
+    }
+
+
+def compare(results: dict, baseline: dict, threshold: float) -> list:
+    regressions = []
+    for name, current in results["endpoints"].items():
+        previous = baseline.get("endpoints", {}).get(name)
+        if previous and current["p95_ms"] > previous["p95_ms"] * (1 + threshold):
+            regressions.append((name, previous["p95_ms"], current["p95_ms"]))
+    return regressions
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+async def run(args) -> dict:
+    rng = random.Random(args.seed)
+    now = datetime.now(timezone.utc)
+    data, vocab = dataset(args, rng, now)
+
+    import httpx
+    import server
+
+    server.connect_db()
+    for collection, docs in data.items():
+        for start in range(0, len(docs), 5000):
+            await server.db[collection].insert_many(docs[start:start + 5000])
+    seeded = {collection: len(docs) for collection, docs in data.items()}
+    print("Seeded " + ", ".join(f"{count} {collection}" for collection, count in seeded.items()))
+
+    workload = Workload(data, vocab, random.Random(args.seed + 1))
+    samples = defaultdict(list)
+    try:
+        async with server.app.router.lifespan_context(server.app):
+            transport = httpx.ASGITransport(app=server.app)
+            async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None,
+                                         headers={"X-User-Id": USER_ID}) as client:
+                started = time.perf_counter()
+                measure_from = started + args.warmup
+                deadline = measure_from + args.duration
+                await asyncio.gather(*(worker(client, workload, measure_from, deadline, samples)
+                                       for _ in range(args.concurrency)))
+                elapsed = time.perf_counter() - measure_from
+    finally:
+        if args.mongo != "memory":
+            # The app closed its own client on shutdown
+            from motor.motor_asyncio import AsyncIOMotorClient
+            scratch = AsyncIOMotorClient(args.mongo)
+            await scratch.drop_database(os.environ["DB_NAME"])
+            scratch.close()
+
+    return {
+        "config": {**vars(args), "seeded": seeded},
+        "environment": {"commit": git_commit(), "python": platform.python_version(), "platform": platform.platform()},
+        "started_at": now.isoformat(),
+        "elapsed_s": round(elapsed, 3),
+        **summarize(samples, elapsed),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--mongo", default="memory", help="'memory' for mongomock-motor, or a MongoDB URL")
+    parser.add_argument("--llm-latency", type=float, default=0.2)
+    parser.add_argument("--llm-jitter", type=float, default=0.1)
+    parser.add_argument("--notes", type=int, default=10000)
+    parser.add_argument("--cards-per-note", type=int, default=10)
+    parser.add_argument("--history-days", type=int, default=365)
+    parser.add_argument("--chat-sessions", type=int, default=20)
+    parser.add_argument("--chat-turns", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--duration", type=float, default=30.0)
+    parser.add_argument("--warmup", type=float, default=5.0)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--out", help="write the results to this JSON file")
+    parser.add_argument("--compare", help="baseline results JSON to check for p95 regressions")
+    parser.add_argument("--threshold", type=float, default=0.2, help="allowed relative p95 growth")
+    args = parser.parse_args()
+
+    # The app reads its configuration on import
+    os.environ.update({
+        "LLM_BACKEND": "fake",
+        "LLM_FAKE_LATENCY": str(args.llm_latency),
+        "LLM_FAKE_JITTER": str(args.llm_jitter),
+        "LLM_RATE_PER_SECOND": os.environ.get("LLM_RATE_PER_SECOND", "1000"),
+        "LLM_BURST": os.environ.get("LLM_BURST", "1000"),
+        "MONGO_URL": "mongodb://memory" if args.mongo == "memory" else args.mongo,
+        "DB_NAME": f"bench_load_{uuid.uuid4().hex[:8]}",
+    })
+    if args.mongo == "memory":
+        use_memory_mongo()
+
+    results = asyncio.run(run(args))
+    print(f"{'endpoint':<38} {'reqs':>7} {'err':>5} {'rps':>8} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}")
+    for name, e in results["endpoints"].items():
+        print(f"{name:<38} {e['requests']:>7} {e['errors']:>5} {e['throughput_rps']:>8.1f} "
+              f"{e['p50_ms']:>9.2f} {e['p95_ms']:>9.2f} {e['p99_ms']:>9.2f}")
+    total = results["total"]
+    print(f"{'total':<38} {total['requests']:>7} {total['errors']:>5} {total['throughput_rps']:>8.1f}")
+
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(results, f, indent=2, default=str)
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(results, json.load(f), args.threshold)
+        for name, before, after in regressions:
+            print(f"REGRESSION {name}: p95 {before:.2f}ms -> {after:.2f}ms")
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
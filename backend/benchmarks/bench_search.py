@@ -0,0 +1,82 @@
+"""Search index benchmark on a synthetic corpus.
+
+    cd backend && python -m benchmarks.bench_search --docs 100000
+"""
+import argparse
+import random
+import statistics
+import time
+
+from search import InvertedIndex, document_for
+
+SUBJECTS = ["Biology", "Chemistry", "Physics", "History", "Mathematics", "Literature"]
+
+
+def vocabulary(size: int, rng: random.Random):
+    letters = "abcdefghijklmnopqrstuvwxyz"
+    return ["".join(rng.choice(letters) for _ in range(rng.randint(4, 10))) for _ in range(size)]
+
+
+def corpus(n: int, seed: int = 7):
+    """Notes, flashcards and quiz questions with Zipf-distributed terms"""
+    rng = random.Random(seed)
+    vocab = vocabulary(20000, rng)
+    weights = [1 / (rank + 1) for rank in range(len(vocab))]
+
+    def words(k):
+        return " ".join(rng.choices(vocab, weights, k=k))
+
+    docs = []
+    for i in range(n):
+        kind = ("note", "flashcard", "quiz")[i % 3]
+        if kind == "note":
+            doc = {"id": f"n{i}", "title": words(5), "subject": rng.choice(SUBJECTS), "content": words(300)}
+        elif kind == "flashcard":
+            doc = {"id": f"f{i}", "note_id": f"n{i - 1}", "question": words(12), "answer": words(30)}
+        else:
+            doc = {"id": f"q{i}", "topic": rng.choice(SUBJECTS), "question": words(15), "options": [words(3) for _ in range(4)]}
+        docs.append((kind, doc))
+    return docs, vocab
+
+
+def percentile(samples, pct):
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(len(samples) * pct / 100))]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--docs", type=int, default=100000)
+    parser.add_argument("--queries", type=int, default=500)
+    args = parser.parse_args()
+
+    docs, vocab = corpus(args.docs)
+    index = InvertedIndex()
+
+    started = time.perf_counter()
+    for kind, doc in docs:
+        index.add(document_for(kind, doc))
+    build = time.perf_counter() - started
+    print(f"build: {args.docs} docs in {build:.2f}s ({args.docs / build:.0f} docs/s), {len(index.postings)} terms")
+
+    rng = random.Random(11)
+    latencies = []
+    for _ in range(args.queries):
+        query = " ".join(rng.choices(vocab[:5000], k=rng.randint(1, 4)))
+        started = time.perf_counter()
+        index.search(query, subject=rng.choice([None, "Biology"]))
+        latencies.append((time.perf_counter() - started) * 1000)
+    print(f"query: p50={statistics.median(latencies):.2f}ms p95={percentile(latencies, 95):.2f}ms "
+          f"p99={percentile(latencies, 99):.2f}ms")
+
+    updates = []
+    for kind, doc in rng.sample(docs, 1000):
+        started = time.perf_counter()
+        index.remove(f"{kind}:{doc['id']}")
+        index.add(document_for(kind, doc))
+        updates.append((time.perf_counter() - started) * 1000)
+    print(f"incremental update: p50={statistics.median(updates):.3f}ms p95={percentile(updates, 95):.3f}ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+"""List-response serialization: the response_model path against the lean path.
+
+    cd backend && python -m benchmarks.bench_serialization --rows 100 1000
+
+For pages of notes and flashcards shaped like Mongo rows, times what happens
+after the query: FastAPI's response_model path (validate every row into the
+model, dump it to JSON-compatible data, encode with the stdlib), the old
+jsonable_encoder path used by sparse pages, and the lean path (fill defaults,
+encode with orjson, streamed in batches for long pages). The models are imported
+from server.py, so its .env settings must be present; no database is used.
+"""
+import argparse
+import asyncio
+import random
+import statistics
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import List
+
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+from pydantic import TypeAdapter
+
+from pagination import ResponseShape, lean_response
+from server import Flashcard, Note
+
+from benchmarks.bench_search import percentile, vocabulary
+
+
+def note_rows(n: int, rng: random.Random, vocab):
+    now = datetime.now(timezone.utc)
+    return [{
+        "id": str(uuid.uuid4()), "user_id": "bench", "title": " ".join(rng.choices(vocab, k=4)),
+        "content": " ".join(rng.choices(vocab, k=rng.randint(80, 400))), "subject": "Biology",
+        "ai_summary": None, "created_at": now - timedelta(minutes=i), "updated_at": now,
+    } for i in range(n)]
+
+
+def card_rows(n: int, rng: random.Random, vocab):
+    now = datetime.now(timezone.utc)
+    return [{
+        "id": str(uuid.uuid4()), "user_id": "bench", "note_id": str(uuid.uuid4()),
+        "question": " ".join(rng.choices(vocab, k=8)), "answer": " ".join(rng.choices(vocab, k=20)),
+        "difficulty": 1, "ease": 2.5, "interval": rng.randint(0, 60), "repetitions": rng.randint(0, 8),
+        "lapses": 0, "priority": 0, "next_review": now + timedelta(days=rng.randint(-30, 30)),
+        "prompt_hash": None, "created_at": now - timedelta(minutes=i),
+    } for i in range(n)]
+
+
+async def body_of(response) -> bytes:
+    if hasattr(response, "body_iterator"):
+        return b"".join([chunk async for chunk in response.body_iterator])
+    return response.body
+
+
+def timed(fn, runs: int):
+    latencies = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        fn()
+        latencies.append((time.perf_counter() - started) * 1000)
+    return statistics.median(latencies), percentile(latencies, 95)
+
+
+def bench(model, rows, runs: int):
+    adapter = TypeAdapter(List[model])
+    shape = ResponseShape(model)
+    loop = asyncio.new_event_loop()
+
+    def response_model_path():
+        # What FastAPI does with response_model=List[Model] for a returned list of dicts
+        content = adapter.dump_python(adapter.validate_python(rows), mode="json")
+        return JSONResponse(content).body
+
+    def jsonable_path():
+        return JSONResponse(jsonable_encoder(rows)).body
+
+    def lean_path():
+        return loop.run_until_complete(body_of(lean_response(shape.fill(rows))))
+
+    results = {name: timed(fn, runs) for name, fn in [
+        ("response_model", response_model_path), ("jsonable_encoder", jsonable_path), ("lean", lean_path),
+    ]}
+    loop.close()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, nargs="+", default=[100, 1000])
+    parser.add_argument("--runs", type=int, default=50)
+    args = parser.parse_args()
+
+    rng = random.Random(5)
+    vocab = vocabulary(5000, rng)
+    for n in args.rows:
+        for name, model, rows in [("notes", Note, note_rows(n, rng, vocab)), ("flashcards", Flashcard, card_rows(n, rng, vocab))]:
+            results = bench(model, rows, args.runs)
+            base = results["response_model"][0]
+            timings = " | ".join(f"{path} p50={p50:.2f}ms p95={p95:.2f}ms ({base / p50:.1f}x)"
+                                 for path, (p50, p95) in results.items())
+            print(f"{n:>6} {name:<10}: {timings}")
+
+
+if __name__ == "__main__":
+    main()
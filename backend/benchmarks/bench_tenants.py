@@ -0,0 +1,104 @@
+"""Per-user query cost as the number of tenants grows. Needs a running MongoDB.
+
+    cd backend && MONGO_URL=mongodb://localhost:27017 python -m benchmarks.bench_tenants --tenants 10 100 1000
+
+Every tenant gets the same notes and flashcards. Tenants are added to a scratch
+database (dropped afterwards), and after each step one user's hot queries are
+timed and explained. Since every index is prefixed by user_id, latency and
+documents examined should stay flat while the total document count grows.
+"""
+import argparse
+import asyncio
+import os
+import random
+import statistics
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+
+from motor.motor_asyncio import AsyncIOMotorClient
+
+from indexes import ensure_indexes
+from pagination import fetch_page
+
+from benchmarks.bench_search import percentile
+
+
+def tenant_docs(user_id: str, notes: int, cards_per_note: int, now: datetime, rng: random.Random):
+    note_docs, card_docs = [], []
+    for i in range(notes):
+        note_id = str(uuid.uuid4())
+        note_docs.append({
+            "id": note_id, "user_id": user_id, "title": f"Note {i}", "content": "Lorem ipsum " * 20,
+            "subject": rng.choice(["Math", "Biology", "History"]),
+            "created_at": now - timedelta(minutes=i), "updated_at": now,
+        })
+        for j in range(cards_per_note):
+            card_docs.append({
+                "id": str(uuid.uuid4()), "user_id": user_id, "note_id": note_id,
+                "question": f"Question {i}.{j}", "answer": f"Answer {i}.{j}", "priority": rng.choice([0, 0, 1]),
+                "next_review": now + timedelta(minutes=rng.randint(-30 * 1440, 30 * 1440)),
+                "created_at": now - timedelta(minutes=i),
+            })
+    return note_docs, card_docs
+
+
+async def examined(cursor) -> int:
+    stats = (await cursor.explain()).get("executionStats", {})
+    return stats.get("totalDocsExamined", -1)
+
+
+async def measure(db, user_id: str, note_id: str, runs: int):
+    now = datetime.now(timezone.utc)
+    due = {"user_id": user_id, "next_review": {"$lte": now}}
+    due_sort = [("priority", -1), ("next_review", 1), ("id", 1)]
+    queries = {
+        "notes page": lambda: fetch_page(db.notes, {"user_id": user_id}, None, 50),
+        "note by id": lambda: db.notes.find_one({"user_id": user_id, "id": note_id}),
+        "due batch": lambda: db.flashcards.find(due, {"_id": 0}).sort(due_sort).limit(100).to_list(100),
+    }
+    results = {}
+    for name, query in queries.items():
+        latencies = []
+        for _ in range(runs):
+            started = time.perf_counter()
+            await query()
+            latencies.append((time.perf_counter() - started) * 1000)
+        results[name] = (statistics.median(latencies), percentile(latencies, 95))
+    return results, await examined(db.flashcards.find(due).sort(due_sort).limit(100))
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--tenants", type=int, nargs="+", default=[10, 100, 1000])
+    parser.add_argument("--notes", type=int, default=50)
+    parser.add_argument("--cards-per-note", type=int, default=4)
+    parser.add_argument("--runs", type=int, default=50)
+    args = parser.parse_args()
+
+    client = AsyncIOMotorClient(os.environ.get("MONGO_URL", "mongodb://localhost:27017"))
+    db = client[f"bench_tenants_{uuid.uuid4().hex[:8]}"]
+    rng = random.Random(7)
+    now = datetime.now(timezone.utc)
+    try:
+        await ensure_indexes(db)
+        seeded, probe = 0, None
+        for target in sorted(args.tenants):
+            while seeded < target:
+                user_id = f"user-{seeded}"
+                notes, cards = tenant_docs(user_id, args.notes, args.cards_per_note, now, rng)
+                await db.notes.insert_many(notes)
+                await db.flashcards.insert_many(cards)
+                probe = probe or (user_id, notes[0]["id"])
+                seeded += 1
+            results, due_examined = await measure(db, probe[0], probe[1], args.runs)
+            total = await db.flashcards.estimated_document_count()
+            timings = " | ".join(f"{name} p50={p50:.2f}ms p95={p95:.2f}ms" for name, (p50, p95) in results.items())
+            print(f"{target:>6} tenants ({total:>8} cards): {timings} | due docs examined={due_examined}")
+    finally:
+        await client.drop_database(db.name)
+        client.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
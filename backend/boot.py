@@ -0,0 +1,67 @@
+"""Where the API process spends its boot time.
+
+server.py marks its import and construction phases and times each startup
+step with `boot_timer`; the breakdown is logged when startup finishes and
+exported as the `startup_step_seconds` gauge on /api/metrics.
+
+Run `python boot.py` to import the app and print the breakdown as JSON, or
+`python boot.py --startup` to also run the startup steps against the
+configured Mongo, e.g. to track boot latency across releases.
+"""
+import json
+import sys
+import time
+from contextlib import contextmanager
+from typing import List, Optional, Tuple
+
+
+class BootTimer:
+    def __init__(self):
+        self.started = time.perf_counter()
+        self._checkpoint = self.started
+        self.steps: List[Tuple[str, float]] = []
+        self.total: Optional[float] = None
+
+    def mark(self, name: str):
+        """Record the time since the previous mark (or since boot) as step `name`"""
+        now = time.perf_counter()
+        self.steps.append((name, now - self._checkpoint))
+        self._checkpoint = now
+
+    @contextmanager
+    def step(self, name: str):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.steps.append((name, time.perf_counter() - started))
+
+    def finish(self) -> dict:
+        self.total = time.perf_counter() - self.started
+        return self.report()
+
+    def report(self) -> dict:
+        total = self.total if self.total is not None else time.perf_counter() - self.started
+        return {"total_seconds": round(total, 4), "steps": {name: round(seconds, 4) for name, seconds in self.steps}}
+
+
+boot_timer = BootTimer()
+
+
+def _main(argv) -> int:
+    import asyncio
+
+    import server
+
+    if "--startup" in argv:
+        async def start_and_stop():
+            async with server.app.router.lifespan_context(server.app):
+                pass
+
+        asyncio.run(start_and_stop())
+    print(json.dumps(server.boot_timer.report(), indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(_main(sys.argv[1:]))
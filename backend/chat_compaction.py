@@ -0,0 +1,111 @@
+"""Rolling-summary compaction of chat sessions.
+
+Each session keeps at most `compact_after` unsummarized turns: once it has
+more, all but the newest `keep_recent` of them are folded into a stored
+summary in `chat_summaries`. The doubt solver's context is built from that
+summary plus the recent turns, so its prompt stays the same size however long
+the session runs. The raw messages are kept and can be paged through.
+"""
+import asyncio
+import logging
+from datetime import datetime, timezone
+from typing import Optional, Set
+
+from pymongo.errors import DuplicateKeyError
+
+from chunking import truncate_to_tokens
+from single_flight import SingleFlight
+
+logger = logging.getLogger(__name__)
+
+SUMMARY_PROJECTION = {"_id": 0, "summary": 1, "folded_turns": 1, "until": 1, "updated_at": 1}
+FOLD_ANSWER_TOKENS = 300
+MAX_SUMMARY_TOKENS = 400
+
+
+def after_position(until: Optional[dict]) -> dict:
+    """Filter for messages after the last folded one"""
+    if not until:
+        return {}
+    return {"$or": [
+        {"created_at": {"$gt": until["created_at"]}},
+        {"created_at": until["created_at"], "id": {"$gt": until["id"]}},
+    ]}
+
+
+async def load_summary(db, user_id: str, session_id: str) -> Optional[dict]:
+    return await db.chat_summaries.find_one({"user_id": user_id, "session_id": session_id}, SUMMARY_PROJECTION)
+
+
+class ChatCompactor:
+    """Folds older chat turns into each session's rolling summary in the background"""
+
+    def __init__(self, ai_service, keep_recent: int = 10, compact_after: int = 20):
+        self.ai_service = ai_service
+        self.keep_recent = keep_recent
+        self.compact_after = max(compact_after, keep_recent + 1)
+        self.inflight = SingleFlight()
+        self.compactions = 0
+        self._tasks: Set[asyncio.Task] = set()
+
+    def schedule(self, db, user_id: str, session_id: str):
+        """Compact the session after a new turn, without holding up the response"""
+        task = asyncio.create_task(self._compact_logged(db, user_id, session_id))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def stop(self):
+        for task in list(self._tasks):
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    async def _compact_logged(self, db, user_id: str, session_id: str):
+        try:
+            # One compaction per session at a time; turns saved meanwhile wait for the next one
+            await self.inflight.do(f"{user_id}:{session_id}", lambda: self.compact(db, user_id, session_id))
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            logger.exception("Could not compact chat session %s", session_id)
+
+    async def compact(self, db, user_id: str, session_id: str) -> int:
+        """Fold the session's older unsummarized turns into its summary; returns the number folded"""
+        current = await load_summary(db, user_id, session_id) or {}
+        pending = await db.chat_messages.find(
+            {"user_id": user_id, "session_id": session_id, **after_position(current.get("until"))},
+            {"_id": 0, "id": 1, "message": 1, "response": 1, "created_at": 1},
+        ).sort([("created_at", 1), ("id", 1)]).limit(self.compact_after + 1).to_list(self.compact_after + 1)
+        if len(pending) <= self.compact_after:
+            return 0
+
+        # At least `keep_recent` turns stay verbatim: the session has more than `compact_after` pending
+        fold = pending[:len(pending) - self.keep_recent]
+        turns = [f"Q: {m['message']}\nA: {truncate_to_tokens(m['response'], FOLD_ANSWER_TOKENS)}" for m in fold]
+        summary = await self.ai_service.summarize_conversation(current.get("summary"), turns)
+        summary = truncate_to_tokens(summary, MAX_SUMMARY_TOKENS)
+
+        last = fold[-1]
+        folded = current.get("folded_turns", 0)
+        update = {
+            "$set": {
+                "summary": summary,
+                "until": {"created_at": last["created_at"], "id": last["id"]},
+                "folded_turns": folded + len(fold),
+                "updated_at": datetime.now(timezone.utc),
+            },
+        }
+        try:
+            # Conditional on the fold count we started from, so a concurrent compaction
+            # in another process cannot fold the same turns twice
+            result = await db.chat_summaries.update_one(
+                {"user_id": user_id, "session_id": session_id,
+                 "folded_turns": folded if current else {"$exists": False}},
+                update,
+                upsert=not current,
+            )
+        except DuplicateKeyError:
+            return 0  # the first summary of this session was written concurrently
+        if not (result.modified_count or result.upserted_id):
+            return 0
+        self.compactions += 1
+        return len(fold)
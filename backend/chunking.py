@@ -0,0 +1,102 @@
+import hashlib
+import re
+from typing import List
+
+HEADING_RE = re.compile(r"^\s*#{1,6}\s")
+SENTENCE_RE = re.compile(r"(?<=[.!?])\s+")
+
+
+def estimate_tokens(text: str) -> int:
+    """Cheap token estimate (~4 characters per token for English prose)"""
+    return (len(text) + 3) // 4
+
+
+def truncate_to_tokens(text: str, max_tokens: int) -> str:
+    limit = max_tokens * 4
+    if len(text) <= limit:
+        return text
+    return text[:limit].rsplit(" ", 1)[0] + " …"
+
+
+def _blocks(text: str) -> List[str]:
+    """Split text into paragraph blocks; a heading line always starts a new block"""
+    blocks, current = [], []
+    for line in text.splitlines():
+        if not line.strip():
+            if current:
+                blocks.append("\n".join(current))
+                current = []
+            continue
+        if HEADING_RE.match(line) and current:
+            blocks.append("\n".join(current))
+            current = []
+        current.append(line)
+    if current:
+        blocks.append("\n".join(current))
+    return blocks
+
+
+def _split_oversized(block: str, max_tokens: int) -> List[str]:
+    """Break a single block that exceeds the budget on sentence, then word, boundaries"""
+    pieces, current = [], ""
+    units = SENTENCE_RE.split(block)
+    if any(estimate_tokens(u) > max_tokens for u in units):
+        units = block.split()
+    for unit in units:
+        candidate = f"{current} {unit}" if current else unit
+        if current and estimate_tokens(candidate) > max_tokens:
+            pieces.append(current)
+            current = unit
+        else:
+            current = candidate
+    if current:
+        pieces.append(current)
+    return pieces
+
+
+def _is_anchor(block: str) -> bool:
+    return hashlib.sha1(block.encode("utf-8")).digest()[0] % 4 == 0
+
+
+def split_into_chunks(text: str, max_tokens: int = 3000) -> List[str]:
+    """Split text into chunks of at most `max_tokens` on paragraph/heading boundaries.
+
+    Chunk boundaries are content-defined: besides the hard budget limit, a chunk
+    also ends after any "anchor" paragraph (chosen by hash) once it is half full.
+    Editing one paragraph therefore only changes the chunk that contains it (and
+    at most the chunks up to the next anchor), so per-chunk cache entries for the
+    rest of a long note stay valid.
+    """
+    chunks, current, current_tokens = [], [], 0
+    for block in _blocks(text):
+        for piece in (_split_oversized(block, max_tokens) if estimate_tokens(block) > max_tokens else [block]):
+            tokens = estimate_tokens(piece)
+            if current and current_tokens + tokens > max_tokens:
+                chunks.append("\n\n".join(current))
+                current, current_tokens = [], 0
+            current.append(piece)
+            current_tokens += tokens
+            if current_tokens >= max_tokens // 2 and _is_anchor(piece):
+                chunks.append("\n\n".join(current))
+                current, current_tokens = [], 0
+    if current:
+        chunks.append("\n\n".join(current))
+    return chunks
+
+
+def group_by_budget(texts: List[str], max_tokens: int) -> List[List[str]]:
+    """Greedily group consecutive texts so each group fits in `max_tokens` (at least two per group)"""
+    groups, current, current_tokens = [], [], 0
+    for text in texts:
+        tokens = estimate_tokens(text)
+        if len(current) >= 2 and current_tokens + tokens > max_tokens:
+            groups.append(current)
+            current, current_tokens = [], 0
+        current.append(text)
+        current_tokens += tokens
+    if current:
+        if len(current) == 1 and groups:
+            groups[-1].append(current[0])
+        else:
+            groups.append(current)
+    return groups
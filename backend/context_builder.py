@@ -0,0 +1,111 @@
+from typing import List, Optional, Tuple
+
+from chat_compaction import after_position, load_summary
+from chunking import estimate_tokens, split_into_chunks, truncate_to_tokens
+from search import InvertedIndex, tokenize
+
+NOTE_CHUNK_TOKENS = 300
+CANDIDATE_NOTES = 5
+VERBATIM_TURNS = 2
+COMPACT_ANSWER_TOKENS = 40
+HISTORY_SHARE = 0.4
+
+
+def rank_note_chunks(question: str, notes: List[dict]) -> List[Tuple[str, str]]:
+    """Split candidate notes into small chunks and rank them against the question with BM25"""
+    index = InvertedIndex()
+    chunks = {}
+    for note in notes:
+        for i, chunk in enumerate(split_into_chunks(note.get("content", ""), NOTE_CHUNK_TOKENS)):
+            key = f"{note['id']}:{i}"
+            chunks[key] = (note.get("title", ""), chunk)
+            index.add({
+                "key": key, "kind": "note", "id": key, "title": note.get("title", ""),
+                "subject": None, "text": "",
+                "fields": {"title": (1.0, note.get("title", "")), "content": (1.0, chunk)},
+            })
+    return [chunks[hit["id"]] for hit in index.search(question, limit=len(chunks) or 1)]
+
+
+def compact_history(history: List[dict]) -> List[str]:
+    """Newest-first list of rendered turns; older turns keep the question and a clipped answer"""
+    turns = []
+    for i, msg in enumerate(reversed(history)):
+        answer = msg["response"] if i < VERBATIM_TURNS else truncate_to_tokens(msg["response"], COMPACT_ANSWER_TOKENS)
+        turns.append(f"Q: {msg['message']}\nA: {answer}")
+    return turns
+
+
+def pack_context(chunks: List[Tuple[str, str]], turns: List[str], budget: int,
+                 summary: Optional[str] = None) -> Tuple[str, dict]:
+    """Fit ranked note chunks, the session summary and newest-first history turns into `budget` tokens.
+
+    History (summary first) gets up to HISTORY_SHARE of the budget, notes the
+    rest; whatever one side leaves unused is handed to the other.
+    """
+    def take(items: List[str], allowance: int) -> Tuple[List[str], int]:
+        taken, used = [], 0
+        for item in items:
+            cost = estimate_tokens(item)
+            if used + cost > allowance:
+                break
+            taken.append(item)
+            used += cost
+        return taken, used
+
+    summary_used = estimate_tokens(summary) if summary else 0
+    rendered_chunks = [f"[{title}]\n{chunk}" for title, chunk in chunks]
+    history_taken, history_used = take(turns, max(0, int(budget * HISTORY_SHARE) - summary_used))
+    notes_taken, notes_used = take(rendered_chunks, budget - summary_used - history_used)
+    if len(history_taken) < len(turns):
+        history_taken, history_used = take(turns, max(0, budget - summary_used - notes_used))
+
+    sections = []
+    if notes_taken:
+        sections.append("Relevant excerpts from the student's notes:\n" + "\n\n".join(notes_taken))
+    if summary:
+        sections.append("Summary of the earlier conversation:\n" + summary)
+    if history_taken:
+        sections.append("Previous conversation:\n" + "\n".join(reversed(history_taken)))
+    return "\n\n".join(sections), {
+        "note_chunks": len(notes_taken),
+        "history_turns": len(history_taken),
+        "summary_tokens": summary_used,
+        "tokens_used": notes_used + summary_used + history_used,
+    }
+
+
+async def build_context(db, search_service, user_id: str, session_id: str, question: str,
+                        budget: int = 1500, history_turns: int = 10) -> Tuple[str, dict]:
+    """Assemble the doubt-solver context: relevant note excerpts, the session's
+    rolling summary and the compacted turns not folded into it yet.
+
+    Returns the context text and per-request stats, including how many tokens
+    were saved compared with sending the raw history and full candidate notes.
+    """
+    summary = await load_summary(db, user_id, session_id) or {}
+    history = await db.chat_messages.find(
+        {"user_id": user_id, "session_id": session_id, **after_position(summary.get("until"))},
+        {"_id": 0, "message": 1, "response": 1}
+    ).sort([("created_at", -1), ("id", -1)]).limit(history_turns).to_list(history_turns)
+    history.reverse()
+
+    notes = []
+    if tokenize(question):
+        hits = await search_service.search(db, user_id, question, kinds=["note"], limit=CANDIDATE_NOTES)
+        if hits:
+            notes = await db.notes.find(
+                {"user_id": user_id, "id": {"$in": [hit["id"] for hit in hits]}},
+                {"_id": 0, "id": 1, "title": 1, "content": 1}
+            ).to_list(CANDIDATE_NOTES)
+
+    context, stats = pack_context(rank_note_chunks(question, notes), compact_history(history), budget,
+                                  summary.get("summary"))
+    baseline = sum(estimate_tokens(f"Q: {m['message']}\nA: {m['response']}") for m in history)
+    baseline += sum(estimate_tokens(note.get("content", "")) for note in notes)
+    stats.update({
+        "budget": budget,
+        "baseline_tokens": baseline,
+        "tokens_saved": max(0, baseline - stats["tokens_used"]),
+    })
+    return context, stats
@@ -0,0 +1,247 @@
+"""Near-duplicate detection for flashcards and quiz questions (MinHash + LSH).
+
+Run `python dedup.py --compact [--dry-run] [--threshold 0.8]` to merge the
+duplicates already stored; new items are checked on insert by DedupService.
+"""
+import asyncio
+import logging
+import os
+import re
+import sys
+import zlib
+from collections import OrderedDict
+from typing import TYPE_CHECKING, Dict, List, Optional, Set, Tuple
+
+from single_flight import SingleFlight
+from versions import bump_versions
+
+if TYPE_CHECKING:
+    import numpy as np
+
+logger = logging.getLogger(__name__)
+
+PRIME = (1 << 31) - 1
+SHINGLE_CHARS = 3
+WORD_RE = re.compile(r"[a-z0-9]+")
+
+# kind -> (collection, field that scopes duplicates)
+DEDUP_KINDS = {
+    "flashcard": ("flashcards", "note_id"),
+    "quiz": ("quiz_questions", "topic"),
+}
+
+
+def shingles(text: str, size: int = SHINGLE_CHARS) -> Set[str]:
+    """Character shingles of the normalized text; short questions need character- rather than word-level grams"""
+    normalized = " ".join(WORD_RE.findall(text.lower()))
+    if len(normalized) <= size:
+        return {normalized}
+    return {normalized[i:i + size] for i in range(len(normalized) - size + 1)}
+
+
+def lsh_params(threshold: float, num_perm: int) -> Tuple[int, int]:
+    """(bands, rows) whose LSH S-curve crosses just below `threshold`, so candidates are rarely missed"""
+    best = (num_perm, 1)
+    for rows in range(1, num_perm + 1):
+        bands = num_perm // rows
+        if (1 / bands) ** (1 / rows) <= threshold:
+            best = (bands, rows)
+    return best
+
+
+def _scope(value) -> str:
+    return str(value or "").strip().lower()
+
+
+class MinHashIndex:
+    """MinHash signatures bucketed with LSH banding.
+
+    `claim` returns the id of an already indexed item whose estimated Jaccard
+    similarity (within the same scope) is at least `threshold`, or registers the
+    new item and returns None.
+    """
+
+    def __init__(self, threshold: float = 0.8, num_perm: int = 128, seed: int = 1):
+        # numpy is imported when the first index is built, not when the app is imported
+        import numpy as np
+
+        self.threshold = threshold
+        self.num_perm = num_perm
+        self.bands, self.rows = lsh_params(threshold, num_perm)
+        rng = np.random.default_rng(seed)
+        self._a = rng.integers(1, PRIME, num_perm, dtype=np.int64)
+        self._b = rng.integers(0, PRIME, num_perm, dtype=np.int64)
+        self.buckets: Dict[Tuple[str, int, bytes], Set[str]] = {}
+        self.signatures: Dict[str, "np.ndarray"] = {}
+        self.keys: Dict[str, List[Tuple[str, int, bytes]]] = {}
+
+    def __len__(self) -> int:
+        return len(self.signatures)
+
+    def signature(self, text: str) -> "np.ndarray":
+        import numpy as np
+
+        hashes = np.fromiter((zlib.crc32(s.encode("utf-8")) for s in shingles(text)), dtype=np.int64) % PRIME
+        return ((np.outer(hashes, self._a) + self._b) % PRIME).min(axis=0).astype(np.uint32)
+
+    def _band_keys(self, scope: str, signature: "np.ndarray") -> List[Tuple[str, int, bytes]]:
+        return [(scope, band, signature[band * self.rows:(band + 1) * self.rows].tobytes())
+                for band in range(self.bands)]
+
+    def find(self, scope: str, text: str) -> Optional[str]:
+        signature = self.signature(text)
+        return self._find(self._band_keys(_scope(scope), signature), signature)[0]
+
+    def _find(self, keys, signature) -> Tuple[Optional[str], float]:
+        import numpy as np
+
+        candidates = set()
+        for key in keys:
+            candidates.update(self.buckets.get(key, ()))
+        best, best_similarity = None, self.threshold
+        for item_id in candidates:
+            similarity = float(np.mean(self.signatures[item_id] == signature))
+            if similarity >= best_similarity:
+                best, best_similarity = item_id, similarity
+        return best, best_similarity
+
+    def claim(self, item_id: str, scope: str, text: str) -> Optional[str]:
+        signature = self.signature(text)
+        keys = self._band_keys(_scope(scope), signature)
+        duplicate_id, _ = self._find(keys, signature)
+        if duplicate_id is not None and duplicate_id != item_id:
+            return duplicate_id
+        self.remove(item_id)
+        self.signatures[item_id] = signature
+        self.keys[item_id] = keys
+        for key in keys:
+            self.buckets.setdefault(key, set()).add(item_id)
+        return None
+
+    def remove(self, item_id: str):
+        if self.signatures.pop(item_id, None) is None:
+            return
+        for key in self.keys.pop(item_id):
+            bucket = self.buckets[key]
+            bucket.discard(item_id)
+            if not bucket:
+                del self.buckets[key]
+
+
+class DedupService:
+    """Per-kind, per-user MinHash indexes over saved question text, read from Mongo
+    on the user's first write of that kind and then kept up to date in-process
+    (like the local search index). At most `max_users` indexes are kept per kind,
+    least recently used dropped first."""
+
+    def __init__(self, threshold: float = 0.8, num_perm: int = 128, enabled: bool = True, max_users: int = 1000):
+        self.enabled = enabled
+        self.threshold = threshold
+        self.num_perm = num_perm
+        self.max_users = max_users
+        self.indexes: Dict[str, "OrderedDict[str, MinHashIndex]"] = {kind: OrderedDict() for kind in DEDUP_KINDS}
+        self.inflight = SingleFlight()
+
+    async def index_of(self, db, kind: str, user_id: str) -> MinHashIndex:
+        index = self.indexes[kind].get(user_id)
+        if index is not None:
+            self.indexes[kind].move_to_end(user_id)
+        else:
+            index = await self.inflight.do(f"{kind}:{user_id}", lambda: self._load_user(db, kind, user_id))
+        return index
+
+    async def _load_user(self, db, kind: str, user_id: str, batch_size: int = 1000) -> MinHashIndex:
+        collection, scope_field = DEDUP_KINDS[kind]
+        index = MinHashIndex(self.threshold, self.num_perm)
+        # Oldest first, so an existing duplicate pair keeps resolving to the original
+        cursor = db[collection].find({"user_id": user_id}, {"_id": 0, "id": 1, "question": 1, scope_field: 1})
+        async for doc in cursor.sort("created_at", 1).batch_size(batch_size):
+            index.claim(doc["id"], doc.get(scope_field), doc.get("question", ""))
+        self.indexes[kind][user_id] = index
+        while len(self.indexes[kind]) > self.max_users:
+            self.indexes[kind].popitem(last=False)
+        return index
+
+    async def claim(self, db, kind: str, doc: dict) -> Optional[str]:
+        """Id of a near-duplicate of `doc` saved by the same user, or None after registering `doc` as new"""
+        if not self.enabled:
+            return None
+        index = await self.index_of(db, kind, doc["user_id"])
+        return index.claim(doc["id"], doc.get(DEDUP_KINDS[kind][1]), doc.get("question", ""))
+
+    def remove(self, kind: str, user_id: str, item_id: str):
+        if user_id in self.indexes[kind]:
+            self.indexes[kind][user_id].remove(item_id)
+
+
+def _keep_first(kind: str):
+    # Sort key: the copy listed first survives a merge
+    if kind == "flashcard":
+        return lambda doc: (-(doc.get("repetitions", 0) + doc.get("lapses", 0)), str(doc.get("created_at")), doc["id"])
+    return lambda doc: (str(doc.get("created_at")), doc["id"])
+
+
+async def compact_duplicates(db, kind: str, threshold: float = 0.8, num_perm: int = 128,
+                             dry_run: bool = False, user_id: Optional[str] = None) -> dict:
+    """Merge stored near-duplicates of `kind` within each user's items, keeping one copy per cluster.
+
+    Flashcards keep the copy with the most review history (then the oldest), so
+    no scheduling progress is lost; quiz questions keep the oldest copy. Returns
+    {duplicate id: kept id}; nothing is deleted when `dry_run` is set. Only
+    `user_id`'s items are scanned when it is given. The collection version of
+    every user who lost items is bumped.
+    """
+    collection, scope_field = DEDUP_KINDS[kind]
+    owner = {"user_id": user_id} if user_id else {}
+    docs = await db[collection].find(
+        owner, {"_id": 0, "id": 1, "user_id": 1, "question": 1, scope_field: 1, "created_at": 1, "repetitions": 1,
+             "lapses": 1}
+    ).to_list(None)
+    docs.sort(key=_keep_first(kind))
+
+    indexes: Dict[str, MinHashIndex] = {}
+    merged, owners = {}, set()
+    for doc in docs:
+        index = indexes.get(doc["user_id"])
+        if index is None:
+            index = indexes[doc["user_id"]] = MinHashIndex(threshold, num_perm)
+        kept = index.claim(doc["id"], doc.get(scope_field), doc.get("question", ""))
+        if kept is not None:
+            merged[doc["id"]] = kept
+            owners.add(doc["user_id"])
+
+    if merged and not dry_run:
+        ids = list(merged)
+        for start in range(0, len(ids), 1000):
+            await db[collection].delete_many({**owner, "id": {"$in": ids[start:start + 1000]}})
+        for affected in sorted(owners):
+            await bump_versions(db, affected, collection)
+    logger.info("%s: %d scanned, %d duplicates%s", collection, len(docs), len(merged), " (dry run)" if dry_run else "")
+    return merged
+
+
+async def _main(argv: List[str]) -> int:
+    from dotenv import load_dotenv
+    from motor.motor_asyncio import AsyncIOMotorClient
+    from pathlib import Path
+
+    if "--compact" not in argv:
+        print(__doc__)
+        return 2
+    threshold = float(argv[argv.index("--threshold") + 1]) if "--threshold" in argv else \
+        float(os.environ.get("DEDUP_THRESHOLD", "0.8"))
+    load_dotenv(Path(__file__).parent / '.env')
+    client = AsyncIOMotorClient(os.environ['MONGO_URL'])
+    db = client[os.environ['DB_NAME']]
+    try:
+        for kind in DEDUP_KINDS:
+            merged = await compact_duplicates(db, kind, threshold, dry_run="--dry-run" in argv)
+            print(f"{kind:10} {len(merged)} duplicates {'found' if '--dry-run' in argv else 'removed'}")
+        return 0
+    finally:
+        client.close()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    sys.exit(asyncio.run(_main(sys.argv[1:])))
@@ -0,0 +1,141 @@
+import asyncio
+import time
+import uuid
+from collections import OrderedDict, deque
+from datetime import datetime, timezone
+from typing import List, Optional, Tuple
+
+from fastapi import HTTPException
+
+from migrations import datetime_migration
+from pagination import decode_cursor, encode_cursor
+
+QUEUE_SORT = [("priority", -1), ("next_review", 1), ("id", 1)]
+CARD_PROJECTION = {"_id": 0, "applied_reviews": 0, "review_version": 0}
+
+
+class _QueueSession:
+    def __init__(self, session_id: str, owner: Optional[str], now: datetime):
+        self.id = session_id
+        self.owner = owner
+        self.now = now  # due cut-off, fixed for the session so paging is stable
+        self.buffer = deque()
+        self.position: Optional[Tuple[int, datetime, str]] = None
+        self.handed_out = set()
+        self.exhausted = False
+        self.refill: Optional[asyncio.Task] = None
+        self.lock = asyncio.Lock()
+        self.touched = time.monotonic()
+
+
+class DueQueue:
+    """Due-card queue ordered by priority, then by how overdue each card is.
+
+    Cards are read with keyset pagination over the (priority, next_review, id)
+    index in prefetch batches, so each request costs one bounded index range
+    scan regardless of deck size. After serving a batch the session refills its
+    buffer in the background, and cards already handed out in the session are
+    never served again. Sessions live in-process and expire after `ttl` seconds;
+    an unknown session id simply starts a fresh session.
+    """
+
+    def __init__(self, prefetch: int = 100, ttl: float = 1800, max_sessions: int = 10000):
+        self.prefetch = prefetch
+        self.ttl = ttl
+        self.max_sessions = max_sessions
+        self._sessions: "OrderedDict[str, _QueueSession]" = OrderedDict()
+
+    def _session(self, session_id: Optional[str], owner: Optional[str]) -> _QueueSession:
+        now = time.monotonic()
+        while self._sessions:
+            oldest = next(iter(self._sessions.values()))
+            if now - oldest.touched < self.ttl and len(self._sessions) < self.max_sessions:
+                break
+            self._sessions.popitem(last=False)
+
+        session = self._sessions.get(session_id) if session_id else None
+        if session is not None and session.owner != owner:
+            # Another user's session id: never serve its buffered cards
+            session, session_id = None, None
+        if session is None:
+            session = _QueueSession(session_id or str(uuid.uuid4()), owner, datetime.now(timezone.utc))
+            self._sessions[session.id] = session
+        session.touched = now
+        self._sessions.move_to_end(session.id)
+        return session
+
+    async def _fetch(self, db, session: _QueueSession, due_filter: dict):
+        filters = due_filter
+        if session.position:
+            priority, next_review, card_id = session.position
+            filters = {"$and": [due_filter, {"$or": [
+                {"priority": {"$lt": priority}},
+                {"priority": priority, "next_review": {"$gt": next_review}},
+                {"priority": priority, "next_review": next_review, "id": {"$gt": card_id}},
+            ]}]}
+        cards = await db.flashcards.find(filters, CARD_PROJECTION).sort(QUEUE_SORT).limit(self.prefetch).to_list(self.prefetch)
+        if len(cards) < self.prefetch:
+            session.exhausted = True
+        if cards:
+            last = cards[-1]
+            session.position = (last.get("priority", 0), last["next_review"], last["id"])
+        session.buffer.extend(card for card in cards if card["id"] not in session.handed_out)
+
+    async def next_batch(self, db, session_id: Optional[str], size: int, due_filter_for,
+                         cursor: Optional[str] = None,
+                         owner: Optional[str] = None) -> Tuple[List[dict], str, Optional[str]]:
+        """Return up to `size` due cards, the session id and a resumable cursor.
+
+        `due_filter_for(now)` builds the Mongo filter for cards due at `now`. The
+        cursor marks the last card served; passing it back lets a worker that has
+        not seen the session (or an expired one) resume right after that card.
+        Sessions belong to `owner`, whose cards `due_filter_for` must select.
+        """
+        session = self._session(session_id, owner)
+        async with session.lock:
+            if cursor and session.position is None:
+                session.position = decode_position(cursor)
+            due_filter = due_filter_for(session.now)
+
+            if session.refill is not None:
+                try:
+                    await session.refill
+                finally:
+                    session.refill = None
+            while len(session.buffer) < size and not session.exhausted:
+                await self._fetch(db, session, due_filter)
+
+            batch = [session.buffer.popleft() for _ in range(min(size, len(session.buffer)))]
+            session.handed_out.update(card["id"] for card in batch)
+
+            # Prefetch the next batch while the client works through this one
+            if len(session.buffer) < size and not session.exhausted:
+                session.refill = asyncio.create_task(self._fetch(db, session, due_filter))
+
+        next_cursor = None
+        if batch and (session.buffer or not session.exhausted):
+            last = batch[-1]
+            next_cursor = encode_position((last.get("priority", 0), last["next_review"], last["id"]))
+        return batch, session.id, next_cursor
+
+
+async def backfill_priority(db):
+    """Give cards created before the queue existed the default priority, so keyset comparisons see a number"""
+    await db.flashcards.update_many({"priority": {"$exists": False}}, {"$set": {"priority": 0}})
+
+
+def encode_position(position: Tuple[int, datetime, str]) -> str:
+    priority, next_review, card_id = position
+    return encode_cursor(next_review, f"{priority}:{card_id}")
+
+
+def decode_position(cursor: str) -> Tuple[int, datetime, str]:
+    next_review, packed = decode_cursor(cursor)
+    try:
+        priority, card_id = packed.split(":", 1)
+        # Legacy string dates are still served (and so in cursors) until the migration completes
+        if not isinstance(next_review, datetime) and (datetime_migration.complete or not isinstance(next_review, str)):
+            raise TypeError("due cursor without a date")
+        return int(priority), next_review, card_id
+    except (ValueError, TypeError, AttributeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
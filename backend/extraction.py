@@ -0,0 +1,189 @@
+"""Local text extraction for uploaded PDF / DOCX / TXT files.
+
+Parsing runs in a process pool so large documents never block the event loop;
+PDF pages are split into ranges and extracted in parallel.
+"""
+import asyncio
+import hashlib
+import io
+import json
+import math
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from pathlib import PurePath
+from typing import BinaryIO, Iterable, List, Optional, Tuple
+
+from fastapi import HTTPException
+
+READ_CHUNK_BYTES = 1024 * 1024
+MIN_PAGES_PER_TASK = 8
+MAX_EXTRACTED_CHARS = 4_000_000  # keeps a cached extraction well below Mongo's 16MB document limit
+
+MIME_TYPES = {
+    ".pdf": "application/pdf",
+    ".docx": "application/vnd.openxmlformats-officedocument.wordprocessingml.document",
+    ".txt": "text/plain",
+    ".md": "text/markdown",
+}
+
+
+def file_kind(filename: str, content_type: Optional[str]) -> str:
+    """'pdf', 'docx' or 'text', from the extension first and the declared content type second"""
+    suffix = PurePath(filename or "").suffix.lower()
+    mime = MIME_TYPES.get(suffix) or content_type or "text/plain"
+    if mime == MIME_TYPES[".pdf"]:
+        return "pdf"
+    if mime == MIME_TYPES[".docx"]:
+        return "docx"
+    if mime.startswith("text/"):
+        return "text"
+    raise HTTPException(status_code=415, detail="Only PDF, DOCX and plain-text files can be analyzed")
+
+
+def hash_upload(file: BinaryIO, max_bytes: int) -> Tuple[str, int]:
+    """sha256 and size of an upload, read in chunks; rejects files over `max_bytes`"""
+    digest = hashlib.sha256()
+    size = 0
+    file.seek(0)
+    while True:
+        chunk = file.read(READ_CHUNK_BYTES)
+        if not chunk:
+            break
+        size += len(chunk)
+        if size > max_bytes:
+            raise HTTPException(status_code=413, detail=f"File exceeds the {max_bytes // (1024 * 1024)}MB upload limit")
+        digest.update(chunk)
+    file.seek(0)
+    return digest.hexdigest(), size
+
+
+class UploadLimitMiddleware:
+    """ASGI middleware capping request bodies on upload routes at `max_bytes`.
+
+    A declared Content-Length over the limit is rejected before anything is
+    read; chunked bodies are counted as they arrive and cut off with a 413 as
+    soon as they pass it, so an oversized upload is never spooled in full.
+    """
+
+    def __init__(self, app, paths: Iterable[str], max_bytes: int):
+        self.app = app
+        self.paths = set(paths)
+        self.max_bytes = max_bytes
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] not in self.paths:
+            await self.app(scope, receive, send)
+            return
+
+        declared = dict(scope["headers"]).get(b"content-length")
+        if declared is not None:
+            try:
+                length = int(declared)
+            except ValueError:
+                length = -1
+            if length < 0:
+                await self._reject(send, 400, "Invalid Content-Length header")
+                return
+            if length > self.max_bytes:
+                await self._reject(send, 413, "File exceeds the upload limit")
+                return
+
+        received = 0
+
+        async def receive_limited():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > self.max_bytes:
+                    # Raised into the body parser; FastAPI turns it into the response
+                    raise HTTPException(status_code=413, detail="File exceeds the upload limit")
+            return message
+
+        await self.app(scope, receive_limited, send)
+
+    @staticmethod
+    async def _reject(send, status: int, detail: str):
+        body = json.dumps({"detail": detail}).encode("utf-8")
+        await send({"type": "http.response.start", "status": status,
+                    "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())]})
+        await send({"type": "http.response.body", "body": body})
+
+
+# Worker functions; run in the process pool
+def _preload():
+    import docx  # noqa: F401
+    import pypdf  # noqa: F401
+
+
+def _pdf_page_count(data: bytes) -> int:
+    from pypdf import PdfReader
+    return len(PdfReader(io.BytesIO(data)).pages)
+
+
+def _pdf_pages_text(data: bytes, start: int, stop: int) -> List[str]:
+    from pypdf import PdfReader
+    reader = PdfReader(io.BytesIO(data))
+    return [reader.pages[i].extract_text() or "" for i in range(start, stop)]
+
+
+def _docx_text(data: bytes) -> str:
+    from docx import Document
+    document = Document(io.BytesIO(data))
+    parts = [paragraph.text for paragraph in document.paragraphs if paragraph.text.strip()]
+    for table in document.tables:
+        for row in table.rows:
+            cells = [cell.text.strip() for cell in row.cells if cell.text.strip()]
+            if cells:
+                parts.append(" | ".join(cells))
+    return "\n".join(parts)
+
+
+class TextExtractor:
+    """Extracts text from uploads in a lazily started process pool"""
+
+    def __init__(self, max_workers: int = 2):
+        self.max_workers = max_workers
+        self._pool: Optional[ProcessPoolExecutor] = None
+
+    @property
+    def pool(self) -> ProcessPoolExecutor:
+        if self._pool is None:
+            # spawn: forking a process that runs the event loop and Mongo driver threads is unsafe
+            self._pool = ProcessPoolExecutor(self.max_workers, mp_context=multiprocessing.get_context("spawn"))
+        return self._pool
+
+    def shutdown(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+    async def warmup(self):
+        """Start the workers and import the parsers ahead of the first upload"""
+        loop = asyncio.get_running_loop()
+        await asyncio.gather(*(loop.run_in_executor(self.pool, _preload) for _ in range(self.max_workers)))
+
+    async def extract(self, kind: str, data: bytes) -> Tuple[str, int]:
+        """Return (text, page count); DOCX and text files count as one page"""
+        loop = asyncio.get_running_loop()
+        try:
+            if kind == "pdf":
+                pages = await loop.run_in_executor(self.pool, _pdf_page_count, data)
+                per_task = max(MIN_PAGES_PER_TASK, math.ceil(pages / self.max_workers))
+                ranges = await asyncio.gather(*(
+                    loop.run_in_executor(self.pool, _pdf_pages_text, data, start, min(pages, start + per_task))
+                    for start in range(0, pages, per_task)
+                ))
+                text = "\n\n".join(page for chunk in ranges for page in chunk if page.strip())
+            elif kind == "docx":
+                pages, text = 1, await loop.run_in_executor(self.pool, _docx_text, data)
+            else:
+                pages, text = 1, data.decode("utf-8", errors="replace")
+        except BrokenProcessPool:
+            # A worker died (e.g. out of memory); start a fresh pool for the next request
+            self._pool = None
+            raise
+        except Exception as exc:
+            raise HTTPException(status_code=422, detail=f"Could not read the {kind.upper()} file: {exc}") from exc
+        return text[:MAX_EXTRACTED_CHARS], pages
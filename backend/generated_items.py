@@ -0,0 +1,155 @@
+import json
+import re
+from typing import List, Optional
+
+TRAILING_COMMA_RE = re.compile(r",\s*([}\]])")
+FENCE_RE = re.compile(r"^\s*```[a-zA-Z]*\s*|\s*```\s*$")
+OPTION_LETTER_RE = re.compile(r"^\(?([A-Fa-f])[).:]?(\s|$)")
+
+
+def _loads(text: str):
+    try:
+        return json.loads(text)
+    except ValueError:
+        pass
+    try:
+        return json.loads(TRAILING_COMMA_RE.sub(r"\1", text))
+    except ValueError:
+        return None
+
+
+class ItemStreamParser:
+    """Incrementally extract the objects of a JSON array from LLM output.
+
+    Tolerates markdown fences and prose around the array, a wrapping object such
+    as {"flashcards": [...]}, trailing commas and output cut off mid-item: every
+    complete item is returned as soon as its closing brace arrives, and an
+    unfinished trailing item is counted in `rejected` by close().
+    """
+
+    def __init__(self):
+        self.rejected = 0
+        self.emitted = 0
+        self._stack: List[str] = []
+        self._in_string = False
+        self._escape = False
+        self._item: Optional[List[str]] = None
+        self._item_depth = 0
+        self._text: List[str] = []
+
+    def feed(self, chunk: str) -> List[dict]:
+        self._text.append(chunk)
+        items = []
+        for ch in chunk:
+            if self._item is not None:
+                self._item.append(ch)
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif ch == "\\":
+                    self._escape = True
+                elif ch == '"':
+                    self._in_string = False
+            elif ch == '"':
+                # Quotes in prose outside any JSON container are not strings
+                self._in_string = bool(self._stack)
+            elif ch in "{[":
+                if ch == "{" and self._item is None and self._stack and self._stack[-1] == "[" \
+                        and "[" not in self._stack[:-1]:
+                    self._item = [ch]
+                    self._item_depth = len(self._stack)
+                self._stack.append(ch)
+            elif ch in "}]" and self._stack:
+                self._stack.pop()
+                if self._item is not None and len(self._stack) == self._item_depth:
+                    item = _loads("".join(self._item))
+                    self._item = None
+                    if isinstance(item, dict):
+                        items.append(item)
+                    else:
+                        self.rejected += 1
+        self.emitted += len(items)
+        return items
+
+    def close(self) -> List[dict]:
+        """Finish the stream; returns a lone top-level object when no array was found"""
+        if self._item is not None:
+            self.rejected += 1
+            self._item = None
+        if self.emitted:
+            return []
+        whole = _loads(FENCE_RE.sub("", "".join(self._text)).strip())
+        if isinstance(whole, dict):
+            nested = next((v for v in whole.values() if isinstance(v, list) and v
+                           and all(isinstance(item, dict) for item in v)), None)
+            items = nested or [whole]
+            self.emitted += len(items)
+            return items
+        return []
+
+
+def parse_items(text: str) -> List[dict]:
+    parser = ItemStreamParser()
+    return parser.feed(text) + parser.close()
+
+
+def _normalize_keys(item: dict) -> dict:
+    return {re.sub(r"[^a-z]", "", str(key).lower()): value for key, value in item.items()}
+
+
+def _text(item: dict, *keys: str) -> Optional[str]:
+    for key in keys:
+        value = item.get(key)
+        if isinstance(value, (str, int, float)) and not isinstance(value, bool) and str(value).strip():
+            return str(value).strip()
+    return None
+
+
+def flashcard_fields(item: dict) -> Optional[dict]:
+    """question/answer of a generated flashcard, or None if it is unusable"""
+    item = _normalize_keys(item)
+    question = _text(item, "question", "front", "q", "term", "prompt")
+    answer = _text(item, "answer", "back", "a", "definition", "explanation")
+    if not question or not answer:
+        return None
+    return {"question": question, "answer": answer}
+
+
+def _correct_index(value, options: List[str]) -> Optional[int]:
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, int):
+        return value if 0 <= value < len(options) else None
+    if not isinstance(value, str) or not value.strip():
+        return None
+    value = value.strip()
+    if value.isdigit():
+        return _correct_index(int(value), options)
+    lowered = [option.lower() for option in options]
+    if value.lower() in lowered:
+        return lowered.index(value.lower())
+    match = OPTION_LETTER_RE.match(value)
+    if match:
+        index = ord(match.group(1).upper()) - ord("A")
+        return index if index < len(options) else None
+    return None
+
+
+def quiz_fields(item: dict) -> Optional[dict]:
+    """question/options/correct_answer of a generated quiz question, or None if it is unusable"""
+    item = _normalize_keys(item)
+    question = _text(item, "question", "prompt", "q")
+    options = item.get("options") or item.get("choices")
+    if isinstance(options, dict):
+        options = [options[key] for key in sorted(options)]
+    if not question or not isinstance(options, list):
+        return None
+    options = [str(option).strip() for option in options if str(option).strip()]
+    if len(options) < 2:
+        return None
+    for key in ("correctanswer", "correctindex", "correctoption", "answerindex", "correct", "answer"):
+        if key in item:
+            correct = _correct_index(item[key], options)
+            if correct is not None:
+                return {"question": question, "options": options, "correct_answer": correct}
+    return None
@@ -0,0 +1,190 @@
+"""Declarative Mongo index registry, applied on app startup.
+
+Run `python indexes.py --check` to create the indexes and then explain() every
+hot query, flagging any that still fall back to a collection scan.
+"""
+import asyncio
+import logging
+import os
+import sys
+from datetime import datetime, timezone
+from typing import Dict, List
+
+from pymongo import ASCENDING, DESCENDING, TEXT, IndexModel
+from pymongo.errors import OperationFailure
+
+logger = logging.getLogger(__name__)
+
+
+def _by_id() -> IndexModel:
+    # user_id leads every index on user-owned collections: it is the shard key (see tenancy.py)
+    return IndexModel([("user_id", ASCENDING), ("id", ASCENDING)], name="user_id_unique", unique=True)
+
+
+def _by_created() -> IndexModel:
+    # Keyset pagination order for list endpoints (see pagination.py)
+    return IndexModel([("user_id", ASCENDING), ("created_at", ASCENDING), ("id", ASCENDING)], name="user_created_at_id")
+
+
+INDEXES: Dict[str, List[IndexModel]] = {
+    "notes": [
+        _by_id(),
+        _by_created(),
+        # Used by SEARCH_BACKEND=mongo; weights mirror search.NOTE_FIELDS
+        IndexModel(
+            [("user_id", ASCENDING), ("title", TEXT), ("subject", TEXT), ("content", TEXT), ("ai_summary", TEXT)],
+            name="user_search_text",
+            weights={"title": 3, "subject": 2, "content": 1, "ai_summary": 1},
+        ),
+    ],
+    "flashcards": [
+        _by_id(),
+        _by_created(),
+        # Due queue order: priority, then most overdue first (see due_queue.py)
+        IndexModel([("user_id", ASCENDING), ("priority", DESCENDING), ("next_review", ASCENDING), ("id", ASCENDING)],
+                   name="user_due_queue"),
+        IndexModel([("user_id", ASCENDING), ("question", TEXT), ("answer", TEXT)], name="user_search_text",
+                   weights={"question": 2, "answer": 1}),
+    ],
+    "tasks": [_by_id(), _by_created()],
+    "quiz_questions": [
+        _by_id(),
+        _by_created(),
+        IndexModel([("user_id", ASCENDING), ("question", TEXT), ("topic", TEXT), ("options", TEXT)],
+                   name="user_search_text", weights={"question": 2, "topic": 2, "options": 1}),
+    ],
+    "study_sessions": [
+        _by_id(),
+        _by_created(),
+        # Finds sessions missing from the rollups (see analytics.backfill_rollups)
+        IndexModel([("rolled_up", ASCENDING)], name="rolled_up"),
+    ],
+    "study_rollups": [
+        IndexModel([("user_id", ASCENDING), ("period", ASCENDING), ("start", ASCENDING), ("subject", ASCENDING)],
+                   name="user_period_start_subject", unique=True),
+    ],
+    "user_progress": [
+        IndexModel([("user_id", ASCENDING)], name="user_id_unique", unique=True),
+    ],
+    "chat_messages": [
+        _by_id(),
+        # History pages and the turns after a session's summary (see chat_compaction.py)
+        IndexModel([("user_id", ASCENDING), ("session_id", ASCENDING), ("created_at", ASCENDING), ("id", ASCENDING)],
+                   name="user_session_created_at_id"),
+    ],
+    "chat_summaries": [
+        IndexModel([("user_id", ASCENDING), ("session_id", ASCENDING)], name="user_session_unique", unique=True),
+    ],
+    "collection_versions": [
+        IndexModel([("user_id", ASCENDING), ("collection", ASCENDING)], name="user_collection_unique", unique=True),
+    ],
+    "llm_cache": [
+        IndexModel([("expires_at", ASCENDING)], name="expires_at_ttl", expireAfterSeconds=0),
+    ],
+    # The job queue is shared by all users; user-facing lookups also match user_id
+    "jobs": [
+        IndexModel([("id", ASCENDING)], name="id_unique", unique=True),
+        # Claim order (see jobs.py)
+        IndexModel([("status", ASCENDING), ("priority", DESCENDING), ("created_at", ASCENDING)], name="claim_order"),
+        # One live or succeeded job per input hash
+        IndexModel([("dedup_key", ASCENDING)], name="dedup_key_unique", unique=True, sparse=True),
+        IndexModel([("expires_at", ASCENDING)], name="expires_at_ttl", expireAfterSeconds=0),
+    ],
+    "extraction_cache": [
+        IndexModel([("expires_at", ASCENDING)], name="expires_at_ttl", expireAfterSeconds=0),
+    ],
+}
+
+
+def hot_queries() -> List[dict]:
+    """The access paths the API relies on; each must be served by an index"""
+    now = datetime.now(timezone.utc)
+    user = {"user_id": "x"}
+    return [
+        {"name": "note by id", "collection": "notes", "filter": {**user, "id": "x"}},
+        {"name": "flashcard by id", "collection": "flashcards", "filter": {**user, "id": "x"}},
+        {"name": "task by id", "collection": "tasks", "filter": {**user, "id": "x"}},
+        {"name": "notes page", "collection": "notes", "filter": user, "sort": [("created_at", 1), ("id", 1)]},
+        {"name": "flashcards page", "collection": "flashcards", "filter": user, "sort": [("created_at", 1), ("id", 1)]},
+        {"name": "due flashcards", "collection": "flashcards", "filter": {**user, "next_review": {"$lte": now}},
+         "sort": [("priority", -1), ("next_review", 1), ("id", 1)]},
+        {"name": "note search", "collection": "notes", "filter": {**user, "$text": {"$search": "x"}}},
+        {"name": "job claim", "collection": "jobs", "filter": {"status": "queued", "run_after": {"$lte": now}},
+         "sort": [("priority", -1), ("created_at", 1)]},
+        {"name": "study rollups", "collection": "study_rollups",
+         "filter": {**user, "period": "day", "start": {"$gte": "x"}}},
+        {"name": "progress", "collection": "user_progress", "filter": user},
+        {"name": "chat history", "collection": "chat_messages", "filter": {**user, "session_id": "x"},
+         "sort": [("created_at", -1), ("id", -1)]},
+        {"name": "collection versions", "collection": "collection_versions",
+         "filter": {**user, "collection": {"$in": ["notes"]}}},
+        {"name": "chat summary", "collection": "chat_summaries", "filter": {**user, "session_id": "x"}},
+    ]
+
+
+async def ensure_indexes(db):
+    """Create every registered index; a conflicting index is logged rather than fatal"""
+    for collection, models in INDEXES.items():
+        try:
+            await db[collection].create_indexes(models)
+        except OperationFailure as exc:
+            logger.error("Could not create indexes on %s: %s", collection, exc)
+
+
+def _plan_stages(plan: dict) -> List[str]:
+    stages = []
+    if "stage" in plan:
+        stages.append(plan["stage"])
+    for key in ("inputStage", "queryPlan"):
+        if key in plan:
+            stages.extend(_plan_stages(plan[key]))
+    for child in plan.get("inputStages", []):
+        stages.extend(_plan_stages(child))
+    return stages
+
+
+async def check_query_plans(db) -> List[dict]:
+    """explain() each hot query and report its plan stages, flagging COLLSCANs"""
+    report = []
+    for query in hot_queries():
+        cursor = db[query["collection"]].find(query["filter"])
+        if query.get("sort"):
+            cursor = cursor.sort(query["sort"])
+        explain = await cursor.explain()
+        stages = _plan_stages(explain.get("queryPlanner", {}).get("winningPlan", {}))
+        collscan = "COLLSCAN" in stages
+        if collscan:
+            logger.warning("Hot query '%s' on %s does a COLLSCAN", query["name"], query["collection"])
+        report.append({
+            "name": query["name"],
+            "collection": query["collection"],
+            "stages": stages,
+            "collscan": collscan,
+        })
+    return report
+
+
+async def _main(check: bool) -> int:
+    from dotenv import load_dotenv
+    from motor.motor_asyncio import AsyncIOMotorClient
+    from pathlib import Path
+
+    load_dotenv(Path(__file__).parent / '.env')
+    client = AsyncIOMotorClient(os.environ['MONGO_URL'])
+    db = client[os.environ['DB_NAME']]
+    try:
+        await ensure_indexes(db)
+        if not check:
+            return 0
+        report = await check_query_plans(db)
+        for entry in report:
+            status = "COLLSCAN" if entry["collscan"] else "ok"
+            print(f"{status:9} {entry['collection']:15} {entry['name']:20} {' > '.join(entry['stages'])}")
+        return 1 if any(entry["collscan"] for entry in report) else 0
+    finally:
+        client.close()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    sys.exit(asyncio.run(_main("--check" in sys.argv)))
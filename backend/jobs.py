@@ -0,0 +1,288 @@
+"""Mongo-backed background job queue for long-running AI operations.
+
+Jobs live in the `jobs` collection, so any API worker can submit, poll or
+cancel them and no outside broker is needed. Each process runs a small pool of
+async workers that claim queued jobs atomically (highest priority first) and
+hold a renewable lease while running; jobs whose lease lapses, e.g. because
+their process died, are put back in the queue.
+"""
+import asyncio
+import hashlib
+import json
+import logging
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+logger = logging.getLogger(__name__)
+
+QUEUED, RUNNING, SUCCEEDED, FAILED, CANCELLED = "queued", "running", "succeeded", "failed", "cancelled"
+JOB_PROJECTION = {"_id": 0, "dedup_key": 0, "lease_until": 0, "worker": 0}
+
+
+def _public(job: Optional[dict]) -> Optional[dict]:
+    if job is not None:
+        for field in ("_id", "dedup_key", "lease_until", "worker"):
+            job.pop(field, None)
+    return job
+
+
+class JobNotFound(Exception):
+    pass
+
+
+def input_hash(kind: str, params: dict, user_id: Optional[str] = None) -> str:
+    raw = json.dumps([kind, user_id, params], sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class JobQueue:
+    """Priority job queue with cancellation, retries with backoff and result dedup.
+
+    Submitting a job whose (kind, user, params) hash matches a queued, running
+    or succeeded job returns that job instead of creating a new one. Handlers are
+    called with the job's params and the id of the user who submitted it; the
+    user-facing methods only see that user's jobs.
+    """
+
+    def __init__(self, collection, workers: int = 4, max_attempts: int = 3, lease_seconds: float = 60,
+                 poll_interval: float = 1.0, retry_base_seconds: float = 2.0, result_ttl_seconds: int = 7 * 24 * 3600,
+                 is_retryable: Callable[[Exception], bool] = lambda exc: True):
+        self.collection = collection
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self.lease_seconds = lease_seconds
+        self.poll_interval = poll_interval
+        self.retry_base_seconds = retry_base_seconds
+        self.result_ttl_seconds = result_ttl_seconds
+        self.is_retryable = is_retryable
+        self.handlers: Dict[str, Callable[[dict, Optional[str]], Awaitable[Any]]] = {}
+        self.worker_id = uuid.uuid4().hex[:12]
+        self._wakeup = asyncio.Event()
+        self._tasks: List[asyncio.Task] = []
+        self._running: Dict[str, asyncio.Task] = {}
+        self._stopping = False
+
+    def register(self, kind: str, handler: Callable[[dict, Optional[str]], Awaitable[Any]]):
+        self.handlers[kind] = handler
+
+    async def submit(self, kind: str, params: dict, priority: int = 0, dedup: bool = True,
+                     user_id: Optional[str] = None) -> dict:
+        if kind not in self.handlers:
+            raise ValueError(f"Unknown job kind: {kind}")
+        now = datetime.now(timezone.utc)
+        job = {
+            "id": str(uuid.uuid4()),
+            "user_id": user_id,
+            "kind": kind,
+            "params": params,
+            "input_hash": input_hash(kind, params, user_id),
+            "priority": priority,
+            "status": QUEUED,
+            "attempts": 0,
+            "max_attempts": self.max_attempts,
+            "result": None,
+            "error": None,
+            "cancel_requested": False,
+            "run_after": now,
+            "created_at": now,
+            "updated_at": now,
+        }
+        if dedup:
+            # Unique while the job is live or succeeded; unset when it fails or is cancelled
+            job["dedup_key"] = job["input_hash"]
+        try:
+            await self.collection.insert_one(job)
+        except DuplicateKeyError:
+            existing = await self.collection.find_one({"dedup_key": job["input_hash"]}, JOB_PROJECTION)
+            if existing is not None:
+                return {**existing, "deduplicated": True}
+            return await self.submit(kind, params, priority, dedup, user_id)
+        self._wakeup.set()
+        job.pop("_id", None)
+        job.pop("dedup_key", None)
+        return {**job, "deduplicated": False}
+
+    @staticmethod
+    def _owned(job_id: str, user_id: Optional[str], **extra) -> dict:
+        return {"id": job_id, **({"user_id": user_id} if user_id is not None else {}), **extra}
+
+    async def get(self, job_id: str, user_id: Optional[str] = None) -> dict:
+        job = await self.collection.find_one(self._owned(job_id, user_id), JOB_PROJECTION)
+        if job is None:
+            raise JobNotFound(job_id)
+        return job
+
+    async def cancel(self, job_id: str, user_id: Optional[str] = None) -> dict:
+        now = datetime.now(timezone.utc)
+        job = await self.collection.find_one_and_update(
+            self._owned(job_id, user_id, status=QUEUED),
+            {"$set": self._finished(CANCELLED, now), "$unset": {"dedup_key": ""}},
+            return_document=ReturnDocument.AFTER,
+        )
+        if job is not None:
+            return _public(job)
+        job = await self.collection.find_one_and_update(
+            self._owned(job_id, user_id, status=RUNNING),
+            {"$set": {"cancel_requested": True, "updated_at": now}},
+            return_document=ReturnDocument.AFTER,
+        )
+        if job is not None:
+            # Running here: stop it now; otherwise its worker sees the flag when renewing its lease
+            task = self._running.get(job_id)
+            if task is not None:
+                task.cancel()
+            return _public(job)
+        return await self.get(job_id, user_id)
+
+    async def retry(self, job_id: str, user_id: Optional[str] = None) -> dict:
+        """Requeue a failed or cancelled job with a fresh attempt budget"""
+        job = await self.get(job_id, user_id)
+        if job["status"] not in (FAILED, CANCELLED):
+            return job
+        now = datetime.now(timezone.utc)
+        try:
+            job = await self.collection.find_one_and_update(
+                {"id": job_id, "status": {"$in": [FAILED, CANCELLED]}},
+                {"$set": {"status": QUEUED, "attempts": 0, "error": None, "cancel_requested": False,
+                          "run_after": now, "updated_at": now, "dedup_key": job["input_hash"]},
+                 "$unset": {"finished_at": "", "expires_at": ""}},
+                return_document=ReturnDocument.AFTER,
+            )
+        except DuplicateKeyError:
+            # An identical job has been submitted since; that one stands in for the retry
+            return await self.collection.find_one({"dedup_key": job["input_hash"]}, JOB_PROJECTION)
+        self._wakeup.set()
+        return _public(job) or await self.get(job_id, user_id)
+
+    def start(self):
+        if self._tasks:
+            return
+        self._stopping = False
+        self._tasks = [asyncio.create_task(self._worker(i)) for i in range(self.workers)]
+        self._tasks.append(asyncio.create_task(self._reaper()))
+
+    async def stop(self):
+        self._stopping = True
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def _finished(self, status: str, now: datetime) -> dict:
+        return {"status": status, "finished_at": now, "updated_at": now,
+                "expires_at": now + timedelta(seconds=self.result_ttl_seconds)}
+
+    async def _claim(self) -> Optional[dict]:
+        now = datetime.now(timezone.utc)
+        return await self.collection.find_one_and_update(
+            {"status": QUEUED, "run_after": {"$lte": now}},
+            {"$set": {"status": RUNNING, "worker": self.worker_id, "started_at": now, "updated_at": now,
+                      "lease_until": now + timedelta(seconds=self.lease_seconds)},
+             "$inc": {"attempts": 1}},
+            sort=[("priority", -1), ("created_at", 1)],
+            return_document=ReturnDocument.AFTER,
+        )
+
+    async def _worker(self, index: int):
+        while True:
+            try:
+                job = await self._claim()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Job worker %d could not claim a job", index)
+                job = None
+            if job is None:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            try:
+                await self._run(job)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                # e.g. Mongo unavailable while settling; the lease reaper requeues the job
+                logger.exception("Job worker %d failed while running job %s", index, job["id"])
+
+    async def _run(self, job: dict):
+        job_id = job["id"]
+        if job["attempts"] > job["max_attempts"]:
+            # Its lease kept lapsing, e.g. the job crashes the process that runs it
+            await self._settle(job_id, {"$set": {**self._finished(FAILED, datetime.now(timezone.utc)),
+                                                 "error": "Worker lost the job too many times"},
+                                        "$unset": {"dedup_key": ""}})
+            return
+        task = asyncio.create_task(self.handlers[job["kind"]](job["params"], job.get("user_id")))
+        self._running[job_id] = task
+        lease = asyncio.create_task(self._renew_lease(job_id, task))
+        try:
+            result = await task
+        except asyncio.CancelledError:
+            if self._stopping:
+                # The worker itself is shutting down: hand the job back to the queue
+                task.cancel()
+                await self.collection.update_one(
+                    {"id": job_id, "status": RUNNING, "worker": self.worker_id},
+                    {"$set": {"status": QUEUED, "updated_at": datetime.now(timezone.utc)}, "$inc": {"attempts": -1}},
+                )
+                raise
+            await self._settle(job_id, {"$set": self._finished(CANCELLED, datetime.now(timezone.utc)),
+                                        "$unset": {"dedup_key": ""}})
+        except Exception as exc:
+            now = datetime.now(timezone.utc)
+            error = f"{type(exc).__name__}: {exc}"
+            if job["attempts"] < job["max_attempts"] and self.is_retryable(exc):
+                delay = self.retry_base_seconds * 2 ** (job["attempts"] - 1)
+                logger.warning("Job %s (%s) failed, retrying in %.0fs: %s", job_id, job["kind"], delay, error)
+                await self._settle(job_id, {"$set": {"status": QUEUED, "error": error, "updated_at": now,
+                                                     "run_after": now + timedelta(seconds=delay)}})
+            else:
+                logger.error("Job %s (%s) failed after %d attempts: %s", job_id, job["kind"], job["attempts"], error)
+                await self._settle(job_id, {"$set": {**self._finished(FAILED, now), "error": error},
+                                            "$unset": {"dedup_key": ""}})
+        else:
+            await self._settle(job_id, {"$set": {**self._finished(SUCCEEDED, datetime.now(timezone.utc)),
+                                                 "result": result, "error": None}})
+        finally:
+            lease.cancel()
+            self._running.pop(job_id, None)
+
+    async def _settle(self, job_id: str, update: dict):
+        # Only the worker holding the job may settle it
+        await self.collection.update_one({"id": job_id, "status": RUNNING, "worker": self.worker_id}, update)
+
+    async def _renew_lease(self, job_id: str, task: asyncio.Task):
+        while True:
+            await asyncio.sleep(self.lease_seconds / 3)
+            now = datetime.now(timezone.utc)
+            job = await self.collection.find_one_and_update(
+                {"id": job_id, "status": RUNNING, "worker": self.worker_id},
+                {"$set": {"lease_until": now + timedelta(seconds=self.lease_seconds), "updated_at": now}},
+            )
+            if job is None or job.get("cancel_requested"):
+                task.cancel()
+                return
+
+    async def _reaper(self):
+        # Requeue jobs whose worker stopped renewing its lease
+        while True:
+            await asyncio.sleep(self.lease_seconds / 2)
+            try:
+                result = await self.collection.update_many(
+                    {"status": RUNNING, "lease_until": {"$lt": datetime.now(timezone.utc)}},
+                    {"$set": {"status": QUEUED, "updated_at": datetime.now(timezone.utc)}},
+                )
+                if result.modified_count:
+                    logger.warning("Requeued %d jobs with expired leases", result.modified_count)
+                    self._wakeup.set()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Job lease reaper failed")
@@ -0,0 +1,113 @@
+import hashlib
+import json
+import time
+from collections import OrderedDict
+from datetime import datetime, timezone, timedelta
+from typing import Any, Optional
+
+
+def normalize_input(value: Any) -> Any:
+    """Normalize prompt input so cosmetic whitespace changes share a cache entry"""
+    if isinstance(value, str):
+        lines = [" ".join(line.split()) for line in value.strip().splitlines()]
+        return "\n".join(lines)
+    if isinstance(value, (list, tuple)):
+        return [normalize_input(v) for v in value]
+    if isinstance(value, dict):
+        return {k: normalize_input(v) for k, v in sorted(value.items())}
+    return value
+
+
+def make_cache_key(method: str, model: str, system_prompt: str, payload: Any) -> str:
+    """Content-addressed key: sha256 over (method, model, system prompt, normalized input)"""
+    raw = json.dumps(
+        [method, model, system_prompt, normalize_input(payload)],
+        sort_keys=True,
+        ensure_ascii=False,
+        default=str,
+    )
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class LLMCache:
+    """Two-tier LLM response cache: in-process LRU with TTL, backed by a Mongo collection.
+
+    Mongo documents look like {"_id": key, "method": ..., "value": ..., "expires_at": ...}.
+    The Mongo tier is optional; pass collection=None for a purely in-process cache.
+    """
+
+    def __init__(self, collection=None, max_entries: int = 1024, ttl_seconds: int = 24 * 3600):
+        self.collection = collection
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.persistent_hits = 0
+
+    def _get_local(self, key: str) -> Optional[str]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        value, expires_at = entry
+        if expires_at <= time.monotonic():
+            del self._entries[key]
+            self.evictions += 1
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    def _set_local(self, key: str, value: str, ttl_seconds: float):
+        self._entries[key] = (value, time.monotonic() + ttl_seconds)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    async def get(self, key: str) -> Optional[str]:
+        value = self._get_local(key)
+        if value is not None:
+            self.hits += 1
+            return value
+
+        if self.collection is not None:
+            doc = await self.collection.find_one({"_id": key}, {"value": 1, "expires_at": 1})
+            if doc:
+                expires_at = doc["expires_at"]
+                if expires_at.tzinfo is None:
+                    expires_at = expires_at.replace(tzinfo=timezone.utc)
+                remaining = (expires_at - datetime.now(timezone.utc)).total_seconds()
+                if remaining > 0:
+                    self._set_local(key, doc["value"], remaining)
+                    self.hits += 1
+                    self.persistent_hits += 1
+                    return doc["value"]
+
+        self.misses += 1
+        return None
+
+    async def set(self, key: str, value: str, method: str = "", ttl_seconds: Optional[int] = None):
+        ttl = ttl_seconds if ttl_seconds is not None else self.ttl_seconds
+        self._set_local(key, value, ttl)
+        if self.collection is not None:
+            await self.collection.update_one(
+                {"_id": key},
+                {"$set": {
+                    "method": method,
+                    "value": value,
+                    "expires_at": datetime.now(timezone.utc) + timedelta(seconds=ttl),
+                }},
+                upsert=True,
+            )
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "persistent_hits": self.persistent_hits,
+            "evictions": self.evictions,
+            "entries": len(self._entries),
+            "hit_rate": (self.hits / lookups) if lookups else 0.0,
+        }
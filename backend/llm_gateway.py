@@ -0,0 +1,433 @@
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import random
+import re
+import time
+from abc import ABC, abstractmethod
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Dict, List, Optional, Tuple
+
+from metrics import (LLM_ERRORS, LLM_IN_FLIGHT, LLM_LATENCY, LLM_PROMPT_CHARS, LLM_RESPONSE_CHARS, LLM_RETRIES,
+                     record_span)
+
+logger = logging.getLogger(__name__)
+
+MODEL_PROVIDER = "gemini"
+MODEL_NAME = "gemini-2.0-flash"
+
+RETRYABLE_STATUS_CODES = {408, 429, 500, 502, 503, 504}
+
+
+class LLMGatewayError(Exception):
+    """Raised when an upstream LLM call fails after retries or runs past its deadline"""
+
+
+class LLMBackend(ABC):
+    """Interface every LLM provider implements.
+
+    `files` is a list of (file_path, mime_type) tuples attached to the prompt.
+    """
+
+    model = "base"
+    streaming = False  # whether stream() yields output as it is generated
+
+    @abstractmethod
+    async def complete(self, system_message: str, prompt: str, session_id: str,
+                       files: Optional[List[Tuple[str, str]]] = None) -> str:
+        ...
+
+    async def stream(self, system_message: str, prompt: str, session_id: str,
+                     files: Optional[List[Tuple[str, str]]] = None) -> AsyncIterator[str]:
+        """Yield the response incrementally; providers without streaming yield it in one piece"""
+        yield await self.complete(system_message, prompt, session_id, files)
+
+
+class GeminiBackend(LLMBackend):
+    """Gemini via emergentintegrations' LlmChat.
+
+    LlmChat only returns whole responses, so streams go through the google-genai
+    SDK when GEMINI_API_KEY is set; without it (or with attached files) a stream
+    is the full completion in one piece.
+    """
+
+    model = f"{MODEL_PROVIDER}/{MODEL_NAME}"
+
+    def __init__(self, api_key: Optional[str] = None, gemini_api_key: Optional[str] = None):
+        self.api_key = api_key or os.environ.get('EMERGENT_LLM_KEY')
+        if not self.api_key:
+            raise ValueError("EMERGENT_LLM_KEY not found in environment")
+        self.gemini_api_key = gemini_api_key or os.environ.get('GEMINI_API_KEY')
+        self.streaming = bool(self.gemini_api_key)
+        self._client = None
+        if not self.streaming:
+            logger.warning("GEMINI_API_KEY is not set: streamed AI responses will arrive in one piece "
+                           "after the whole answer is generated")
+
+    async def complete(self, system_message: str, prompt: str, session_id: str,
+                       files: Optional[List[Tuple[str, str]]] = None) -> str:
+        # Imported on first use: the SDK is slow to import and unused with the fake backend
+        from emergentintegrations.llm.chat import FileContentWithMimeType, LlmChat, UserMessage
+
+        chat = LlmChat(
+            api_key=self.api_key,
+            session_id=session_id,
+            system_message=system_message
+        ).with_model(MODEL_PROVIDER, MODEL_NAME)
+
+        message = UserMessage(text=prompt)
+        if files:
+            message = UserMessage(
+                text=prompt,
+                file_contents=[FileContentWithMimeType(file_path=path, mime_type=mime) for path, mime in files]
+            )
+        return await chat.send_message(message)
+
+    async def stream(self, system_message: str, prompt: str, session_id: str,
+                     files: Optional[List[Tuple[str, str]]] = None) -> AsyncIterator[str]:
+        if not self.gemini_api_key or files:
+            async for chunk in super().stream(system_message, prompt, session_id, files):
+                yield chunk
+            return
+
+        from google import genai
+        from google.genai import types
+
+        if self._client is None:
+            self._client = genai.Client(api_key=self.gemini_api_key)
+        response = await self._client.aio.models.generate_content_stream(
+            model=MODEL_NAME,
+            contents=prompt,
+            config=types.GenerateContentConfig(system_instruction=system_message),
+        )
+        try:
+            async for chunk in response:
+                if chunk.text:
+                    yield chunk.text
+        finally:
+            await response.aclose()
+
+
+class FakeBackend(LLMBackend):
+    """Deterministic local backend for tests and benchmarks.
+
+    The same (system message, prompt) always produces the same response. Latency is
+    `latency` seconds plus up to `jitter` seconds derived from the prompt hash, so
+    runs are reproducible. Prompts asking for a JSON array get a JSON array of
+    well-formed flashcard/quiz items back.
+    """
+
+    model = "fake/deterministic"
+    streaming = True
+
+    def __init__(self, latency: float = 0.0, jitter: float = 0.0):
+        self.latency = latency
+        self.jitter = jitter
+        self.calls = 0
+
+    def respond(self, system_message: str, prompt: str) -> str:
+        digest = hashlib.sha256(f"{system_message}\n{prompt}".encode("utf-8")).hexdigest()
+        words = re.findall(r"[A-Za-z]{4,}", prompt)[-40:] or ["study"]
+
+        if "JSON array" in prompt:
+            match = re.search(r"Generate (\d+)", prompt)
+            count = int(match.group(1)) if match else 5
+            items = []
+            for i in range(count):
+                word = words[(int(digest[i % 64], 16) + i) % len(words)]
+                items.append({
+                    "question": f"Question {i + 1}: what is {word}?",
+                    "answer": f"{word} is explained in the material ({digest[i:i + 8]}).",
+                    "options": [f"{word} {c}" for c in "ABCD"],
+                    "correct_answer": int(digest[i], 16) % 4,
+                })
+            return json.dumps(items)
+
+        bullets = [f"- {' '.join(words[i:i + 6])}" for i in range(0, min(len(words), 24), 6)]
+        return "\n".join(bullets + [f"({digest[:12]})"])
+
+    async def complete(self, system_message: str, prompt: str, session_id: str,
+                       files: Optional[List[Tuple[str, str]]] = None) -> str:
+        self.calls += 1
+        response = self.respond(system_message, prompt)
+        delay = self._delay(prompt)
+        if delay > 0:
+            await asyncio.sleep(delay)
+        return response
+
+    async def stream(self, system_message: str, prompt: str, session_id: str,
+                     files: Optional[List[Tuple[str, str]]] = None) -> AsyncIterator[str]:
+        self.calls += 1
+        pieces = re.findall(r"\S+\s*", self.respond(system_message, prompt))
+        delay = self._delay(prompt) / max(len(pieces), 1)
+        for piece in pieces:
+            if delay > 0:
+                await asyncio.sleep(delay)
+            yield piece
+
+    def _delay(self, prompt: str) -> float:
+        spread = int(hashlib.sha256(prompt.encode("utf-8")).hexdigest()[:8], 16) / 0xFFFFFFFF
+        return self.latency + self.jitter * spread
+
+
+class TokenBucket:
+    """Token-bucket rate limiter: `rate` tokens per second, bursts of up to `capacity`"""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = None
+        self._lock = asyncio.Lock()
+
+    def _refill(self, now: float):
+        if self._updated is not None:
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    async def acquire(self, deadline: Optional[float] = None):
+        loop = asyncio.get_running_loop()
+        async with self._lock:
+            while True:
+                now = loop.time()
+                self._refill(now)
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+                if deadline is not None and now + wait > deadline:
+                    raise LLMGatewayError("Rate limit wait exceeds request deadline")
+                await asyncio.sleep(wait)
+
+
+def is_retryable(exc: Exception) -> bool:
+    if isinstance(exc, (asyncio.TimeoutError, ConnectionError)):
+        return True
+    status = getattr(exc, "status_code", None) or getattr(exc, "status", None)
+    if status in RETRYABLE_STATUS_CODES:
+        return True
+    message = str(exc).lower()
+    return "429" in message or "rate limit" in message or "overloaded" in message or "unavailable" in message
+
+
+def _parse_class_limits(raw: str) -> Dict[str, int]:
+    limits = {}
+    for part in raw.split(','):
+        if '=' in part:
+            name, value = part.split('=', 1)
+            limits[name.strip()] = int(value)
+    return limits
+
+
+class LLMGateway:
+    """Bounded-concurrency front door for every upstream LLM call.
+
+    Each call holds a slot in its endpoint-class semaphore and in the global
+    semaphore, takes a token from the shared token bucket, and runs with a
+    deadline. Retryable failures (timeouts, 429s, 5xx) are retried with
+    full-jitter exponential backoff as long as the backoff fits before the deadline.
+    """
+
+    def __init__(self, backend: LLMBackend, max_concurrency: int = 8,
+                 class_limits: Optional[Dict[str, int]] = None,
+                 rate_per_second: float = 5.0, burst: int = 10,
+                 timeout: float = 60.0, max_retries: int = 3,
+                 backoff_base: float = 0.5, backoff_cap: float = 8.0,
+                 stream_idle_timeout: float = 30.0):
+        self.backend = backend
+        self.max_concurrency = max_concurrency
+        self.class_limits = class_limits or {}
+        self.timeout = timeout
+        self.stream_idle_timeout = stream_idle_timeout
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_cap = backoff_cap
+        self.bucket = TokenBucket(rate_per_second, burst)
+        self._global = asyncio.Semaphore(max_concurrency)
+        self._classes: Dict[str, asyncio.Semaphore] = {}
+        self.calls = 0
+        self.retries = 0
+        self.failures = 0
+        self.in_flight = 0  # calls holding a global slot
+
+    @classmethod
+    def from_env(cls) -> "LLMGateway":
+        if os.environ.get('LLM_BACKEND', 'gemini') == 'fake':
+            backend = FakeBackend(
+                latency=float(os.environ.get('LLM_FAKE_LATENCY', '0.05')),
+                jitter=float(os.environ.get('LLM_FAKE_JITTER', '0.0')),
+            )
+        else:
+            backend = GeminiBackend()
+        return cls(
+            backend,
+            max_concurrency=int(os.environ.get('LLM_MAX_CONCURRENCY', '8')),
+            class_limits=_parse_class_limits(os.environ.get('LLM_CLASS_LIMITS', '')),
+            rate_per_second=float(os.environ.get('LLM_RATE_PER_SECOND', '5')),
+            burst=int(os.environ.get('LLM_BURST', '10')),
+            timeout=float(os.environ.get('LLM_TIMEOUT_SECONDS', '60')),
+            max_retries=int(os.environ.get('LLM_MAX_RETRIES', '3')),
+            stream_idle_timeout=float(os.environ.get('LLM_STREAM_IDLE_SECONDS', '30')),
+        )
+
+    def _class_semaphore(self, endpoint_class: str) -> asyncio.Semaphore:
+        sem = self._classes.get(endpoint_class)
+        if sem is None:
+            sem = asyncio.Semaphore(self.class_limits.get(endpoint_class, self.max_concurrency))
+            self._classes[endpoint_class] = sem
+        return sem
+
+    @asynccontextmanager
+    async def _slots(self, endpoint_class: str):
+        async with self._class_semaphore(endpoint_class), self._global:
+            self.in_flight += 1
+            try:
+                yield
+            finally:
+                self.in_flight -= 1
+
+    def _observe(self, endpoint_class: str, started: float, outcome: str, response_chars: Optional[int]):
+        elapsed = time.perf_counter() - started
+        LLM_IN_FLIGHT.dec((endpoint_class,))
+        LLM_LATENCY.observe((endpoint_class, outcome), elapsed)
+        if response_chars is not None:
+            LLM_RESPONSE_CHARS.observe((endpoint_class,), response_chars)
+        record_span("llm", elapsed)
+
+    async def complete(self, endpoint_class: str, system_message: str, prompt: str,
+                       session_id: str, files: Optional[List[Tuple[str, str]]] = None,
+                       timeout: Optional[float] = None) -> str:
+        started = time.perf_counter()
+        LLM_IN_FLIGHT.inc((endpoint_class,))
+        LLM_PROMPT_CHARS.observe((endpoint_class,), len(system_message) + len(prompt))
+        outcome, response = "error", None
+        try:
+            response = await self._complete(endpoint_class, system_message, prompt, session_id, files, timeout)
+            outcome = "ok"
+            return response
+        except asyncio.CancelledError:
+            outcome = "cancelled"
+            raise
+        finally:
+            self._observe(endpoint_class, started, outcome, len(response) if response is not None else None)
+
+    async def _complete(self, endpoint_class: str, system_message: str, prompt: str, session_id: str,
+                        files: Optional[List[Tuple[str, str]]], timeout: Optional[float]) -> str:
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + (timeout or self.timeout)
+        attempt = 0
+        while True:
+            try:
+                async with self._slots(endpoint_class):
+                    await self.bucket.acquire(deadline)
+                    remaining = deadline - loop.time()
+                    if remaining <= 0:
+                        raise asyncio.TimeoutError()
+                    self.calls += 1
+                    return await asyncio.wait_for(
+                        self.backend.complete(system_message, prompt, session_id, files),
+                        remaining,
+                    )
+            except LLMGatewayError:
+                self.failures += 1
+                LLM_ERRORS.inc((endpoint_class,))
+                raise
+            except Exception as exc:
+                backoff = random.uniform(0, min(self.backoff_cap, self.backoff_base * 2 ** attempt))
+                if (attempt >= self.max_retries or not is_retryable(exc)
+                        or loop.time() + backoff >= deadline):
+                    self.failures += 1
+                    LLM_ERRORS.inc((endpoint_class,))
+                    raise LLMGatewayError(f"{endpoint_class} LLM call failed: {exc!r}") from exc
+                attempt += 1
+                self.retries += 1
+                LLM_RETRIES.inc((endpoint_class,))
+                logger.warning("Retrying %s LLM call (attempt %d) after %s", endpoint_class, attempt, exc)
+                await asyncio.sleep(backoff)
+
+    async def stream(self, endpoint_class: str, system_message: str, prompt: str,
+                     session_id: str, files: Optional[List[Tuple[str, str]]] = None,
+                     timeout: Optional[float] = None) -> AsyncIterator[str]:
+        """Streaming variant of `complete`.
+
+        Holds the same semaphore slots for the whole stream. The deadline (`timeout`)
+        bounds the wait for the first chunk; after that only the gap between chunks
+        is bounded (`stream_idle_timeout`), so long answers are not cut off while
+        they are still arriving. Failures before the first chunk are retried like
+        `complete`; once output has been sent to the caller a failure is final.
+        Closing the generator closes the upstream stream.
+        """
+        started = time.perf_counter()
+        LLM_IN_FLIGHT.inc((endpoint_class,))
+        LLM_PROMPT_CHARS.observe((endpoint_class,), len(system_message) + len(prompt))
+        outcome, size = "error", 0
+        chunks = self._stream(endpoint_class, system_message, prompt, session_id, files, timeout)
+        try:
+            async for chunk in chunks:
+                size += len(chunk)
+                yield chunk
+            outcome = "ok"
+        except (GeneratorExit, asyncio.CancelledError):
+            outcome = "cancelled"
+            raise
+        finally:
+            await chunks.aclose()
+            self._observe(endpoint_class, started, outcome, size)
+
+    async def _stream(self, endpoint_class: str, system_message: str, prompt: str, session_id: str,
+                      files: Optional[List[Tuple[str, str]]], timeout: Optional[float]) -> AsyncIterator[str]:
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + (timeout or self.timeout)
+        attempt = 0
+        while True:
+            started = False
+            try:
+                async with self._slots(endpoint_class):
+                    await self.bucket.acquire(deadline)
+                    self.calls += 1
+                    upstream = self.backend.stream(system_message, prompt, session_id, files)
+                    try:
+                        while True:
+                            if started:
+                                remaining = self.stream_idle_timeout
+                            else:
+                                remaining = deadline - loop.time()
+                                if remaining <= 0:
+                                    raise asyncio.TimeoutError()
+                            try:
+                                chunk = await asyncio.wait_for(upstream.__anext__(), remaining)
+                            except StopAsyncIteration:
+                                return
+                            started = True
+                            yield chunk
+                    finally:
+                        await upstream.aclose()
+            except LLMGatewayError:
+                self.failures += 1
+                LLM_ERRORS.inc((endpoint_class,))
+                raise
+            except Exception as exc:
+                backoff = random.uniform(0, min(self.backoff_cap, self.backoff_base * 2 ** attempt))
+                if (started or attempt >= self.max_retries or not is_retryable(exc)
+                        or loop.time() + backoff >= deadline):
+                    self.failures += 1
+                    LLM_ERRORS.inc((endpoint_class,))
+                    raise LLMGatewayError(f"{endpoint_class} LLM stream failed: {exc!r}") from exc
+                attempt += 1
+                self.retries += 1
+                LLM_RETRIES.inc((endpoint_class,))
+                logger.warning("Retrying %s LLM stream (attempt %d) after %s", endpoint_class, attempt, exc)
+                await asyncio.sleep(backoff)
+
+    def stats(self) -> dict:
+        return {
+            "backend": self.backend.model,
+            "streaming": self.backend.streaming,
+            "calls": self.calls,
+            "retries": self.retries,
+            "failures": self.failures,
+            "in_flight": self.in_flight,
+            "global_available": self.max_concurrency - self.in_flight,
+        }
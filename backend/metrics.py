@@ -0,0 +1,291 @@
+"""Prometheus metrics and optional per-request trace spans.
+
+Everything lives in one process-wide registry that GET /api/metrics renders in
+the Prometheus text format. Request latency and in-flight counts come from
+MetricsMiddleware, Mongo command timings from MongoListener (a pymongo command
+listener; Motor runs commands in its thread pool, so metric updates are
+locked), and upstream LLM calls are timed in the gateway. Counters kept by
+other components, like cache hits, are read at scrape time through callbacks.
+
+With METRICS_TRACE=1 every request also collects spans (Mongo commands,
+context building, LLM calls) and reports their totals in a Server-Timing
+response header. A span costs a clock read and a list append, and nothing
+when tracing is off. Spans that finish after the response headers are sent,
+such as a streamed LLM answer, are not included.
+"""
+import os
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from pymongo import monitoring
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+MONGO_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576)
+
+TRACE_ENABLED = os.environ.get('METRICS_TRACE', '').lower() in ('1', 'true', 'yes')
+
+Sample = Tuple[str, Sequence[str], Sequence[str], float]
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_sample(name: str, label_names: Sequence[str], label_values: Sequence[str], value: float) -> str:
+    labels = ",".join(f'{n}="{_escape(v)}"' for n, v in zip(label_names, label_values))
+    value = float(value)
+    number = str(int(value)) if value.is_integer() else repr(value)
+    return f"{name}{{{labels}}} {number}" if labels else f"{name} {number}"
+
+
+class Counter:
+    type = "counter"
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._values: Dict[tuple, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, labels: tuple = (), amount: float = 1.0):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0.0) + amount
+
+    def samples(self) -> Iterable[Sample]:
+        with self._lock:
+            items = list(self._values.items())
+        for values, value in items:
+            yield self.name, self.labels, values, value
+
+
+class Gauge(Counter):
+    type = "gauge"
+
+    def dec(self, labels: tuple = (), amount: float = 1.0):
+        self.inc(labels, -amount)
+
+    def set(self, labels: tuple = (), value: float = 0.0):
+        with self._lock:
+            self._values[labels] = value
+
+
+class Histogram:
+    type = "histogram"
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = (), buckets: Sequence[float] = LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        # labels -> [per-bucket counts (last one is +Inf), sum, count]
+        self._values: Dict[tuple, list] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, labels: tuple, value: float):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(labels)
+            if state is None:
+                state = self._values[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            state[0][index] += 1
+            state[1] += value
+            state[2] += 1
+
+    def samples(self) -> Iterable[Sample]:
+        with self._lock:
+            items = [(values, (list(counts), total, count)) for values, (counts, total, count) in self._values.items()]
+        bucket_labels = self.labels + ("le",)
+        for values, (counts, total, count) in items:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += bucket_count
+                le = "+Inf" if bound == float("inf") else repr(float(bound))
+                yield f"{self.name}_bucket", bucket_labels, values + (le,), cumulative
+            yield f"{self.name}_sum", self.labels, values, total
+            yield f"{self.name}_count", self.labels, values, count
+
+
+class Callback:
+    """A metric whose samples are read from `collect()` at scrape time"""
+
+    def __init__(self, name: str, help: str, type: str, labels: Sequence[str],
+                 collect: Callable[[], Iterable[Tuple[tuple, float]]]):
+        self.name = name
+        self.help = help
+        self.type = type
+        self.labels = tuple(labels)
+        self.collect = collect
+
+    def samples(self) -> Iterable[Sample]:
+        for values, value in self.collect():
+            yield self.name, self.labels, values, value
+
+
+class Registry:
+    def __init__(self):
+        self.metrics: List = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        lines = []
+        for metric in self.metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+            lines.extend(_format_sample(*sample) for sample in metric.samples())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+HTTP_REQUESTS = REGISTRY.register(Counter(
+    "http_requests_total", "HTTP requests by route template and status", ("method", "route", "status")))
+HTTP_LATENCY = REGISTRY.register(Histogram(
+    "http_request_duration_seconds", "Time until the response body is fully sent", ("method", "route")))
+HTTP_IN_FLIGHT = REGISTRY.register(Gauge(
+    "http_requests_in_flight", "Requests being served", ("method",)))
+MONGO_LATENCY = REGISTRY.register(Histogram(
+    "mongo_command_duration_seconds", "Mongo command round trips", ("collection", "command"), MONGO_BUCKETS))
+MONGO_FAILURES = REGISTRY.register(Counter(
+    "mongo_command_failures_total", "Mongo commands that returned an error", ("collection", "command")))
+LLM_LATENCY = REGISTRY.register(Histogram(
+    "llm_call_duration_seconds", "Upstream LLM calls including queueing and retries", ("endpoint", "outcome")))
+LLM_IN_FLIGHT = REGISTRY.register(Gauge(
+    "llm_calls_in_flight", "Upstream LLM calls in progress or waiting for a slot", ("endpoint",)))
+LLM_PROMPT_CHARS = REGISTRY.register(Histogram(
+    "llm_prompt_chars", "Prompt size sent upstream", ("endpoint",), SIZE_BUCKETS))
+LLM_RESPONSE_CHARS = REGISTRY.register(Histogram(
+    "llm_response_chars", "Response size received from upstream", ("endpoint",), SIZE_BUCKETS))
+LLM_RETRIES = REGISTRY.register(Counter(
+    "llm_retries_total", "Upstream LLM calls retried after a retryable failure", ("endpoint",)))
+LLM_ERRORS = REGISTRY.register(Counter(
+    "llm_errors_total", "Upstream LLM calls that failed for good", ("endpoint",)))
+
+
+def register_cache_metrics(counts: Callable[[], Dict[str, Tuple[int, int]]]):
+    """Expose hit/miss counters and hit ratios for caches; `counts` maps cache name to (hits, misses)"""
+    def ratios():
+        for name, (hits, misses) in counts().items():
+            yield (name,), (hits / (hits + misses)) if hits + misses else 0.0
+
+    REGISTRY.register(Callback("cache_hits_total", "Cache hits", "counter", ("cache",),
+                               lambda: (((name,), hits) for name, (hits, _) in counts().items())))
+    REGISTRY.register(Callback("cache_misses_total", "Cache misses", "counter", ("cache",),
+                               lambda: (((name,), misses) for name, (_, misses) in counts().items())))
+    REGISTRY.register(Callback("cache_hit_ratio", "Cache hits over lookups since startup", "gauge", ("cache",), ratios))
+
+
+# The current request's spans, a list of (name, seconds); None when tracing is off.
+# Motor copies the context into its executor threads, so Mongo spans land here too.
+_trace: ContextVar[Optional[list]] = ContextVar("metrics_trace", default=None)
+
+
+def record_span(name: str, seconds: float):
+    trace = _trace.get()
+    if trace is not None:
+        trace.append((name, seconds))
+
+
+@contextmanager
+def span(name: str):
+    """Time the block as a span of the current request's trace"""
+    trace = _trace.get()
+    if trace is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        trace.append((name, time.perf_counter() - started))
+
+
+def server_timing(trace: list, total: float) -> str:
+    """Server-Timing header value: total time and count per span name"""
+    totals: Dict[str, list] = {}
+    for name, seconds in list(trace):
+        entry = totals.setdefault(name, [0.0, 0])
+        entry[0] += seconds
+        entry[1] += 1
+    parts = [f'{name};dur={seconds * 1000:.2f};desc="{count}x"' for name, (seconds, count) in totals.items()]
+    return ", ".join(parts + [f"total;dur={total * 1000:.2f}"])
+
+
+class MetricsMiddleware:
+    """ASGI middleware recording per-route latency, status counts and in-flight requests.
+
+    Routes are labelled by their path template (e.g. /api/notes/{note_id}) so
+    the number of series stays bounded.
+    """
+
+    def __init__(self, app, trace: bool = TRACE_ENABLED):
+        self.app = app
+        self.trace = trace
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        method = scope["method"]
+        started = time.perf_counter()
+        status = 500
+        trace = [] if self.trace else None
+        token = _trace.set(trace) if trace is not None else None
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                if trace is not None:
+                    timing = server_timing(trace, time.perf_counter() - started)
+                    message = {**message, "headers": [*message.get("headers", []),
+                                                      (b"server-timing", timing.encode("latin-1"))]}
+            await send(message)
+
+        HTTP_IN_FLIGHT.inc((method,))
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            HTTP_IN_FLIGHT.dec((method,))
+            route = scope.get("route")
+            template = getattr(route, "path", None) or "unmatched"
+            HTTP_LATENCY.observe((method, template), time.perf_counter() - started)
+            HTTP_REQUESTS.inc((method, template, str(status)))
+            if token is not None:
+                _trace.reset(token)
+
+
+class MongoListener(monitoring.CommandListener):
+    """Times every Mongo command by collection and command name"""
+
+    def __init__(self):
+        # (connection, request id) -> collection of commands awaiting a reply
+        self._pending: Dict[tuple, str] = {}
+
+    def started(self, event):
+        name = event.command_name
+        collection = event.command.get("collection" if name == "getMore" else name)
+        self._pending[(event.connection_id, event.request_id)] = collection if isinstance(collection, str) else ""
+
+    def succeeded(self, event):
+        self._finish(event)
+
+    def failed(self, event):
+        MONGO_FAILURES.inc((self._finish(event), event.command_name))
+
+    def _finish(self, event) -> str:
+        collection = self._pending.pop((event.connection_id, event.request_id), "")
+        seconds = event.duration_micros / 1e6
+        MONGO_LATENCY.observe((collection, event.command_name), seconds)
+        record_span("mongo", seconds)
+        return collection
@@ -0,0 +1,187 @@
+"""One-off data migrations run on startup.
+
+Each step records a marker document in the `migrations` collection when it
+finishes, and later boots skip the steps that have one, so a cold start does
+not scan collections for legacy rows that are long gone. Delete a marker to
+run its step again on the next boot.
+"""
+import asyncio
+import logging
+from datetime import datetime, timezone
+from typing import Awaitable, Callable, Dict, List, Optional, Set
+
+from pymongo import UpdateOne
+from pymongo.errors import ConnectionFailure
+
+from metrics import REGISTRY, Callback
+
+logger = logging.getLogger(__name__)
+
+# Timestamp fields that older versions of the API stored as ISO strings
+DATETIME_FIELDS: Dict[str, List[str]] = {
+    "notes": ["created_at", "updated_at"],
+    "flashcards": ["next_review", "created_at"],
+    "tasks": ["created_at"],
+    "quiz_questions": ["created_at"],
+    "chat_messages": ["created_at"],
+    "study_sessions": ["created_at"],
+}
+
+
+MIGRATIONS_COLLECTION = "migrations"
+
+
+async def completed_migrations(db) -> Set[str]:
+    return set(await db[MIGRATIONS_COLLECTION].distinct("_id"))
+
+
+async def mark_completed(db, name: str):
+    await db[MIGRATIONS_COLLECTION].update_one(
+        {"_id": name}, {"$set": {"completed_at": datetime.now(timezone.utc)}}, upsert=True
+    )
+
+
+async def run_once(db, name: str, step: Callable[..., Awaitable], completed: Set[str]):
+    """Run `step(db)` unless it is in `completed`, then record it"""
+    if name in completed:
+        return
+    await step(db)
+    await mark_completed(db, name)
+
+
+def _parse(value):
+    if isinstance(value, str):
+        parsed = datetime.fromisoformat(value)
+        return parsed if parsed.tzinfo else parsed.replace(tzinfo=timezone.utc)
+    return value
+
+
+def _string_typed(fields: List[str]) -> dict:
+    return {"$or": [{field: {"$type": "string"}} for field in fields]}
+
+
+class DatetimeMigration:
+    """Online migration of ISO-string timestamps to native BSON dates.
+
+    While the migration is running, readers call `coerce` on fetched documents
+    and build range queries with `range_filter`, both of which also understand
+    the legacy string format. Once every collection has been converted both
+    become no-ops, so list endpoints no longer do per-row conversion in Python.
+
+    During the window, keyset pages may order legacy rows before converted ones;
+    this settles once the migration completes.
+    """
+
+    name = "datetime_fields"
+
+    def __init__(self, batch_size: int = 500, max_attempts: int = 5, retry_delay: float = 1.0):
+        self.batch_size = batch_size
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self.complete = False
+        self.migrated = 0
+        self.skipped = 0  # documents whose timestamps could not be parsed
+        self.error: Optional[str] = None
+        self._task: Optional[asyncio.Task] = None
+
+    async def start(self, db, completed: Set[str] = frozenset()):
+        """Check for legacy documents and convert them in a background task"""
+        if self.name in completed:
+            self.complete = True
+            return
+        for collection, fields in DATETIME_FIELDS.items():
+            if await db[collection].find_one(_string_typed(fields), {"_id": 1}):
+                logger.info("Legacy string timestamps found, starting datetime migration")
+                self._task = asyncio.create_task(self.run(db))
+                return
+        self.complete = True
+        await mark_completed(db, self.name)
+
+    async def stop(self):
+        if self._task and not self._task.done():
+            self._task.cancel()
+
+    async def run(self, db):
+        """Convert every collection; stays incomplete (readers keep the fallback) on failure or skipped documents"""
+        try:
+            for collection, fields in DATETIME_FIELDS.items():
+                await self._migrate(db, collection, fields)
+            if self.skipped:
+                logger.error("Datetime migration converted %d documents but skipped %d with unparseable timestamps; "
+                             "fix them and restart to finish the migration", self.migrated, self.skipped)
+                return
+            await self._retry(lambda: mark_completed(db, self.name))
+        except asyncio.CancelledError:
+            raise
+        except Exception as exc:
+            self.error = repr(exc)
+            logger.exception("Datetime migration failed after converting %d documents", self.migrated)
+            return
+        self.complete = True
+        logger.info("Datetime migration complete: %d documents converted", self.migrated)
+
+    async def _migrate(self, db, collection: str, fields: List[str]):
+        last_id = None
+        while True:
+            # Walk in _id order, so skipped documents are not fetched again
+            filters = _string_typed(fields)
+            if last_id is not None:
+                filters = {"$and": [filters, {"_id": {"$gt": last_id}}]}
+            docs = await self._retry(lambda: db[collection].find(
+                filters, {"_id": 1, **{f: 1 for f in fields}}
+            ).sort("_id", 1).limit(self.batch_size).to_list(self.batch_size))
+            if not docs:
+                return
+            last_id = docs[-1]["_id"]
+            updates = []
+            for doc in docs:
+                try:
+                    values = {f: _parse(doc[f]) for f in fields if isinstance(doc.get(f), str)}
+                except ValueError:
+                    self.skipped += 1
+                    logger.warning("Skipping %s document %s: unparseable timestamp", collection, doc["_id"])
+                    continue
+                updates.append(UpdateOne({"_id": doc["_id"]}, {"$set": values}))
+            if updates:
+                await self._retry(lambda: db[collection].bulk_write(updates, ordered=False))
+                self.migrated += len(updates)
+            # Yield between batches so the migration never starves request handling
+            await asyncio.sleep(0)
+
+    async def _retry(self, operation: Callable[[], Awaitable]):
+        """Run `operation`, retrying connection errors with exponential backoff"""
+        for attempt in range(self.max_attempts):
+            try:
+                return await operation()
+            except ConnectionFailure as exc:
+                if attempt + 1 == self.max_attempts:
+                    raise
+                delay = self.retry_delay * 2 ** attempt
+                logger.warning("Datetime migration: %s, retrying in %.0fs", exc, delay)
+                await asyncio.sleep(delay)
+
+    def coerce(self, docs: List[dict], *fields: str) -> List[dict]:
+        if not self.complete:
+            for doc in docs:
+                for field in fields:
+                    if isinstance(doc.get(field), str):
+                        doc[field] = _parse(doc[field])
+        return docs
+
+    def range_filter(self, field: str, op: str, value: datetime) -> dict:
+        if self.complete:
+            return {field: {op: value}}
+        return {"$or": [
+            {field: {op: value}},
+            {field: {"$type": "string", op: value.isoformat()}},
+        ]}
+
+
+datetime_migration = DatetimeMigration()
+
+REGISTRY.register(Callback(
+    "datetime_migration_documents", "Documents converted or skipped by the datetime migration", "counter",
+    ("outcome",), lambda: [(("converted",), datetime_migration.migrated), (("skipped",), datetime_migration.skipped)]))
+REGISTRY.register(Callback(
+    "datetime_migration_failed", "1 when the datetime migration stopped on an error", "gauge",
+    (), lambda: [((), 1.0 if datetime_migration.error else 0.0)]))
@@ -0,0 +1,140 @@
+import base64
+import json
+import os
+from datetime import datetime
+from typing import Any, Iterable, List, Optional, Tuple
+
+import orjson
+from fastapi import HTTPException
+from fastapi.responses import Response, StreamingResponse
+from pydantic_core import PydanticUndefined
+
+# Clients follow X-Next-Cursor for more; `limit` asks for up to MAX_PAGE_SIZE at once
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+
+# Serve full pages without response_model validation (see ResponseShape)
+LEAN_RESPONSES = os.environ.get('LEAN_RESPONSES', '').lower() in ('1', 'true', 'yes')
+# Pages longer than this are streamed in batches of STREAM_BATCH rows
+STREAM_THRESHOLD = 250
+STREAM_BATCH = 250
+
+SORT_ORDER = [("created_at", 1), ("id", 1)]
+
+
+def encode_cursor(created_at: Any, item_id: str) -> str:
+    """Opaque cursor for the keyset position (created_at, id)"""
+    if isinstance(created_at, datetime):
+        position = ["d", created_at.isoformat(), item_id]
+    else:
+        position = ["s", created_at, item_id]
+    return base64.urlsafe_b64encode(json.dumps(position).encode("utf-8")).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Tuple[Any, str]:
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        kind, created_at, item_id = json.loads(base64.urlsafe_b64decode(padded))
+        if kind == "d":
+            created_at = datetime.fromisoformat(created_at)
+        return created_at, item_id
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+def parse_fields(fields: Optional[str], allowed: Iterable[str]) -> Optional[dict]:
+    """Turn a `fields=title,subject` query parameter into a Mongo projection.
+
+    Returns None when no sparse fieldset was requested. `id` and `created_at`
+    are always projected because the cursor is built from them.
+    """
+    if not fields:
+        return None
+    requested = [f.strip() for f in fields.split(",") if f.strip()]
+    unknown = sorted(set(requested) - set(allowed))
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown fields: {', '.join(unknown)}")
+    projection = {"_id": 0, "id": 1, "created_at": 1}
+    projection.update({f: 1 for f in requested})
+    return projection
+
+
+async def fetch_page(collection, query: dict, cursor: Optional[str], limit: int,
+                     projection: Optional[dict] = None, descending: bool = False) -> Tuple[List[dict], Optional[str]]:
+    """Fetch one page ordered by (created_at, id) using keyset pagination.
+
+    Returns the documents and the cursor of the next page (None on the last page).
+    With `descending`, pages run from the newest document backwards.
+    """
+    filters = query
+    if cursor:
+        created_at, item_id = decode_cursor(cursor)
+        op = "$lt" if descending else "$gt"
+        after_cursor = {"$or": [
+            {"created_at": {op: created_at}},
+            {"created_at": created_at, "id": {op: item_id}},
+        ]}
+        filters = {"$and": [query, after_cursor]} if query else after_cursor
+    sort = [(field, -1) for field, _ in SORT_ORDER] if descending else SORT_ORDER
+    docs = await collection.find(filters, projection or {"_id": 0}).sort(sort).limit(limit + 1).to_list(limit + 1)
+
+    next_cursor = None
+    if len(docs) > limit:
+        docs = docs[:limit]
+        next_cursor = encode_cursor(docs[-1]["created_at"], docs[-1]["id"])
+    return docs, next_cursor
+
+
+class ResponseShape:
+    """The stored fields of a response model, for list pages served from trusted rows.
+
+    `projection` makes Mongo return exactly the model's fields, and `fill` lays
+    them out in the model's field order (Mongo keeps the order they were
+    stored in), adding the model's plain defaults for fields older documents
+    lack. The lean path encodes the result with orjson, which formats
+    datetimes the same way as pydantic, so the body matches the validated
+    response_model path byte for byte.
+    """
+
+    def __init__(self, model):
+        self.fields = tuple(model.model_fields)
+        self.projection = {"_id": 0, **{name: 1 for name in self.fields}}
+        self.defaults = {name: field.default for name, field in model.model_fields.items()
+                         if field.default is not PydanticUndefined}
+
+    def fill(self, docs: List[dict]) -> List[dict]:
+        fields, defaults = self.fields, self.defaults
+        return [{name: doc[name] if name in doc else defaults[name] for name in fields} for doc in docs]
+
+
+async def _encode_batches(items: List[dict]):
+    yield b"["
+    for start in range(0, len(items), STREAM_BATCH):
+        # Each batch is a JSON array; strip its brackets and join batches with commas
+        chunk = orjson.dumps(items[start:start + STREAM_BATCH], option=orjson.OPT_UTC_Z)[1:-1]
+        yield chunk if start == 0 else b"," + chunk
+    yield b"]"
+
+
+def lean_response(items: List[dict], headers: Optional[dict] = None) -> Response:
+    """Encode rows with orjson, streaming long pages batch by batch"""
+    if len(items) <= STREAM_THRESHOLD:
+        return Response(orjson.dumps(items, option=orjson.OPT_UTC_Z), media_type="application/json", headers=headers)
+    return StreamingResponse(_encode_batches(items), media_type="application/json", headers=headers)
+
+
+def page_response(response, items: List[dict], next_cursor: Optional[str], sparse: bool,
+                  shape: Optional[ResponseShape] = None):
+    """Attach the next-page cursor header.
+
+    Sparse pages bypass the endpoint's response_model, as do full pages when
+    LEAN_RESPONSES is set and the endpoint passes its `shape`.
+    """
+    headers = {NEXT_CURSOR_HEADER: next_cursor} if next_cursor else {}
+    if sparse:
+        return lean_response(items, headers)
+    if LEAN_RESPONSES and shape is not None:
+        return lean_response(shape.fill(items), headers)
+    response.headers.update(headers)
+    return items
@@ -0,0 +1,211 @@
+"""PDF export of notes: rendering in a process pool, a disk cache, and streamed ZIP archives."""
+import asyncio
+import hashlib
+import io
+import logging
+import multiprocessing
+import os
+import re
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from datetime import datetime
+from pathlib import Path
+from typing import AsyncIterator, List, Optional
+from xml.sax.saxutils import escape
+
+from single_flight import SingleFlight
+
+logger = logging.getLogger(__name__)
+
+
+def _preload():
+    import reportlab.platypus  # noqa: F401
+
+
+def render_note_pdf(note: dict) -> bytes:
+    """Render a note (title, content, optional AI summary) to PDF bytes; runs in the worker pool"""
+    from reportlab.lib.pagesizes import letter
+    from reportlab.lib.styles import getSampleStyleSheet
+    from reportlab.platypus import Paragraph, SimpleDocTemplate, Spacer
+
+    buffer = io.BytesIO()
+    doc = SimpleDocTemplate(buffer, pagesize=letter)
+    styles = getSampleStyleSheet()
+    story = [Paragraph(f"<b>{escape(note['title'])}</b>", styles['Heading1']), Spacer(1, 12)]
+
+    for line in note['content'].split('\n'):
+        story.append(Paragraph(escape(line), styles['BodyText']))
+        story.append(Spacer(1, 6))
+
+    if note.get('ai_summary'):
+        story.append(Spacer(1, 20))
+        story.append(Paragraph("<b>AI Summary:</b>", styles['Heading2']))
+        story.append(Spacer(1, 12))
+        for line in note['ai_summary'].split('\n'):
+            story.append(Paragraph(escape(line), styles['BodyText']))
+
+    doc.build(story)
+    return buffer.getvalue()
+
+
+def export_filename(note: dict) -> str:
+    title = re.sub(r"[^\w\- ]+", "", note.get("title", "")).strip()[:80] or "note"
+    return f"{title}.pdf"
+
+
+class _ZipStream(io.RawIOBase):
+    """Write-only sink for zipfile that hands out what has been written so far"""
+
+    def __init__(self):
+        self._chunks: List[bytes] = []
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+class PdfExporter:
+    """Renders note PDFs off the event loop and caches them on disk.
+
+    Cached files are keyed by (note id, updated_at, summary hash), so an unchanged
+    note is never re-rendered and a new AI summary invalidates the old file.
+    The least recently used files are evicted once the cache exceeds `max_bytes`.
+    """
+
+    def __init__(self, directory: Path, max_workers: int = 2, max_bytes: int = 200 * 1024 * 1024):
+        self.directory = Path(directory)
+        self.max_workers = max_workers
+        self.max_bytes = max_bytes
+        self.inflight = SingleFlight()
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self.hits = 0
+        self.renders = 0
+
+    @property
+    def pool(self) -> ProcessPoolExecutor:
+        if self._pool is None:
+            # spawn: forking a process that runs the event loop and Mongo driver threads is unsafe
+            self._pool = ProcessPoolExecutor(self.max_workers, mp_context=multiprocessing.get_context("spawn"))
+        return self._pool
+
+    def shutdown(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+    async def warmup(self):
+        """Start the workers and import reportlab ahead of the first export"""
+        loop = asyncio.get_running_loop()
+        await asyncio.gather(*(loop.run_in_executor(self.pool, _preload) for _ in range(self.max_workers)))
+
+    def stats(self) -> dict:
+        return {"hits": self.hits, "renders": self.renders, "in_flight": self.inflight.stats()["in_flight"]}
+
+    @staticmethod
+    def cache_key(note: dict) -> str:
+        summary_hash = hashlib.sha256((note.get("ai_summary") or "").encode("utf-8")).hexdigest()
+        updated_at = note.get("updated_at")
+        if isinstance(updated_at, datetime):
+            updated_at = updated_at.isoformat()
+        raw = f"{note['id']}|{updated_at}|{summary_hash}"
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()[:32]
+
+    async def pdf_path(self, note: dict) -> Path:
+        """Path of the note's rendered PDF, rendering it first on a cache miss"""
+        path = self.directory / f"{self.cache_key(note)}.pdf"
+        if await asyncio.to_thread(self._touch, path):
+            self.hits += 1
+            return path
+        return await self.inflight.do(str(path), lambda: self._render(note, path))
+
+    async def _render(self, note: dict, path: Path) -> Path:
+        loop = asyncio.get_running_loop()
+        try:
+            data = await loop.run_in_executor(self.pool, render_note_pdf, note)
+        except BrokenProcessPool:
+            # A worker died; start a fresh pool for the next request
+            self._pool = None
+            raise
+        self.renders += 1
+        await asyncio.to_thread(self._store, path, data)
+        return path
+
+    @staticmethod
+    def _touch(path: Path) -> bool:
+        try:
+            os.utime(path)  # mtime doubles as the LRU clock
+            return True
+        except FileNotFoundError:
+            return False
+
+    def _store(self, path: Path, data: bytes):
+        self.directory.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_suffix(f".{os.getpid()}.tmp")
+        tmp.write_bytes(data)
+        os.replace(tmp, path)
+        self._evict(keep=path)
+
+    def _evict(self, keep: Path):
+        files = []
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith(".pdf"):
+                stat = entry.stat()
+                files.append((stat.st_mtime, stat.st_size, entry.path))
+        total = sum(size for _, size, _ in files)
+        for _, size, file_path in sorted(files):
+            if total <= self.max_bytes:
+                break
+            if file_path == str(keep):
+                continue
+            try:
+                os.remove(file_path)
+                total -= size
+            except FileNotFoundError:
+                pass
+
+    async def zip_stream(self, notes: List[dict], concurrency: int = 4) -> AsyncIterator[bytes]:
+        """Stream a ZIP of the notes' PDFs, rendering up to `concurrency` at once.
+
+        Entries are written in completion order; PDFs are stored uncompressed
+        since they are compressed already.
+        """
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def load(note: dict):
+            async with semaphore:
+                try:
+                    path = await self.pdf_path(note)
+                    return note, await asyncio.to_thread(path.read_bytes)
+                except Exception:
+                    # One broken note should not abort the whole archive
+                    logger.exception("Could not export note %s", note["id"])
+                    return note, None
+
+        sink = _ZipStream()
+        names = set()
+        tasks = [asyncio.create_task(load(note)) for note in notes]
+        try:
+            with zipfile.ZipFile(sink, "w", compression=zipfile.ZIP_STORED) as archive:
+                for next_done in asyncio.as_completed(tasks):
+                    note, data = await next_done
+                    if data is None:
+                        continue
+                    name = export_filename(note)
+                    if name in names:
+                        name = f"{name[:-4]} ({note['id'][:8]}).pdf"
+                    names.add(name)
+                    archive.writestr(name, data)
+                    yield sink.drain()
+            yield sink.drain()
+        finally:
+            for task in tasks:
+                task.cancel()
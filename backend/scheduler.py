@@ -0,0 +1,93 @@
+from datetime import datetime, timedelta, timezone
+from typing import Iterable, List
+
+DEFAULT_EASE = 2.5
+MIN_EASE = 1.3
+PASSING_GRADE = 3
+MAX_PRIORITY = 3
+
+
+def sm2_review(card: dict, grade: int, reviewed_at: datetime) -> dict:
+    """Apply one SM-2 review (grade 0-5) to a card's scheduling state.
+
+    Returns the new state fields: ease, interval (days), repetitions, lapses,
+    difficulty, priority, next_review and last_reviewed. Cards that keep being
+    forgotten get a higher priority in the due queue.
+    """
+    ease = card.get("ease", DEFAULT_EASE)
+    interval = card.get("interval", 0)
+    repetitions = card.get("repetitions", 0)
+    lapses = card.get("lapses", 0)
+
+    if grade >= PASSING_GRADE:
+        if repetitions == 0:
+            interval = 1
+        elif repetitions == 1:
+            interval = 6
+        else:
+            interval = max(1, round(interval * ease))
+        repetitions += 1
+    else:
+        repetitions = 0
+        interval = 1
+        lapses += 1
+    ease = max(MIN_EASE, ease + 0.1 - (5 - grade) * (0.08 + (5 - grade) * 0.02))
+
+    return {
+        "ease": round(ease, 4),
+        "interval": interval,
+        "repetitions": repetitions,
+        "lapses": lapses,
+        # Legacy 1-5 level shown by the frontend
+        "difficulty": min(5, repetitions + 1),
+        "priority": min(lapses, MAX_PRIORITY),
+        "next_review": reviewed_at + timedelta(days=interval),
+        "last_reviewed": reviewed_at,
+    }
+
+
+def simulate_workload(cards: Iterable[dict], days: int = 30, retention: float = 0.9,
+                      now: datetime = None, seed: int = 0) -> List[dict]:
+    """Project the number of reviews due on each of the next `days` days.
+
+    Every card is advanced day by day with vectorized SM-2 updates, assuming each
+    review is recalled with probability `retention`. Seeded, so it is reproducible.
+    `cards` need next_review and may carry ease/interval/repetitions.
+    """
+    import numpy as np
+
+    now = now or datetime.now(timezone.utc)
+    cards = list(cards)
+    start = now.replace(hour=0, minute=0, second=0, microsecond=0)
+    counts = np.zeros(days, dtype=np.int64)
+
+    if cards:
+        due = np.array([max(0.0, (c["next_review"] - start).total_seconds() / 86400) for c in cards])
+        interval = np.array([float(c.get("interval", 0)) for c in cards])
+        ease = np.array([float(c.get("ease", DEFAULT_EASE)) for c in cards])
+        repetitions = np.array([c.get("repetitions", 0) for c in cards], dtype=np.int64)
+        rng = np.random.default_rng(seed)
+
+        for day in range(days):
+            mask = due < day + 1
+            count = int(mask.sum())
+            counts[day] = count
+            if not count:
+                continue
+            recalled = rng.random(count) < retention
+            reps = repetitions[mask]
+            new_interval = np.where(
+                recalled,
+                np.where(reps == 0, 1.0, np.where(reps == 1, 6.0, np.maximum(1.0, np.round(interval[mask] * ease[mask])))),
+                1.0,
+            )
+            # Recalled reviews are modelled as grade 4 (ease unchanged), lapses as grade 1
+            ease[mask] = np.where(recalled, ease[mask], np.maximum(MIN_EASE, ease[mask] - 0.54))
+            repetitions[mask] = np.where(recalled, reps + 1, 0)
+            interval[mask] = new_interval
+            due[mask] = day + new_interval
+
+    return [
+        {"date": (start + timedelta(days=day)).date().isoformat(), "due": int(counts[day])}
+        for day in range(days)
+    ]
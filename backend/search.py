@@ -0,0 +1,275 @@
+import heapq
+import logging
+import math
+import re
+import time
+from collections import OrderedDict
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+from single_flight import SingleFlight
+
+logger = logging.getLogger(__name__)
+
+TOKEN_RE = re.compile(r"[a-z0-9]+")
+STOPWORDS = frozenset(
+    "a an and are as at be by for from has have in is it its of on or that the this to was were what when "
+    "where which who why will with how do does can".split()
+)
+
+# Field weights (BM25F-style): a title hit counts three times a body hit
+NOTE_FIELDS = {"title": 3.0, "subject": 2.0, "content": 1.0, "ai_summary": 1.0}
+FLASHCARD_FIELDS = {"question": 2.0, "answer": 1.0}
+QUIZ_FIELDS = {"question": 2.0, "topic": 2.0, "options": 0.5}
+
+SEARCH_KINDS = ("note", "flashcard", "quiz")
+SNIPPET_CHARS = 160
+MAX_STORED_TEXT = 20000
+
+
+def tokenize(text: str) -> List[str]:
+    return [t for t in TOKEN_RE.findall(text.lower()) if t not in STOPWORDS and len(t) > 1]
+
+
+def _field_text(value) -> str:
+    if isinstance(value, list):
+        return " ".join(str(v) for v in value)
+    return value or ""
+
+
+def make_snippet(text: str, terms: Iterable[str], width: int = SNIPPET_CHARS) -> str:
+    """Window of `text` around the first query-term hit (or its start)"""
+    terms = [t for t in terms if t]
+    match = re.search(r"\b(" + "|".join(map(re.escape, terms)) + r")", text, re.IGNORECASE) if terms else None
+    start = max(0, match.start() - width // 3) if match else 0
+    snippet = " ".join(text[start:start + width].split())
+    if start > 0:
+        snippet = "…" + snippet
+    if start + width < len(text):
+        snippet += "…"
+    return snippet
+
+
+def document_for(kind: str, doc: dict, subject: Optional[str] = None) -> dict:
+    """Normalize a note / flashcard / quiz question into an indexable search document"""
+    if kind == "note":
+        fields, title, body = NOTE_FIELDS, doc.get("title", ""), doc.get("content", "")
+        subject = doc.get("subject")
+    elif kind == "flashcard":
+        fields, title, body = FLASHCARD_FIELDS, doc.get("question", ""), doc.get("answer", "")
+    else:
+        fields, title, body = QUIZ_FIELDS, doc.get("question", ""), _field_text(doc.get("options"))
+        subject = subject or doc.get("topic")
+    return {
+        "key": f"{kind}:{doc['id']}",
+        "kind": kind,
+        "id": doc["id"],
+        "title": title,
+        "subject": subject,
+        "text": body[:MAX_STORED_TEXT],
+        "fields": {name: (weight, _field_text(doc.get(name))) for name, weight in fields.items()},
+    }
+
+
+class InvertedIndex:
+    """In-memory BM25 inverted index, maintained incrementally as documents change"""
+
+    def __init__(self, k1: float = 1.2, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self.postings: Dict[str, Dict[str, float]] = {}
+        self.lengths: Dict[str, float] = {}
+        self.meta: Dict[str, Tuple[str, str, str, Optional[str], str]] = {}
+        self.doc_terms: Dict[str, Tuple[str, ...]] = {}
+        self.total_length = 0.0
+        self.loaded_at = time.monotonic()
+
+    def __len__(self) -> int:
+        return len(self.lengths)
+
+    def add(self, document: dict):
+        key = document["key"]
+        self.remove(key)
+        weighted_tf: Dict[str, float] = {}
+        length = 0.0
+        for weight, text in document["fields"].values():
+            for term in tokenize(text):
+                weighted_tf[term] = weighted_tf.get(term, 0.0) + weight
+                length += weight
+        for term, tf in weighted_tf.items():
+            self.postings.setdefault(term, {})[key] = tf
+        self.doc_terms[key] = tuple(weighted_tf)
+        self.lengths[key] = length
+        self.total_length += length
+        self.meta[key] = (document["kind"], document["id"], document["title"], document["subject"], document["text"])
+
+    def remove(self, key: str):
+        length = self.lengths.pop(key, None)
+        if length is None:
+            return
+        self.total_length -= length
+        del self.meta[key]
+        for term in self.doc_terms.pop(key):
+            docs = self.postings[term]
+            del docs[key]
+            if not docs:
+                del self.postings[term]
+
+    def subject_of(self, kind: str, item_id: str) -> Optional[str]:
+        meta = self.meta.get(f"{kind}:{item_id}")
+        return meta[3] if meta else None
+
+    def search(self, query: str, kinds: Optional[Iterable[str]] = None,
+               subject: Optional[str] = None, limit: int = 20) -> List[dict]:
+        terms = list(dict.fromkeys(tokenize(query)))
+        if not terms or not self.lengths:
+            return []
+        kinds = set(kinds or SEARCH_KINDS)
+        n = len(self.lengths)
+        avg_length = self.total_length / n or 1.0
+        scores: Dict[str, float] = {}
+        for term in terms:
+            docs = self.postings.get(term)
+            if not docs:
+                continue
+            idf = math.log(1 + (n - len(docs) + 0.5) / (len(docs) + 0.5))
+            for key, tf in docs.items():
+                norm = self.k1 * (1 - self.b + self.b * self.lengths[key] / avg_length)
+                scores[key] = scores.get(key, 0.0) + idf * tf * (self.k1 + 1) / (tf + norm)
+
+        def allowed(key: str) -> bool:
+            kind, _, _, doc_subject, _ = self.meta[key]
+            return kind in kinds and (subject is None or doc_subject == subject)
+
+        top = heapq.nlargest(limit, (item for item in scores.items() if allowed(item[0])), key=lambda item: item[1])
+        results = []
+        for key, score in top:
+            kind, item_id, title, doc_subject, text = self.meta[key]
+            results.append({
+                "type": kind,
+                "id": item_id,
+                "title": title,
+                "subject": doc_subject,
+                "score": round(score, 4),
+                "snippet": make_snippet(text or title, terms),
+            })
+        return results
+
+
+class SearchService:
+    """Ranked search over notes, flashcards and saved quiz questions.
+
+    backend="local" keeps an in-process BM25 index per user, read from Mongo on
+    the user's first search and then updated by the write endpoints (writes
+    for users not loaded yet are picked up by that first read). At most
+    `max_users` indexes are kept, least recently searched dropped first, and
+    an index is read again once it is `max_age` seconds old.
+
+    Each worker only sees its own writes, so with several API workers a local
+    index can miss the others' changes for up to `max_age`; such deployments
+    should use backend="mongo", which relies on the collections' text indexes
+    instead. Either way a search only scores the requesting user's documents.
+    """
+
+    def __init__(self, backend: str = "local", max_users: int = 1000, max_age: float = 3600):
+        self.backend = backend
+        self.max_users = max_users
+        self.max_age = max_age
+        self.indexes: "OrderedDict[str, InvertedIndex]" = OrderedDict()
+        # user -> index updates that arrived while the user's index was being read
+        self._deferred: Dict[str, List[Callable[[InvertedIndex], None]]] = {}
+        self.inflight = SingleFlight()
+
+    async def index_of(self, db, user_id: str) -> InvertedIndex:
+        index = self.indexes.get(user_id)
+        if index is not None and time.monotonic() - index.loaded_at > self.max_age:
+            del self.indexes[user_id]
+            index = None
+        if index is not None:
+            self.indexes.move_to_end(user_id)
+        else:
+            self._deferred.setdefault(user_id, [])  # from now on, before the read has started
+            index = await self.inflight.do(user_id, lambda: self._load_user(db, user_id))
+        return index
+
+    async def _load_user(self, db, user_id: str, batch_size: int = 1000) -> InvertedIndex:
+        index = InvertedIndex()
+        deferred = self._deferred.setdefault(user_id, [])
+        try:
+            async for note in db.notes.find({"user_id": user_id}, {"_id": 0}).batch_size(batch_size):
+                index.add(document_for("note", note))
+            async for card in db.flashcards.find({"user_id": user_id}, {"_id": 0}).batch_size(batch_size):
+                index.add(document_for("flashcard", card, subject=index.subject_of("note", card.get("note_id"))))
+            async for question in db.quiz_questions.find({"user_id": user_id}, {"_id": 0}).batch_size(batch_size):
+                index.add(document_for("quiz", question))
+            for update in deferred:
+                update(index)
+            self.indexes[user_id] = index
+            while len(self.indexes) > self.max_users:
+                self.indexes.popitem(last=False)
+        finally:
+            self._deferred.pop(user_id, None)
+        logger.debug("Search index loaded for user %s: %d documents", user_id, len(index))
+        return index
+
+    def _update(self, user_id: str, update: Callable[[InvertedIndex], None]):
+        if self.backend != "local":
+            return
+        if user_id in self.indexes:
+            update(self.indexes[user_id])
+        elif user_id in self._deferred:
+            self._deferred[user_id].append(update)
+
+    def index_note(self, note: dict):
+        self._update(note["user_id"], lambda index: index.add(document_for("note", note)))
+
+    def index_flashcard(self, card: dict):
+        self._update(card["user_id"], lambda index: index.add(
+            document_for("flashcard", card, subject=index.subject_of("note", card.get("note_id")))))
+
+    def index_quiz_question(self, question: dict):
+        self._update(question["user_id"], lambda index: index.add(document_for("quiz", question)))
+
+    def remove(self, user_id: str, kind: str, item_id: str):
+        self._update(user_id, lambda index: index.remove(f"{kind}:{item_id}"))
+
+    async def search(self, db, user_id: str, query: str, kinds: Optional[Iterable[str]] = None,
+                     subject: Optional[str] = None, limit: int = 20) -> List[dict]:
+        if self.backend == "local":
+            index = await self.index_of(db, user_id)
+            return index.search(query, kinds, subject, limit)
+        return await self._search_mongo(db, user_id, query, set(kinds or SEARCH_KINDS), subject, limit)
+
+    async def _search_mongo(self, db, user_id: str, query: str, kinds: set, subject: Optional[str],
+                            limit: int) -> List[dict]:
+        terms = tokenize(query)
+        score = {"score": {"$meta": "textScore"}}
+        results = []
+
+        async def run(kind: str, collection, filters: dict, title_field: str, body_field: str, subject_of):
+            # The text indexes are prefixed by user_id, which every $text query must match exactly
+            cursor = collection.find({"user_id": user_id, "$text": {"$search": query}, **filters}, {"_id": 0, **score})
+            for doc in await cursor.sort([("score", {"$meta": "textScore"})]).limit(limit).to_list(limit):
+                body = _field_text(doc.get(body_field))
+                results.append({
+                    "type": kind,
+                    "id": doc["id"],
+                    "title": doc.get(title_field, ""),
+                    "subject": subject_of(doc),
+                    "score": round(doc["score"], 4),
+                    "snippet": make_snippet(body or doc.get(title_field, ""), terms),
+                })
+
+        if "note" in kinds:
+            await run("note", db.notes, {"subject": subject} if subject else {}, "title", "content",
+                      lambda doc: doc.get("subject"))
+        if "flashcard" in kinds:
+            filters = {}
+            if subject:
+                filters["note_id"] = {"$in": await db.notes.distinct("id", {"user_id": user_id, "subject": subject})}
+            await run("flashcard", db.flashcards, filters, "question", "answer", lambda doc: subject)
+        if "quiz" in kinds:
+            await run("quiz", db.quiz_questions, {"topic": subject} if subject else {}, "question", "options",
+                      lambda doc: doc.get("topic"))
+
+        results.sort(key=lambda r: r["score"], reverse=True)
+        return results[:limit]
@@ -1,43 +1,181 @@
-from fastapi import FastAPI, APIRouter, UploadFile, File, HTTPException
-from fastapi.responses import FileResponse
+from boot import boot_timer
+from fastapi import FastAPI, APIRouter, UploadFile, File, HTTPException, Request, Response, Query, Depends
+from fastapi.responses import FileResponse, JSONResponse, StreamingResponse
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
 from motor.motor_asyncio import AsyncIOMotorClient
 import os
 import logging
 from pathlib import Path
-from pydantic import BaseModel, Field, ConfigDict
+from pydantic import BaseModel, Field, ConfigDict, ValidationError, field_validator
+from fastapi.encoders import jsonable_encoder
 from typing import List, Optional
 import uuid
-from datetime import datetime, timezone, timedelta
+import asyncio
+import tempfile
+from contextlib import asynccontextmanager
+from datetime import datetime, timezone
+boot_timer.mark("import framework")
 from ai_service import AIService
-import shutil
-from pypdf import PdfReader
-from docx import Document as DocxDocument
-from reportlab.lib.pagesizes import letter
-from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer
-from reportlab.lib.styles import getSampleStyleSheet
-import io
+from llm_cache import LLMCache
+from llm_gateway import LLMGatewayError
+from sse import sse_item_response, sse_response
+from extraction import TextExtractor, UploadLimitMiddleware, file_kind, hash_upload
+from pdf_export import PdfExporter
+from jobs import JobNotFound, JobQueue
+from generated_items import ItemStreamParser, flashcard_fields, quiz_fields
+from indexes import check_query_plans, ensure_indexes
+from migrations import completed_migrations, datetime_migration, run_once
+from scheduler import DEFAULT_EASE, simulate_workload, sm2_review
+from pymongo import UpdateOne
+from due_queue import CARD_PROJECTION, DueQueue, backfill_priority
+from search import SEARCH_KINDS, SearchService
+from dedup import DedupService, compact_duplicates
+from analytics import RollupSweeper, backfill_rollups, current_streak, record_session, study_analytics
+from context_builder import build_context
+from chat_compaction import ChatCompactor, load_summary
+from versions import ConditionalGetMiddleware, ResponseCache, bump_versions
+from tenancy import DEFAULT_USER_ID, backfill_user_ids, current_user
+from metrics import CONTENT_TYPE as METRICS_CONTENT_TYPE
+from metrics import REGISTRY, Callback, MetricsMiddleware, MongoListener, register_cache_metrics, span
+from pagination import (DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE, NEXT_CURSOR_HEADER, ResponseShape, fetch_page,
+                        page_response, parse_fields)
+boot_timer.mark("import modules")
 
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
 
-# MongoDB connection
-mongo_url = os.environ['MONGO_URL']
-client = AsyncIOMotorClient(mongo_url)
-db = client[os.environ['DB_NAME']]
+# MongoDB connection, opened by connect_db() on startup
+client: Optional[AsyncIOMotorClient] = None
+db = None
 
-# Initialize AI Service
-ai_service = AIService()
+# Flashcard review batches
+MAX_REVIEW_BATCH = 500
+APPLIED_REVIEW_HISTORY = 200
+REVIEW_BATCH_ATTEMPTS = 3
+
+# Prefetching due-card queue
+QUEUE_SESSION_HEADER = "X-Queue-Session"
+MAX_GENERATED_ITEMS = 100
+due_queue = DueQueue(prefetch=int(os.environ.get('DUE_QUEUE_PREFETCH', '100')))
+
+# Study analytics windows (see analytics.py)
+MAX_ANALYTICS_DAYS = 366
+MAX_ANALYTICS_WEEKS = 104
+
+# Initialize AI Service with a two-tier (in-process LRU + Mongo) response cache
+llm_cache = LLMCache(
+    None,  # bound to db.llm_cache by connect_db()
+    max_entries=int(os.environ.get('LLM_CACHE_MAX_ENTRIES', '1024')),
+    ttl_seconds=int(os.environ.get('LLM_CACHE_TTL_SECONDS', str(24 * 3600))),
+)
+# Ranked search over notes, flashcards and quiz questions
+search_service = SearchService(
+    os.environ.get('SEARCH_BACKEND', 'local'),
+    max_users=int(os.environ.get('SEARCH_MAX_USERS', '1000')),
+    max_age=float(os.environ.get('SEARCH_INDEX_MAX_AGE_SECONDS', '3600')),
+)
+
+# Uploaded files: size limit, local text extraction pool and content-hash extraction cache
+MAX_UPLOAD_BYTES = int(os.environ.get('MAX_UPLOAD_MB', '25')) * 1024 * 1024
+text_extractor = TextExtractor(max_workers=int(os.environ.get('EXTRACTION_WORKERS', '2')))
+extraction_cache = LLMCache(
+    None,  # bound to db.extraction_cache by connect_db()
+    max_entries=int(os.environ.get('EXTRACTION_CACHE_MAX_ENTRIES', '32')),
+    ttl_seconds=int(os.environ.get('EXTRACTION_CACHE_TTL_SECONDS', str(7 * 24 * 3600))),
+)
+
+# Background jobs (see jobs.py); handlers are registered next to the endpoints
+MAX_JOB_PRIORITY = 9
+job_queue = JobQueue(
+    None,  # bound to db.jobs by connect_db()
+    workers=int(os.environ.get('JOB_WORKERS', '4')),
+    max_attempts=int(os.environ.get('JOB_MAX_ATTEMPTS', '3')),
+    lease_seconds=float(os.environ.get('JOB_LEASE_SECONDS', '60')),
+    # Client errors (missing note, unparseable output) will not go away on a retry
+    is_retryable=lambda exc: not (isinstance(exc, HTTPException) and exc.status_code < 500),
+)
+
+# PDF export: rendering pool and on-disk cache of rendered notes
+MAX_EXPORT_NOTES = 500
+pdf_exporter = PdfExporter(
+    Path(os.environ.get('PDF_CACHE_DIR', str(Path(tempfile.gettempdir()) / "studyai-exports"))),
+    max_workers=int(os.environ.get('PDF_EXPORT_WORKERS', '2')),
+    max_bytes=int(os.environ.get('PDF_CACHE_MAX_MB', '200')) * 1024 * 1024,
+)
+
+# Near-duplicate detection for saved flashcards and quiz questions
+dedup_service = DedupService(
+    threshold=float(os.environ.get('DEDUP_THRESHOLD', '0.8')),
+    num_perm=int(os.environ.get('DEDUP_NUM_PERM', '128')),
+    enabled=os.environ.get('DEDUP_ENABLED', 'true').lower() in ('1', 'true', 'yes'),
+    max_users=int(os.environ.get('DEDUP_MAX_USERS', '1000')),
+)
+
+ai_service = AIService(
+    cache=llm_cache,
+    summary_chunk_tokens=int(os.environ.get('SUMMARY_CHUNK_TOKENS', '3000')),
+    summary_fanout=int(os.environ.get('SUMMARY_FANOUT', '4')),
+)
+
+CHAT_HISTORY_TURNS = int(os.environ.get('CHAT_HISTORY_TURNS', '10'))
+# Recent list/progress bodies keyed by ETag (see versions.py)
+response_cache = ResponseCache(
+    ttl=float(os.environ.get('RESPONSE_CACHE_TTL_SECONDS', '30')),
+    max_bytes=int(os.environ.get('RESPONSE_CACHE_MB', '64')) * 1024 * 1024,
+)
+
+chat_compactor = ChatCompactor(
+    ai_service,
+    keep_recent=CHAT_HISTORY_TURNS,
+    compact_after=int(os.environ.get('CHAT_COMPACT_AFTER', '20')),
+)
+
+def connect_db():
+    """Create the Mongo client (once) and bind the services that keep collections"""
+    global client, db
+    if client is None:
+        client = AsyncIOMotorClient(os.environ['MONGO_URL'], tz_aware=True, event_listeners=[MongoListener()])
+        db = client[os.environ['DB_NAME']]
+        llm_cache.collection = db.llm_cache
+        extraction_cache.collection = db.extraction_cache
+        job_queue.collection = db.jobs
+    return db
+
+boot_timer.mark("construct services")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await startup()
+    try:
+        yield
+    finally:
+        await shutdown()
 
 # Create the main app
-app = FastAPI()
+app = FastAPI(lifespan=lifespan)
 api_router = APIRouter(prefix="/api")
 
 # Models
+class JobCreate(BaseModel):
+    kind: str
+    params: dict = {}
+    priority: int = Field(0, ge=0, le=MAX_JOB_PRIORITY)  # higher runs first
+
+class StudyPlanRequest(BaseModel):
+    topics: List[str] = Field(min_length=1)
+    exam_date: str
+    hours_per_day: int = Field(2, ge=1, le=16)
+
+class ExamRequest(BaseModel):
+    topics: List[str] = Field(min_length=1)
+    question_count: int = Field(10, ge=1, le=MAX_GENERATED_ITEMS)
+    bypass_cache: bool = False
+
 class Note(BaseModel):
     model_config = ConfigDict(extra="ignore")
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
+    user_id: str = DEFAULT_USER_ID
     title: str
     content: str
     subject: str
@@ -53,20 +191,48 @@ class NoteCreate(BaseModel):
 class Flashcard(BaseModel):
     model_config = ConfigDict(extra="ignore")
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
+    user_id: str = DEFAULT_USER_ID
     note_id: str
     question: str
     answer: str
     difficulty: int = 1  # 1-5 for spaced repetition
+    # SM-2 scheduling state (see scheduler.py)
+    ease: float = DEFAULT_EASE
+    interval: int = 0  # in days
+    repetitions: int = 0
+    lapses: int = 0
+    priority: int = 0  # due-queue priority, raised for frequently forgotten cards
     next_review: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
+    prompt_hash: Optional[str] = None  # provenance of AI-generated cards
     created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
 
+class FlashcardReview(BaseModel):
+    review_id: str  # client-generated; makes retried batches idempotent
+    flashcard_id: str
+    grade: int = Field(ge=0, le=5)  # SM-2 grade: 0-2 forgotten, 3-5 recalled
+    reviewed_at: Optional[datetime] = None
+
+    @field_validator("reviewed_at")
+    @classmethod
+    def reviewed_at_utc(cls, value: Optional[datetime]) -> Optional[datetime]:
+        """Timestamps without an offset are taken as UTC"""
+        if value is None:
+            return None
+        return value.replace(tzinfo=timezone.utc) if value.tzinfo is None else value.astimezone(timezone.utc)
+
+class FlashcardReviewBatch(BaseModel):
+    reviews: List[FlashcardReview] = Field(max_length=MAX_REVIEW_BATCH)
+
 class FlashcardCreate(BaseModel):
     note_id: str
-    count: int = 5
+    count: int = Field(5, ge=1, le=MAX_GENERATED_ITEMS)
+    bypass_cache: bool = False
+    save: bool = True
 
 class StudyTask(BaseModel):
     model_config = ConfigDict(extra="ignore")
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
+    user_id: str = DEFAULT_USER_ID
     title: str
     description: str
     date: str
@@ -83,21 +249,26 @@ class StudyTaskCreate(BaseModel):
 class QuizQuestion(BaseModel):
     model_config = ConfigDict(extra="ignore")
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
+    user_id: str = DEFAULT_USER_ID
     topic: str
     question: str
     options: List[str]
     correct_answer: int
     difficulty: str = "medium"
+    prompt_hash: Optional[str] = None  # provenance of AI-generated questions
     created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
 
 class QuizGenerate(BaseModel):
     topic: str
     difficulty: str = "medium"
-    count: int = 5
+    count: int = Field(5, ge=1, le=MAX_GENERATED_ITEMS)
+    bypass_cache: bool = False
+    save: bool = True
 
 class ChatMessage(BaseModel):
     model_config = ConfigDict(extra="ignore")
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
+    user_id: str = DEFAULT_USER_ID
     session_id: str
     message: str
     response: str
@@ -110,6 +281,7 @@ class ChatRequest(BaseModel):
 class StudySession(BaseModel):
     model_config = ConfigDict(extra="ignore")
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
+    user_id: str = DEFAULT_USER_ID
     subject: str
     duration: int  # in minutes
     date: str
@@ -125,6 +297,7 @@ class StudySessionCreate(BaseModel):
 class UserProgress(BaseModel):
     model_config = ConfigDict(extra="ignore")
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
+    user_id: str = DEFAULT_USER_ID
     total_study_hours: float = 0.0
     total_notes: int = 0
     total_flashcards: int = 0
@@ -134,6 +307,27 @@ class UserProgress(BaseModel):
     badges: List[str] = []
     last_study_date: Optional[str] = None
 
+# Job kinds that can be submitted through POST /api/jobs, with their parameter models
+JOB_PARAMS = {
+    "flashcards": FlashcardCreate,
+    "quiz": QuizGenerate,
+    "study_plan": StudyPlanRequest,
+    "exam": ExamRequest,
+}
+
+# Stored shapes of the list endpoints' response models (see pagination.ResponseShape)
+NOTE_SHAPE = ResponseShape(Note)
+FLASHCARD_SHAPE = ResponseShape(Flashcard)
+TASK_SHAPE = ResponseShape(StudyTask)
+QUIZ_QUESTION_SHAPE = ResponseShape(QuizQuestion)
+STUDY_SESSION_SHAPE = ResponseShape(StudySession)
+
+def new_progress(user_id: str) -> dict:
+    return UserProgress(user_id=user_id).model_dump()
+
+# Records sessions left out of the rollups by a failed request (see analytics.backfill_rollups)
+rollup_sweeper = RollupSweeper(new_progress, interval=float(os.environ.get('ROLLUP_SWEEP_SECONDS', '600')))
+
 # API Endpoints
 
 @api_router.get("/")
@@ -142,335 +336,814 @@ async def root():
 
 # Notes endpoints
 @api_router.post("/notes", response_model=Note)
-async def create_note(note: NoteCreate):
-    note_obj = Note(**note.model_dump())
+async def create_note(note: NoteCreate, user_id: str = Depends(current_user)):
+    note_obj = Note(**note.model_dump(), user_id=user_id)
     doc = note_obj.model_dump()
-    doc['created_at'] = doc['created_at'].isoformat()
-    doc['updated_at'] = doc['updated_at'].isoformat()
     await db.notes.insert_one(doc)
+    await bump_versions(db, user_id, "notes")
+    search_service.index_note(doc)
     return note_obj
 
 @api_router.get("/notes", response_model=List[Note])
-async def get_notes():
-    notes = await db.notes.find({}, {"_id": 0}).to_list(1000)
-    for note in notes:
-        if isinstance(note['created_at'], str):
-            note['created_at'] = datetime.fromisoformat(note['created_at'])
-        if isinstance(note['updated_at'], str):
-            note['updated_at'] = datetime.fromisoformat(note['updated_at'])
-    return notes
+async def get_notes(
+    response: Response,
+    cursor: Optional[str] = None,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    fields: Optional[str] = None,
+    user_id: str = Depends(current_user),
+):
+    projection = parse_fields(fields, Note.model_fields)
+    notes, next_cursor = await fetch_page(db.notes, {"user_id": user_id}, cursor, limit, projection or NOTE_SHAPE.projection)
+    if projection:
+        return page_response(response, notes, next_cursor, sparse=True)
+    datetime_migration.coerce(notes, 'created_at', 'updated_at')
+    return page_response(response, notes, next_cursor, sparse=False, shape=NOTE_SHAPE)
+
+@api_router.get("/notes/export")
+async def export_notes_zip(
+    ids: Optional[str] = None,
+    subject: Optional[str] = None,
+    limit: int = Query(MAX_EXPORT_NOTES, ge=1, le=MAX_EXPORT_NOTES),
+    user_id: str = Depends(current_user),
+):
+    # ZIP of many notes' PDFs, rendered concurrently and streamed as each one is ready
+    query = {"user_id": user_id}
+    if ids:
+        query["id"] = {"$in": [i.strip() for i in ids.split(",") if i.strip()]}
+    if subject:
+        query["subject"] = subject
+    notes = await db.notes.find(query, {"_id": 0}).sort([("created_at", 1), ("id", 1)]).to_list(limit)
+    if not notes:
+        raise HTTPException(status_code=404, detail="No notes to export")
+    
+    return StreamingResponse(
+        pdf_exporter.zip_stream(notes, concurrency=pdf_exporter.max_workers * 2),
+        media_type="application/zip",
+        headers={"Content-Disposition": 'attachment; filename="notes.zip"'},
+    )
 
 @api_router.get("/notes/{note_id}", response_model=Note)
-async def get_note(note_id: str):
-    note = await db.notes.find_one({"id": note_id}, {"_id": 0})
+async def get_note(note_id: str, user_id: str = Depends(current_user)):
+    note = await db.notes.find_one({"user_id": user_id, "id": note_id}, {"_id": 0})
     if not note:
         raise HTTPException(status_code=404, detail="Note not found")
-    if isinstance(note['created_at'], str):
-        note['created_at'] = datetime.fromisoformat(note['created_at'])
-    if isinstance(note['updated_at'], str):
-        note['updated_at'] = datetime.fromisoformat(note['updated_at'])
+    datetime_migration.coerce([note], 'created_at', 'updated_at')
     return note
 
 @api_router.post("/notes/{note_id}/summarize")
-async def summarize_note(note_id: str):
-    note = await db.notes.find_one({"id": note_id}, {"_id": 0})
+async def summarize_note(note_id: str, bypass_cache: bool = False, user_id: str = Depends(current_user)):
+    note = await db.notes.find_one({"user_id": user_id, "id": note_id}, {"_id": 0})
     if not note:
         raise HTTPException(status_code=404, detail="Note not found")
     
-    summary = await ai_service.summarize_text(note['content'])
-    await db.notes.update_one({"id": note_id}, {"$set": {"ai_summary": summary}})
+    summary = await ai_service.summarize_text(note['content'], bypass_cache=bypass_cache)
+    await db.notes.update_one({"user_id": user_id, "id": note_id}, {"$set": {"ai_summary": summary}})
+    await bump_versions(db, user_id, "notes")
+    search_service.index_note({**note, "ai_summary": summary})
     return {"summary": summary}
 
+@api_router.post("/notes/{note_id}/summarize/stream")
+async def summarize_note_stream(note_id: str, request: Request, bypass_cache: bool = False,
+                                user_id: str = Depends(current_user)):
+    note = await db.notes.find_one({"user_id": user_id, "id": note_id}, {"_id": 0})
+    if not note:
+        raise HTTPException(status_code=404, detail="Note not found")
+    
+    async def save_summary(summary: str):
+        await db.notes.update_one({"user_id": user_id, "id": note_id}, {"$set": {"ai_summary": summary}})
+        await bump_versions(db, user_id, "notes")
+        search_service.index_note({**note, "ai_summary": summary})
+    
+    return sse_response(request, ai_service.stream_summary(note['content'], bypass_cache=bypass_cache), save_summary)
+
 @api_router.delete("/notes/{note_id}")
-async def delete_note(note_id: str):
-    result = await db.notes.delete_one({"id": note_id})
+async def delete_note(note_id: str, user_id: str = Depends(current_user)):
+    result = await db.notes.delete_one({"user_id": user_id, "id": note_id})
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Note not found")
+    await bump_versions(db, user_id, "notes")
+    search_service.remove(user_id, "note", note_id)
     return {"message": "Note deleted"}
 
+# Generated flashcards / quiz questions: parsed, validated and saved with one insert_many
+def accept_generated(items: List[dict], build, parser: ItemStreamParser) -> list:
+    accepted = []
+    for item in items:
+        model = build(item)
+        if model is None:
+            parser.rejected += 1
+        else:
+            accepted.append(model)
+    return accepted
+
+async def stream_generated(chunks, build, parser: ItemStreamParser):
+    # Yield each validated item as soon as it has been parsed from the stream
+    try:
+        async for chunk in chunks:
+            for model in accept_generated(parser.feed(chunk), build, parser):
+                yield model
+        for model in accept_generated(parser.close(), build, parser):
+            yield model
+    finally:
+        await chunks.aclose()
+
+async def claim_new(kind: str, collection, docs: List[dict]):
+    """Register `docs` (all of one user) in the near-duplicate index.
+
+    Returns the docs that are new and {duplicate id: saved id} for the rest.
+    Index entries whose item has since been deleted are dropped on the way.
+    """
+    new, duplicates, pending = [], {}, docs
+    while pending:
+        claimed = []
+        for doc in pending:
+            saved_id = await dedup_service.claim(db, kind, doc)
+            if saved_id is None:
+                new.append(doc)
+            else:
+                claimed.append((doc, saved_id))
+        if not claimed:
+            break
+        known = {doc["id"] for doc in new}
+        known.update(await collection.distinct("id", {
+            "user_id": docs[0]["user_id"], "id": {"$in": [saved_id for _, saved_id in claimed]},
+        }))
+        pending = []
+        for doc, saved_id in claimed:
+            if saved_id in known:
+                duplicates[doc["id"]] = saved_id
+            else:
+                dedup_service.remove(kind, doc["user_id"], saved_id)
+                pending.append(doc)
+    return new, duplicates
+
+async def save_generated(kind: str, collection, models: list, index_doc):
+    """Save generated items with one insert_many, skipping near-duplicates of saved items"""
+    docs, duplicates = await claim_new(kind, collection, [model.model_dump() for model in models])
+    if docs:
+        try:
+            await collection.insert_many(docs, ordered=False)
+        except Exception:
+            for doc in docs:
+                dedup_service.remove(kind, doc["user_id"], doc["id"])
+            raise
+        await bump_versions(db, docs[0]["user_id"], collection.name)
+        for doc in docs:
+            index_doc(doc)
+    return [model for model in models if model.id not in duplicates], duplicates
+
+def flashcard_builder(user_id: str, note_id: str, prompt_hash: str):
+    def build(item: dict) -> Optional[Flashcard]:
+        fields = flashcard_fields(item)
+        return Flashcard(user_id=user_id, note_id=note_id, prompt_hash=prompt_hash, **fields) if fields else None
+    return build
+
+def quiz_question_builder(user_id: str, topic: str, difficulty: str, prompt_hash: str):
+    def build(item: dict) -> Optional[QuizQuestion]:
+        fields = quiz_fields(item)
+        if not fields:
+            return None
+        return QuizQuestion(user_id=user_id, topic=topic, difficulty=difficulty, prompt_hash=prompt_hash, **fields)
+    return build
+
 # Flashcards endpoints
 @api_router.post("/flashcards/generate")
-async def generate_flashcards(request: FlashcardCreate):
-    note = await db.notes.find_one({"id": request.note_id}, {"_id": 0})
+async def generate_flashcards(request: FlashcardCreate, user_id: str = Depends(current_user)):
+    note = await db.notes.find_one({"user_id": user_id, "id": request.note_id}, {"_id": 0})
     if not note:
         raise HTTPException(status_code=404, detail="Note not found")
     
-    flashcards_data = await ai_service.generate_flashcards(note['content'], request.count)
-    return {"flashcards": flashcards_data}
+    prompt_hash = ai_service.flashcards_prompt_hash(note['content'], request.count)
+    raw = await ai_service.generate_flashcards(note['content'], request.count, bypass_cache=request.bypass_cache)
+    parser = ItemStreamParser()
+    cards = accept_generated(parser.feed(raw) + parser.close(), flashcard_builder(user_id, request.note_id, prompt_hash), parser)
+    if not cards:
+        raise HTTPException(status_code=502, detail="Could not parse any flashcards from the AI response")
+    duplicates = {}
+    if request.save:
+        cards, duplicates = await save_generated("flashcard", db.flashcards, cards, search_service.index_flashcard)
+    return {"flashcards": cards, "rejected": parser.rejected, "duplicates": duplicates, "prompt_hash": prompt_hash}
+
+@api_router.post("/flashcards/generate/stream")
+async def generate_flashcards_stream(flashcard_request: FlashcardCreate, request: Request,
+                                     user_id: str = Depends(current_user)):
+    note = await db.notes.find_one({"user_id": user_id, "id": flashcard_request.note_id}, {"_id": 0})
+    if not note:
+        raise HTTPException(status_code=404, detail="Note not found")
+    
+    prompt_hash = ai_service.flashcards_prompt_hash(note['content'], flashcard_request.count)
+    parser = ItemStreamParser()
+    chunks = ai_service.stream_flashcards(note['content'], flashcard_request.count, bypass_cache=flashcard_request.bypass_cache)
+    
+    async def save_cards(cards: List[Flashcard]):
+        saved, duplicates = [], {}
+        if flashcard_request.save:
+            saved, duplicates = await save_generated("flashcard", db.flashcards, cards, search_service.index_flashcard)
+        return {"saved": len(saved), "rejected": parser.rejected, "duplicates": duplicates, "prompt_hash": prompt_hash}
+    
+    items = stream_generated(chunks, flashcard_builder(user_id, flashcard_request.note_id, prompt_hash), parser)
+    return sse_item_response(request, items, save_cards)
 
 @api_router.post("/flashcards", response_model=Flashcard)
-async def create_flashcard(flashcard: Flashcard):
+async def create_flashcard(flashcard: Flashcard, user_id: str = Depends(current_user)):
+    flashcard = flashcard.model_copy(update={"user_id": user_id})
     doc = flashcard.model_dump()
-    doc['next_review'] = doc['next_review'].isoformat()
-    doc['created_at'] = doc['created_at'].isoformat()
+    _, duplicates = await claim_new("flashcard", db.flashcards, [doc])
+    if duplicates:
+        # A near-identical card already exists for this note; return it instead
+        existing = await db.flashcards.find_one({"user_id": user_id, "id": duplicates[doc["id"]]}, CARD_PROJECTION)
+        return datetime_migration.coerce([existing], 'next_review', 'created_at')[0]
     await db.flashcards.insert_one(doc)
+    await bump_versions(db, user_id, "flashcards")
+    search_service.index_flashcard(doc)
     return flashcard
 
 @api_router.get("/flashcards", response_model=List[Flashcard])
-async def get_flashcards():
-    flashcards = await db.flashcards.find({}, {"_id": 0}).to_list(1000)
-    for fc in flashcards:
-        if isinstance(fc['next_review'], str):
-            fc['next_review'] = datetime.fromisoformat(fc['next_review'])
-        if isinstance(fc['created_at'], str):
-            fc['created_at'] = datetime.fromisoformat(fc['created_at'])
-    return flashcards
+async def get_flashcards(
+    response: Response,
+    cursor: Optional[str] = None,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    fields: Optional[str] = None,
+    user_id: str = Depends(current_user),
+):
+    projection = parse_fields(fields, Flashcard.model_fields)
+    flashcards, next_cursor = await fetch_page(db.flashcards, {"user_id": user_id}, cursor, limit, projection or FLASHCARD_SHAPE.projection)
+    if projection:
+        return page_response(response, flashcards, next_cursor, sparse=True)
+    datetime_migration.coerce(flashcards, 'next_review', 'created_at')
+    return page_response(response, flashcards, next_cursor, sparse=False, shape=FLASHCARD_SHAPE)
 
 @api_router.get("/flashcards/due")
-async def get_due_flashcards():
-    now = datetime.now(timezone.utc).isoformat()
-    flashcards = await db.flashcards.find({"next_review": {"$lte": now}}, {"_id": 0}).to_list(100)
-    for fc in flashcards:
-        if isinstance(fc['next_review'], str):
-            fc['next_review'] = datetime.fromisoformat(fc['next_review'])
-        if isinstance(fc['created_at'], str):
-            fc['created_at'] = datetime.fromisoformat(fc['created_at'])
-    return flashcards
+async def get_due_flashcards(
+    response: Response,
+    session: Optional[str] = None,
+    cursor: Optional[str] = None,
+    batch: int = Query(100, ge=1, le=500),
+    user_id: str = Depends(current_user),
+):
+    flashcards, session_id, next_cursor = await due_queue.next_batch(
+        db, session, batch,
+        lambda now: {"user_id": user_id, **datetime_migration.range_filter("next_review", "$lte", now)},
+        cursor=cursor,
+        owner=user_id,
+    )
+    response.headers[QUEUE_SESSION_HEADER] = session_id
+    if next_cursor:
+        response.headers[NEXT_CURSOR_HEADER] = next_cursor
+    return datetime_migration.coerce(flashcards, 'next_review', 'created_at')
 
 @api_router.patch("/flashcards/{flashcard_id}/review")
-async def review_flashcard(flashcard_id: str, correct: bool):
-    flashcard = await db.flashcards.find_one({"id": flashcard_id}, {"_id": 0})
+async def review_flashcard(flashcard_id: str, correct: bool, user_id: str = Depends(current_user)):
+    flashcard = await db.flashcards.find_one({"user_id": user_id, "id": flashcard_id}, {"_id": 0})
     if not flashcard:
         raise HTTPException(status_code=404, detail="Flashcard not found")
     
-    # Spaced repetition logic
-    difficulty = flashcard.get('difficulty', 1)
-    if correct:
-        difficulty = min(5, difficulty + 1)
-        days_to_next = difficulty * 2
-    else:
-        difficulty = max(1, difficulty - 1)
-        days_to_next = 1
+    # Spaced repetition logic (SM-2, a correct answer counts as grade 4)
+    state = sm2_review(flashcard, 4 if correct else 1, datetime.now(timezone.utc))
+    await db.flashcards.update_one({"user_id": user_id, "id": flashcard_id}, {"$set": state, "$inc": {"review_version": 1}})
+    await bump_versions(db, user_id, "flashcards")
+    return {"message": "Flashcard reviewed", "next_review": state["next_review"]}
+
+@api_router.post("/flashcards/reviews")
+async def review_flashcards_batch(batch: FlashcardReviewBatch, user_id: str = Depends(current_user)):
+    """Apply a batch of graded reviews with one read and one bulk_write per attempt.
     
-    next_review = (datetime.now(timezone.utc) + timedelta(days=days_to_next)).isoformat()
-    await db.flashcards.update_one(
-        {"id": flashcard_id},
-        {"$set": {"difficulty": difficulty, "next_review": next_review}}
-    )
-    return {"message": "Flashcard reviewed", "next_review": next_review}
+    Each card remembers the ids of its recently applied reviews, so retrying a
+    batch (even concurrently) never applies a review twice. Every update is
+    also conditional on the card's review_version, bumped by each review, so a
+    card reviewed in between is read again and its reviews replayed on the new
+    state rather than overwriting it. Reviews still conflicting after
+    REVIEW_BATCH_ATTEMPTS are returned in `dropped`, for the client to resend.
+    """
+    now = datetime.now(timezone.utc)
+    for review in batch.reviews:
+        # Unstamped reviews, and ones stamped ahead of the server clock, happen now
+        review.reviewed_at = min(review.reviewed_at or now, now)
+    pending = {}
+    for review in sorted(batch.reviews, key=lambda r: r.reviewed_at):
+        pending.setdefault(review.flashcard_id, []).append(review)
+    
+    applied, duplicates, not_found, results = 0, 0, [], {}
+    for _ in range(REVIEW_BATCH_ATTEMPTS):
+        cards = {
+            card["id"]: card
+            for card in await db.flashcards.find(
+                {"user_id": user_id, "id": {"$in": list(pending)}},
+                {"_id": 0, "id": 1, "ease": 1, "interval": 1, "repetitions": 1, "lapses": 1,
+                 "applied_reviews": 1, "review_version": 1}
+            ).to_list(len(pending))
+        }
+        operations, planned = [], {}
+        for card_id, reviews in pending.items():
+            card = cards.get(card_id)
+            if card is None:
+                not_found.append(card_id)
+                continue
+            seen = set(card.get("applied_reviews", []))
+            state, new = dict(card), []
+            for review in reviews:
+                if review.review_id in seen:
+                    duplicates += 1
+                    continue
+                seen.add(review.review_id)
+                state.update(sm2_review(state, review.grade, review.reviewed_at))
+                new.append(review.review_id)
+            if not new:
+                continue
+            update = {key: state[key] for key in ("ease", "interval", "repetitions", "lapses", "difficulty", "priority", "next_review", "last_reviewed")}
+            operations.append(UpdateOne(
+                # review_version is None for cards never reviewed, which also matches a missing field
+                {"user_id": user_id, "id": card_id, "review_version": card.get("review_version")},
+                {"$set": update, "$inc": {"review_version": 1},
+                 "$push": {"applied_reviews": {"$each": new, "$slice": -APPLIED_REVIEW_HISTORY}}}
+            ))
+            planned[card_id] = (new, {"flashcard_id": card_id, "next_review": update["next_review"], "interval": update["interval"]})
+        if not operations:
+            pending = {}
+            break
+        
+        modified = (await db.flashcards.bulk_write(operations, ordered=False)).modified_count
+        conflicts = set()
+        if modified < len(operations):
+            # Some cards changed since they were read: keep the ones that did take these reviews
+            after = await db.flashcards.find(
+                {"user_id": user_id, "id": {"$in": list(planned)}}, {"_id": 0, "id": 1, "applied_reviews": 1}
+            ).to_list(len(planned))
+            taken = {card["id"]: set(card.get("applied_reviews", [])) for card in after}
+            conflicts = {card_id for card_id, (new, _) in planned.items() if not set(new) <= taken.get(card_id, set())}
+        for card_id, (new, result) in planned.items():
+            if card_id not in conflicts:
+                applied += len(new)
+                results[card_id] = result
+        if modified:
+            await bump_versions(db, user_id, "flashcards")
+        pending = {card_id: pending[card_id] for card_id in conflicts}
+        if not pending:
+            break
+    
+    dropped = [review.review_id for reviews in pending.values() for review in reviews]
+    if dropped:
+        logger.warning("Dropped %d reviews for user %s after %d conflicting attempts", len(dropped), user_id, REVIEW_BATCH_ATTEMPTS)
+    return {
+        "applied": applied,
+        "duplicates": duplicates,
+        "not_found": not_found,
+        "dropped": dropped,
+        "cards": list(results.values()),
+    }
+
+@api_router.get("/flashcards/workload")
+async def get_review_workload(days: int = Query(30, ge=1, le=365), retention: float = Query(0.9, gt=0, le=1),
+                              user_id: str = Depends(current_user)):
+    """Projected number of due reviews per day for the next `days` days"""
+    cards = await db.flashcards.find(
+        {"user_id": user_id}, {"_id": 0, "next_review": 1, "ease": 1, "interval": 1, "repetitions": 1}
+    ).to_list(None)
+    datetime_migration.coerce(cards, 'next_review')
+    return {"days": simulate_workload(cards, days=days, retention=retention)}
 
 # Study Tasks/Planner endpoints
 @api_router.post("/tasks", response_model=StudyTask)
-async def create_task(task: StudyTaskCreate):
-    task_obj = StudyTask(**task.model_dump())
+async def create_task(task: StudyTaskCreate, user_id: str = Depends(current_user)):
+    task_obj = StudyTask(**task.model_dump(), user_id=user_id)
     doc = task_obj.model_dump()
-    doc['created_at'] = doc['created_at'].isoformat()
     await db.tasks.insert_one(doc)
+    await bump_versions(db, user_id, "tasks")
     return task_obj
 
 @api_router.get("/tasks", response_model=List[StudyTask])
-async def get_tasks():
-    tasks = await db.tasks.find({}, {"_id": 0}).to_list(1000)
-    for task in tasks:
-        if isinstance(task['created_at'], str):
-            task['created_at'] = datetime.fromisoformat(task['created_at'])
-    return tasks
+async def get_tasks(
+    response: Response,
+    cursor: Optional[str] = None,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    fields: Optional[str] = None,
+    user_id: str = Depends(current_user),
+):
+    projection = parse_fields(fields, StudyTask.model_fields)
+    tasks, next_cursor = await fetch_page(db.tasks, {"user_id": user_id}, cursor, limit, projection or TASK_SHAPE.projection)
+    if projection:
+        return page_response(response, tasks, next_cursor, sparse=True)
+    datetime_migration.coerce(tasks, 'created_at')
+    return page_response(response, tasks, next_cursor, sparse=False, shape=TASK_SHAPE)
 
 @api_router.patch("/tasks/{task_id}/complete")
-async def complete_task(task_id: str):
-    result = await db.tasks.update_one({"id": task_id}, {"$set": {"completed": True}})
+async def complete_task(task_id: str, user_id: str = Depends(current_user)):
+    result = await db.tasks.update_one({"user_id": user_id, "id": task_id}, {"$set": {"completed": True}})
     if result.matched_count == 0:
         raise HTTPException(status_code=404, detail="Task not found")
+    await bump_versions(db, user_id, "tasks")
     return {"message": "Task completed"}
 
 @api_router.delete("/tasks/{task_id}")
-async def delete_task(task_id: str):
-    result = await db.tasks.delete_one({"id": task_id})
+async def delete_task(task_id: str, user_id: str = Depends(current_user)):
+    result = await db.tasks.delete_one({"user_id": user_id, "id": task_id})
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Task not found")
+    await bump_versions(db, user_id, "tasks")
     return {"message": "Task deleted"}
 
 # Quiz endpoints
 @api_router.post("/quiz/generate")
-async def generate_quiz(request: QuizGenerate):
-    quiz_data = await ai_service.generate_quiz(request.topic, request.difficulty, request.count)
-    return {"quiz": quiz_data}
+async def generate_quiz(request: QuizGenerate, user_id: str = Depends(current_user)):
+    prompt_hash = ai_service.quiz_prompt_hash(request.topic, request.difficulty, request.count)
+    raw = await ai_service.generate_quiz(request.topic, request.difficulty, request.count, bypass_cache=request.bypass_cache)
+    parser = ItemStreamParser()
+    build = quiz_question_builder(user_id, request.topic, request.difficulty, prompt_hash)
+    questions = accept_generated(parser.feed(raw) + parser.close(), build, parser)
+    if not questions:
+        raise HTTPException(status_code=502, detail="Could not parse any quiz questions from the AI response")
+    duplicates = {}
+    if request.save:
+        questions, duplicates = await save_generated("quiz", db.quiz_questions, questions, search_service.index_quiz_question)
+    return {"quiz": questions, "rejected": parser.rejected, "duplicates": duplicates, "prompt_hash": prompt_hash}
+
+@api_router.post("/quiz/generate/stream")
+async def generate_quiz_stream(quiz_request: QuizGenerate, request: Request, user_id: str = Depends(current_user)):
+    prompt_hash = ai_service.quiz_prompt_hash(quiz_request.topic, quiz_request.difficulty, quiz_request.count)
+    parser = ItemStreamParser()
+    chunks = ai_service.stream_quiz(quiz_request.topic, quiz_request.difficulty, quiz_request.count, bypass_cache=quiz_request.bypass_cache)
+    
+    async def save_questions(questions: List[QuizQuestion]):
+        saved, duplicates = [], {}
+        if quiz_request.save:
+            saved, duplicates = await save_generated("quiz", db.quiz_questions, questions, search_service.index_quiz_question)
+        return {"saved": len(saved), "rejected": parser.rejected, "duplicates": duplicates, "prompt_hash": prompt_hash}
+    
+    items = stream_generated(chunks, quiz_question_builder(user_id, quiz_request.topic, quiz_request.difficulty, prompt_hash), parser)
+    return sse_item_response(request, items, save_questions)
 
 @api_router.post("/quiz/questions", response_model=QuizQuestion)
-async def save_quiz_question(question: QuizQuestion):
+async def save_quiz_question(question: QuizQuestion, user_id: str = Depends(current_user)):
+    question = question.model_copy(update={"user_id": user_id})
     doc = question.model_dump()
-    doc['created_at'] = doc['created_at'].isoformat()
+    _, duplicates = await claim_new("quiz", db.quiz_questions, [doc])
+    if duplicates:
+        # A near-identical question on this topic is already saved; return it instead
+        existing = await db.quiz_questions.find_one({"user_id": user_id, "id": duplicates[doc["id"]]}, {"_id": 0})
+        return datetime_migration.coerce([existing], 'created_at')[0]
     await db.quiz_questions.insert_one(doc)
+    await bump_versions(db, user_id, "quiz_questions")
+    search_service.index_quiz_question(doc)
     return question
 
 @api_router.get("/quiz/questions", response_model=List[QuizQuestion])
-async def get_quiz_questions():
-    questions = await db.quiz_questions.find({}, {"_id": 0}).to_list(1000)
-    for q in questions:
-        if isinstance(q['created_at'], str):
-            q['created_at'] = datetime.fromisoformat(q['created_at'])
-    return questions
+async def get_quiz_questions(
+    response: Response,
+    cursor: Optional[str] = None,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    fields: Optional[str] = None,
+    user_id: str = Depends(current_user),
+):
+    projection = parse_fields(fields, QuizQuestion.model_fields)
+    questions, next_cursor = await fetch_page(db.quiz_questions, {"user_id": user_id}, cursor, limit, projection or QUIZ_QUESTION_SHAPE.projection)
+    if projection:
+        return page_response(response, questions, next_cursor, sparse=True)
+    datetime_migration.coerce(questions, 'created_at')
+    return page_response(response, questions, next_cursor, sparse=False, shape=QUIZ_QUESTION_SHAPE)
 
 # Chat/Doubt Solver endpoints
-@api_router.post("/chat")
-async def chat_doubt_solver(request: ChatRequest):
-    # Get recent chat history for context
-    history = await db.chat_messages.find(
-        {"session_id": request.session_id},
-        {"_id": 0}
-    ).sort("created_at", -1).limit(5).to_list(5)
-    
-    chat_context = "\n".join([f"Q: {msg['message']}\nA: {msg['response']}" for msg in reversed(history)])
-    
-    response = await ai_service.chat_doubt_solver(request.message, request.session_id, chat_context)
-    
+async def build_chat_context(user_id: str, session_id: str, question: str):
+    # Relevant note excerpts, the session summary and recent history, within the token budget
+    with span("context"):
+        return await build_context(
+            db, search_service, user_id, session_id, question,
+            budget=int(os.environ.get('CHAT_CONTEXT_TOKENS', '1500')),
+            history_turns=CHAT_HISTORY_TURNS,
+        )
+
+async def save_chat_message(user_id: str, session_id: str, message: str, response: str):
     chat_msg = ChatMessage(
-        session_id=request.session_id,
-        message=request.message,
+        user_id=user_id,
+        session_id=session_id,
+        message=message,
         response=response
     )
     doc = chat_msg.model_dump()
-    doc['created_at'] = doc['created_at'].isoformat()
     await db.chat_messages.insert_one(doc)
+    chat_compactor.schedule(db, user_id, session_id)
+
+@api_router.post("/chat")
+async def chat_doubt_solver(request: ChatRequest, user_id: str = Depends(current_user)):
+    chat_context, context_stats = await build_chat_context(user_id, request.session_id, request.message)
+    
+    response = await ai_service.chat_doubt_solver(request.message, request.session_id, chat_context)
+    await save_chat_message(user_id, request.session_id, request.message, response)
+    
+    return {"response": response, "context_stats": context_stats}
+
+@api_router.post("/chat/stream")
+async def chat_doubt_solver_stream(chat_request: ChatRequest, request: Request, user_id: str = Depends(current_user)):
+    chat_context, context_stats = await build_chat_context(user_id, chat_request.session_id, chat_request.message)
     
-    return {"response": response}
+    async def save_response(response: str):
+        await save_chat_message(user_id, chat_request.session_id, chat_request.message, response)
+        return {"context_stats": context_stats}
+    
+    chunks = ai_service.stream_chat(chat_request.message, chat_request.session_id, chat_context)
+    return sse_response(request, chunks, save_response)
 
 @api_router.get("/chat/history/{session_id}")
-async def get_chat_history(session_id: str):
-    messages = await db.chat_messages.find(
-        {"session_id": session_id},
-        {"_id": 0}
-    ).sort("created_at", 1).to_list(100)
-    for msg in messages:
-        if isinstance(msg['created_at'], str):
-            msg['created_at'] = datetime.fromisoformat(msg['created_at'])
-    return messages
+async def get_chat_history(
+    session_id: str,
+    response: Response,
+    cursor: Optional[str] = None,
+    limit: int = Query(20, ge=1, le=100),
+    user_id: str = Depends(current_user),
+):
+    # Newest page first; each page is in chronological order and the cursor leads to older messages
+    messages, next_cursor = await fetch_page(
+        db.chat_messages, {"user_id": user_id, "session_id": session_id}, cursor, limit, descending=True
+    )
+    if next_cursor:
+        response.headers[NEXT_CURSOR_HEADER] = next_cursor
+    messages.reverse()
+    return datetime_migration.coerce(messages, 'created_at')
+
+@api_router.get("/chat/summary/{session_id}")
+async def get_chat_summary(session_id: str, user_id: str = Depends(current_user)):
+    summary = await load_summary(db, user_id, session_id)
+    return summary or {"summary": None, "folded_turns": 0}
 
 # File upload and analysis
 @api_router.post("/files/analyze")
-async def analyze_file(file: UploadFile = File(...), query: str = "Summarize this document"):
-    # Save uploaded file temporarily
-    upload_dir = ROOT_DIR / "uploads"
-    upload_dir.mkdir(exist_ok=True)
-    file_path = upload_dir / file.filename
-    
-    with open(file_path, "wb") as buffer:
-        shutil.copyfileobj(file.file, buffer)
+async def analyze_file(
+    file: Optional[UploadFile] = File(None),
+    query: str = "Summarize this document",
+    file_hash: Optional[str] = None,
+    bypass_cache: bool = False,
+    background: bool = False,
+    priority: int = Query(0, ge=0, le=MAX_JOB_PRIORITY),
+    user_id: str = Depends(current_user),
+):
+    # Extracted text is cached by content hash: re-asking about a file already seen
+    # skips extraction, and passing its file_hash instead of the file skips the upload
+    filename = file.filename if file is not None else "document"
+    if file is not None:
+        kind = file_kind(file.filename, file.content_type)
+        file_hash, _ = await asyncio.to_thread(hash_upload, file.file, MAX_UPLOAD_BYTES)
+    elif not file_hash:
+        raise HTTPException(status_code=400, detail="Upload a file or pass the file_hash of one analyzed before")
     
-    # Determine mime type
-    mime_type = file.content_type or "text/plain"
-    if file.filename.endswith('.pdf'):
-        mime_type = "application/pdf"
-    elif file.filename.endswith('.docx'):
-        mime_type = "application/vnd.openxmlformats-officedocument.wordprocessingml.document"
-    elif file.filename.endswith('.txt'):
-        mime_type = "text/plain"
+    text = await extraction_cache.get(extraction_key(user_id, file_hash))
+    cached_extraction = text is not None
+    if text is None:
+        if file is None:
+            raise HTTPException(status_code=404, detail="Unknown file_hash, please upload the file")
+        text, _ = await text_extractor.extract(kind, await file.read())
+        if not text.strip():
+            raise HTTPException(status_code=422, detail="No extractable text found (scanned documents are not supported)")
+        await extraction_cache.set(extraction_key(user_id, file_hash), text, method=kind)
     
+    if background:
+        params = {"file_hash": file_hash, "filename": filename, "query": query, "bypass_cache": bypass_cache}
+        return await submit_job("file_analysis", params, priority, user_id)
+    return await analyze_extracted_text(file_hash, filename, query, bypass_cache, text,
+                                        cached_extraction=cached_extraction, user_id=user_id)
+
+def extraction_key(user_id: str, file_hash: str) -> str:
+    # Per user, so knowing a file's hash never reveals another user's upload
+    return f"{user_id}:{file_hash}"
+
+async def analyze_extracted_text(file_hash: str, filename: str, query: str, bypass_cache: bool = False,
+                                 text: Optional[str] = None, cached_extraction: bool = True,
+                                 user_id: str = DEFAULT_USER_ID):
+    # Without `text` (background jobs) the extraction is always read back from the cache
+    if text is None:
+        text = await extraction_cache.get(extraction_key(user_id, file_hash))
+        if text is None:
+            raise HTTPException(status_code=410, detail="The extracted text has expired, please upload the file again")
+    analysis = await ai_service.analyze_document(
+        filename, text, query,
+        max_tokens=int(os.environ.get('FILE_ANALYSIS_MAX_TOKENS', '30000')),
+        bypass_cache=bypass_cache,
+    )
+    return {"analysis": analysis, "filename": filename, "file_hash": file_hash, "cached_extraction": cached_extraction}
+
+# Background jobs: long-running AI operations, polled by job id
+async def submit_job(kind: str, params: dict, priority: int, user_id: str) -> JSONResponse:
+    job = await job_queue.submit(kind, params, priority, dedup=not params.get("bypass_cache"), user_id=user_id)
+    return JSONResponse(status_code=202, content=jsonable_encoder(job))
+
+async def get_job_or_404(action, job_id: str, user_id: str) -> dict:
     try:
-        analysis = await ai_service.analyze_file(str(file_path), mime_type, query)
-        return {"analysis": analysis, "filename": file.filename}
-    finally:
-        # Clean up
-        if file_path.exists():
-            file_path.unlink()
+        return await action(job_id, user_id)
+    except JobNotFound:
+        raise HTTPException(status_code=404, detail="Job not found")
+
+@api_router.post("/jobs")
+async def create_job(job: JobCreate, user_id: str = Depends(current_user)):
+    params_model = JOB_PARAMS.get(job.kind)
+    if params_model is None:
+        raise HTTPException(status_code=400, detail=f"Unknown job kind, expected one of: {', '.join(JOB_PARAMS)}")
+    try:
+        params = params_model(**job.params).model_dump()
+    except ValidationError as exc:
+        raise HTTPException(status_code=422, detail=jsonable_encoder(exc.errors()))
+    return await submit_job(job.kind, params, job.priority, user_id)
+
+@api_router.get("/jobs/{job_id}")
+async def get_job(job_id: str, user_id: str = Depends(current_user)):
+    return await get_job_or_404(job_queue.get, job_id, user_id)
+
+@api_router.post("/jobs/{job_id}/cancel")
+async def cancel_job(job_id: str, user_id: str = Depends(current_user)):
+    return await get_job_or_404(job_queue.cancel, job_id, user_id)
+
+@api_router.post("/jobs/{job_id}/retry")
+async def retry_job(job_id: str, user_id: str = Depends(current_user)):
+    return await get_job_or_404(job_queue.retry, job_id, user_id)
+
+@api_router.post("/study-plans")
+async def create_study_plan(request: StudyPlanRequest, priority: int = Query(0, ge=0, le=MAX_JOB_PRIORITY),
+                            user_id: str = Depends(current_user)):
+    return await submit_job("study_plan", request.model_dump(), priority, user_id)
+
+@api_router.post("/exams")
+async def create_exam(request: ExamRequest, priority: int = Query(0, ge=0, le=MAX_JOB_PRIORITY),
+                      user_id: str = Depends(current_user)):
+    return await submit_job("exam", request.model_dump(), priority, user_id)
+
+async def run_study_plan(user_id: str, **params) -> dict:
+    plan = await ai_service.suggest_study_plan(params["topics"], params["exam_date"], params["hours_per_day"])
+    return {"plan": plan}
+
+async def run_exam(user_id: str, **params) -> dict:
+    questions = await ai_service.generate_exam_questions(
+        params["topics"], params["question_count"], bypass_cache=params["bypass_cache"]
+    )
+    return {"questions": questions}
+
+def job_handler(endpoint, params_model=None):
+    # Run an endpoint function as its submitting user; results are stored in their JSON form
+    async def handler(params: dict, user_id: Optional[str]):
+        user_id = user_id or DEFAULT_USER_ID
+        if params_model:
+            result = await endpoint(params_model(**params), user_id=user_id)
+        else:
+            result = await endpoint(**params, user_id=user_id)
+        return jsonable_encoder(result)
+    return handler
+
+job_queue.register("flashcards", job_handler(generate_flashcards, FlashcardCreate))
+job_queue.register("quiz", job_handler(generate_quiz, QuizGenerate))
+job_queue.register("file_analysis", job_handler(analyze_extracted_text))
+job_queue.register("study_plan", job_handler(run_study_plan))
+job_queue.register("exam", job_handler(run_exam))
 
 # Study Sessions/Progress endpoints
 @api_router.post("/sessions", response_model=StudySession)
-async def create_study_session(session: StudySessionCreate):
-    session_obj = StudySession(**session.model_dump())
+async def create_study_session(session: StudySessionCreate, user_id: str = Depends(current_user)):
+    session_obj = StudySession(**session.model_dump(), user_id=user_id)
     doc = session_obj.model_dump()
-    doc['created_at'] = doc['created_at'].isoformat()
-    await db.study_sessions.insert_one(doc)
-    
-    # Update user progress
-    progress = await db.user_progress.find_one({}, {"_id": 0})
-    if not progress:
-        progress = UserProgress().model_dump()
-        await db.user_progress.insert_one(progress)
+    await db.study_sessions.insert_one({**doc, "rolled_up": False})
     
-    study_hours = session.duration / 60.0
-    await db.user_progress.update_one(
-        {},
-        {
-            "$inc": {"total_study_hours": study_hours, "xp": session.duration},
-            "$set": {"last_study_date": session.date}
-        }
-    )
+    # Update the daily/weekly rollups, the streak and the progress totals; a
+    # session left unmarked by a failure here is recorded by the rollup sweep
+    await record_session(db, doc, new_progress(user_id))
+    await db.study_sessions.update_one({"id": doc["id"]}, {"$set": {"rolled_up": True}})
+    await bump_versions(db, user_id, "study_sessions", "study_rollups", "user_progress")
     
     return session_obj
 
 @api_router.get("/sessions", response_model=List[StudySession])
-async def get_study_sessions():
-    sessions = await db.study_sessions.find({}, {"_id": 0}).to_list(1000)
-    for s in sessions:
-        if isinstance(s['created_at'], str):
-            s['created_at'] = datetime.fromisoformat(s['created_at'])
-    return sessions
+async def get_study_sessions(
+    response: Response,
+    cursor: Optional[str] = None,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    fields: Optional[str] = None,
+    user_id: str = Depends(current_user),
+):
+    projection = parse_fields(fields, StudySession.model_fields)
+    sessions, next_cursor = await fetch_page(db.study_sessions, {"user_id": user_id}, cursor, limit, projection or STUDY_SESSION_SHAPE.projection)
+    if projection:
+        return page_response(response, sessions, next_cursor, sparse=True)
+    datetime_migration.coerce(sessions, 'created_at')
+    return page_response(response, sessions, next_cursor, sparse=False, shape=STUDY_SESSION_SHAPE)
 
 @api_router.get("/progress", response_model=UserProgress)
-async def get_user_progress():
-    progress = await db.user_progress.find_one({}, {"_id": 0})
+async def get_user_progress(user_id: str = Depends(current_user)):
+    progress = await db.user_progress.find_one({"user_id": user_id}, {"_id": 0})
     if not progress:
-        progress = UserProgress().model_dump()
-        await db.user_progress.insert_one(progress)
-        progress = await db.user_progress.find_one({}, {"_id": 0})
+        defaults = new_progress(user_id)
+        defaults.pop("user_id")
+        # Upsert: concurrent first requests must not create two progress documents
+        await db.user_progress.update_one({"user_id": user_id}, {"$setOnInsert": defaults}, upsert=True)
+        progress = await db.user_progress.find_one({"user_id": user_id}, {"_id": 0})
+    progress["streak_days"] = current_streak(progress)
     return progress
 
+@api_router.get("/progress/analytics")
+async def get_progress_analytics(
+    days: int = Query(30, ge=1, le=MAX_ANALYTICS_DAYS),
+    weeks: int = Query(12, ge=1, le=MAX_ANALYTICS_WEEKS),
+    user_id: str = Depends(current_user),
+):
+    """Per-day and per-week study totals by subject, read from the rollups only"""
+    return await study_analytics(db, user_id, days, weeks)
+
 @api_router.post("/progress/update")
-async def update_progress(updates: dict):
-    await db.user_progress.update_one({}, {"$set": updates}, upsert=True)
+async def update_progress(updates: dict, user_id: str = Depends(current_user)):
+    updates = {key: value for key, value in updates.items() if key not in ("_id", "user_id")}
+    if updates:
+        await db.user_progress.update_one({"user_id": user_id}, {"$set": updates}, upsert=True)
+        await bump_versions(db, user_id, "user_progress")
     return {"message": "Progress updated"}
 
 # Export notes as PDF
 @api_router.get("/notes/{note_id}/export")
-async def export_note_pdf(note_id: str):
-    note = await db.notes.find_one({"id": note_id}, {"_id": 0})
+async def export_note_pdf(note_id: str, user_id: str = Depends(current_user)):
+    note = await db.notes.find_one({"user_id": user_id, "id": note_id}, {"_id": 0})
     if not note:
         raise HTTPException(status_code=404, detail="Note not found")
     
-    # Create PDF
-    buffer = io.BytesIO()
-    doc = SimpleDocTemplate(buffer, pagesize=letter)
-    styles = getSampleStyleSheet()
-    story = []
-    
-    # Add title
-    title = Paragraph(f"<b>{note['title']}</b>", styles['Heading1'])
-    story.append(title)
-    story.append(Spacer(1, 12))
-    
-    # Add content
-    for line in note['content'].split('\n'):
-        para = Paragraph(line, styles['BodyText'])
-        story.append(para)
-        story.append(Spacer(1, 6))
-    
-    if note.get('ai_summary'):
-        story.append(Spacer(1, 20))
-        summary_title = Paragraph("<b>AI Summary:</b>", styles['Heading2'])
-        story.append(summary_title)
-        story.append(Spacer(1, 12))
-        summary_para = Paragraph(note['ai_summary'], styles['BodyText'])
-        story.append(summary_para)
-    
-    doc.build(story)
-    buffer.seek(0)
-    
-    # Save to temp file and return
-    export_dir = ROOT_DIR / "exports"
-    export_dir.mkdir(exist_ok=True)
-    export_path = export_dir / f"{note_id}.pdf"
-    
-    with open(export_path, "wb") as f:
-        f.write(buffer.getvalue())
-    
+    # Rendered in the worker pool on the first request, then served from the disk cache
     return FileResponse(
-        path=export_path,
+        path=await pdf_exporter.pdf_path(note),
         media_type="application/pdf",
         filename=f"{note['title']}.pdf"
     )
 
+# Search
+@api_router.get("/search")
+async def search(
+    q: str = Query(..., min_length=1),
+    subject: Optional[str] = None,
+    types: Optional[str] = None,
+    limit: int = Query(20, ge=1, le=100),
+    user_id: str = Depends(current_user),
+):
+    kinds = [t.strip() for t in types.split(",") if t.strip()] if types else list(SEARCH_KINDS)
+    unknown = sorted(set(kinds) - set(SEARCH_KINDS))
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown types: {', '.join(unknown)}")
+    results = await search_service.search(db, user_id, q, kinds, subject, limit)
+    return {"query": q, "results": results}
+
+# Merge the user's near-duplicate flashcards / quiz questions already stored (dry run by default)
+@api_router.post("/maintenance/dedup")
+async def compact_duplicate_items(
+    kind: str = Query("flashcard", pattern="^(flashcard|quiz)$"),
+    threshold: Optional[float] = Query(None, gt=0, le=1),
+    dry_run: bool = True,
+    user_id: str = Depends(current_user),
+):
+    merged = await compact_duplicates(db, kind, threshold or dedup_service.threshold, dedup_service.num_perm, dry_run,
+                                      user_id=user_id)
+    if not dry_run:
+        for item_id in merged:
+            search_service.remove(user_id, kind, item_id)
+            dedup_service.remove(kind, user_id, item_id)
+    return {"kind": kind, "dry_run": dry_run, "duplicates": len(merged), "merged": merged}
+
+# AI cache and request coalescing statistics
+@api_router.get("/ai/cache/stats")
+async def get_ai_cache_stats():
+    return {
+        **ai_service.stats(),
+        "extraction_cache": extraction_cache.stats(),
+        "chat_compactions": chat_compactor.compactions,
+        "response_cache": response_cache.stats(),
+    }
+
+register_cache_metrics(lambda: {
+    "llm": (llm_cache.hits, llm_cache.misses),
+    "extraction": (extraction_cache.hits, extraction_cache.misses),
+    "pdf": (pdf_exporter.hits, pdf_exporter.renders),
+    "response": (response_cache.hits, response_cache.misses),
+})
+
+REGISTRY.register(Callback("startup_step_seconds", "Time spent in each import, construction and startup step",
+                           "gauge", ("step",), lambda: (((name,), seconds) for name, seconds in boot_timer.steps)))
+
+@api_router.get("/metrics")
+async def get_metrics():
+    return Response(content=REGISTRY.render(), media_type=METRICS_CONTENT_TYPE)
+
 # Include router
 app.include_router(api_router)
 
+# Room for the multipart framing around the file
+app.add_middleware(UploadLimitMiddleware, paths=["/api/files/analyze"], max_bytes=MAX_UPLOAD_BYTES + 64 * 1024)
+
+@app.exception_handler(LLMGatewayError)
+async def llm_gateway_error_handler(request, exc: LLMGatewayError):
+    return JSONResponse(status_code=503, content={"detail": "AI service is busy or unavailable, please retry"})
+
+# Inside CORSMiddleware, so 304s and cached bodies get CORS headers
+app.add_middleware(ConditionalGetMiddleware, get_db=lambda: db, cache=response_cache)
+
 app.add_middleware(
     CORSMiddleware,
     allow_credentials=True,
     allow_origins=os.environ.get('CORS_ORIGINS', '*').split(','),
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=[NEXT_CURSOR_HEADER, QUEUE_SESSION_HEADER, "ETag"],
 )
 
+# Outermost, so latency covers the other middleware too
+app.add_middleware(MetricsMiddleware)
+
 # Configure logging
 logging.basicConfig(
     level=logging.INFO,
@@ -478,6 +1151,47 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-@app.on_event("shutdown")
-async def shutdown_db_client():
+boot_timer.mark("define routes")
+
+async def warmup():
+    """Pay first-request costs during startup: Mongo connections, the LLM client and the worker pools"""
+    await db.command("ping")
+    logger.info("LLM backend: %s", ai_service.gateway.backend.model)
+    await asyncio.gather(text_extractor.warmup(), pdf_exporter.warmup())
+
+async def startup():
+    with boot_timer.step("connect"):
+        connect_db()
+    with boot_timer.step("ensure indexes"):
+        await ensure_indexes(db)
+    if os.environ.get('MONGO_INDEX_CHECK', '').lower() in ('1', 'true', 'yes'):
+        report = await check_query_plans(db)
+        logger.info("Query plan check: %d hot queries, %d collection scans",
+                    len(report), sum(entry["collscan"] for entry in report))
+    # One-off backfills are skipped once recorded as done; search and dedup
+    # indexes are read per user on first use
+    with boot_timer.step("migrations"):
+        completed = await completed_migrations(db)
+        await run_once(db, "user_ids", backfill_user_ids, completed)
+        await datetime_migration.start(db, completed)
+        await run_once(db, "flashcard_priority", backfill_priority, completed)
+    # Not a one-off: also picks up sessions a failed request saved but never rolled up
+    with boot_timer.step("rollups"):
+        await backfill_rollups(db, progress_defaults=new_progress)
+    if os.environ.get('STARTUP_WARMUP', '').lower() in ('1', 'true', 'yes'):
+        with boot_timer.step("warmup"):
+            await warmup()
+    job_queue.start()
+    rollup_sweeper.start(db)
+    report = boot_timer.finish()
+    logger.info("Started in %.2fs: %s", report["total_seconds"],
+                ", ".join(f"{name} {seconds:.3f}s" for name, seconds in report["steps"].items()))
+
+async def shutdown():
+    await job_queue.stop()
+    await chat_compactor.stop()
+    await datetime_migration.stop()
+    await rollup_sweeper.stop()
+    text_extractor.shutdown()
+    pdf_exporter.shutdown()
     client.close()
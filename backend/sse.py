@@ -0,0 +1,74 @@
+import json
+import logging
+from typing import Any, AsyncIterator, Awaitable, Callable, Optional
+
+from fastapi import Request
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel
+
+from llm_gateway import LLMGatewayError
+
+logger = logging.getLogger(__name__)
+
+SSE_HEADERS = {
+    "Cache-Control": "no-cache",
+    "X-Accel-Buffering": "no",
+}
+
+
+def sse_event(data: dict, event: Optional[str] = None) -> str:
+    """Format one server-sent event"""
+    payload = json.dumps(data, ensure_ascii=False, default=str)
+    if event:
+        return f"event: {event}\ndata: {payload}\n\n"
+    return f"data: {payload}\n\n"
+
+
+async def _relay(request: Request, chunks: AsyncIterator, on_complete: Optional[Callable[..., Awaitable[Optional[dict]]]],
+                 render: Callable[[Any], str], collect: Callable[[list], Any]) -> AsyncIterator[str]:
+    pieces = []
+    try:
+        async for chunk in chunks:
+            if await request.is_disconnected():
+                logger.info("Client disconnected from %s, cancelling upstream", request.url.path)
+                return
+            pieces.append(chunk)
+            yield render(chunk)
+        extra = await on_complete(collect(pieces)) if on_complete else None
+        yield sse_event({"done": True, **(extra or {})}, event="done")
+    except LLMGatewayError:
+        yield sse_event({"detail": "AI service is busy or unavailable, please retry"}, event="error")
+    finally:
+        # Closing the generator chain tears down the upstream LLM call when the
+        # client goes away (Starlette cancels the response task on disconnect).
+        await chunks.aclose()
+
+
+def sse_response(request: Request, chunks: AsyncIterator[str],
+                 on_complete: Optional[Callable[[str], Awaitable[Optional[dict]]]] = None) -> StreamingResponse:
+    """Stream `chunks` as SSE `data` events, then call `on_complete` with the full text.
+
+    `on_complete` runs only if the stream finished, so partial output from a
+    disconnected client is never persisted. Its return value is merged into the
+    final `done` event.
+    """
+    return StreamingResponse(
+        _relay(request, chunks, on_complete, lambda chunk: sse_event({"delta": chunk}), "".join),
+        media_type="text/event-stream",
+        headers=SSE_HEADERS,
+    )
+
+
+def _jsonable(item):
+    return item.model_dump(mode="json") if isinstance(item, BaseModel) else item
+
+
+def sse_item_response(request: Request, items: AsyncIterator,
+                      on_complete: Optional[Callable[[list], Awaitable[Optional[dict]]]] = None) -> StreamingResponse:
+    """Like `sse_response`, but each element of `items` (a dict or pydantic model)
+    is sent as an `item` event and `on_complete` receives the list of items."""
+    return StreamingResponse(
+        _relay(request, items, on_complete, lambda item: sse_event(_jsonable(item), event="item"), list),
+        media_type="text/event-stream",
+        headers=SSE_HEADERS,
+    )
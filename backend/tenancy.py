@@ -0,0 +1,80 @@
+"""Per-user data partitioning.
+
+Every user-owned document carries the `user_id` of its owner, taken from the
+X-User-Id header; requests without one act as DEFAULT_USER_ID, which also owns
+everything saved before partitioning. `user_id` leads every compound index on
+these collections and is part of every query filter, so a request only touches
+its own user's index ranges. It is also the shard key: all unique indexes are
+prefixed by it, so each collection can be sharded with {user_id: 1}.
+
+Run `python tenancy.py --migrate` to assign existing documents to the default
+user and create the indexes; the API does the same on its first startup.
+"""
+import asyncio
+import logging
+import os
+import re
+import sys
+from typing import Optional
+
+from fastapi import Header, HTTPException
+
+logger = logging.getLogger(__name__)
+
+USER_ID_HEADER = "X-User-Id"
+DEFAULT_USER_ID = "default"
+USER_ID_RE = re.compile(r"^[A-Za-z0-9._@:-]{1,128}$")
+SHARD_KEY = {"user_id": 1}
+
+# Collections whose documents belong to one user; jobs are owned but live in a shared queue
+USER_COLLECTIONS = (
+    "notes", "flashcards", "tasks", "quiz_questions", "chat_messages", "chat_summaries",
+    "study_sessions", "study_rollups", "user_progress", "collection_versions",
+)
+OWNED_COLLECTIONS = USER_COLLECTIONS + ("jobs",)
+
+
+def current_user(x_user_id: Optional[str] = Header(None)) -> str:
+    """FastAPI dependency: the requesting user's id"""
+    if x_user_id is None or not x_user_id.strip():
+        return DEFAULT_USER_ID
+    if not USER_ID_RE.match(x_user_id):
+        raise HTTPException(status_code=400, detail=f"Invalid {USER_ID_HEADER} header")
+    return x_user_id
+
+
+async def backfill_user_ids(db, user_id: str = DEFAULT_USER_ID) -> int:
+    """Assign documents saved before partitioning to `user_id`"""
+    assigned = 0
+    for collection in OWNED_COLLECTIONS:
+        result = await db[collection].update_many({"user_id": {"$exists": False}}, {"$set": {"user_id": user_id}})
+        if result.modified_count:
+            logger.info("Assigned %d %s to user %s", result.modified_count, collection, user_id)
+        assigned += result.modified_count
+    return assigned
+
+
+async def _main(argv) -> int:
+    from dotenv import load_dotenv
+    from motor.motor_asyncio import AsyncIOMotorClient
+    from pathlib import Path
+
+    from indexes import ensure_indexes
+
+    if "--migrate" not in argv:
+        print(__doc__)
+        return 2
+    load_dotenv(Path(__file__).parent / '.env')
+    client = AsyncIOMotorClient(os.environ['MONGO_URL'])
+    db = client[os.environ['DB_NAME']]
+    try:
+        print(f"{await backfill_user_ids(db)} documents assigned to '{DEFAULT_USER_ID}'")
+        await ensure_indexes(db)
+        return 0
+    finally:
+        client.close()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    sys.exit(asyncio.run(_main(sys.argv[1:])))
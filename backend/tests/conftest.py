@@ -0,0 +1,28 @@
+import os
+
+import mongomock_motor
+import pytest
+
+os.environ.setdefault("LLM_BACKEND", "fake")
+os.environ.setdefault("LLM_FAKE_LATENCY", "0")
+
+
+@pytest.fixture
+def db():
+    """A fresh in-memory database (mongomock-motor)"""
+    return mongomock_motor.AsyncMongoMockClient(tz_aware=True)["test"]
+
+
+@pytest.fixture
+def api(monkeypatch):
+    """A TestClient for the app backed by a fresh in-memory database (mongomock-motor)"""
+    from fastapi.testclient import TestClient
+
+    import server
+
+    monkeypatch.setattr(server, "AsyncIOMotorClient",
+                        lambda url, **kwargs: mongomock_motor.AsyncMongoMockClient(tz_aware=True))
+    monkeypatch.setattr(server, "client", None)
+    monkeypatch.setattr(server, "db", None)
+    server.connect_db()
+    return TestClient(server.app, headers={"X-User-Id": "tester"})
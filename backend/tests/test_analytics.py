@@ -0,0 +1,63 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+from analytics import backfill_rollups
+
+
+def progress_defaults(user_id):
+    return {"id": f"progress-{user_id}", "user_id": user_id, "total_study_hours": 0.0, "streak_days": 0, "xp": 0,
+            "last_study_date": None}
+
+
+def session(session_id, created_at, **fields):
+    return {"id": session_id, "user_id": "u1", "subject": "Biology", "duration": 30, "date": "2026-10-16",
+            "focus_score": 80, "created_at": created_at, **fields}
+
+
+def test_created_session_is_rolled_up_and_marked(api):
+    import server
+
+    response = api.post("/api/sessions", json={"subject": "Biology", "duration": 30, "date": "2026-10-16"})
+    assert response.status_code == 200
+
+    async def stored():
+        return await server.db.study_sessions.find_one({"id": response.json()["id"]})
+
+    assert asyncio.run(stored())["rolled_up"] is True
+    assert api.get("/api/progress").json()["xp"] == 30
+
+
+def test_stragglers_are_recorded_once_after_the_grace_period(db):
+    now = datetime.now(timezone.utc)
+
+    async def scenario():
+        await db.study_sessions.insert_many([
+            session("old", now - timedelta(hours=1), rolled_up=False),
+            session("in-flight", now, rolled_up=False),
+        ])
+        first = await backfill_rollups(db, progress_defaults=progress_defaults)
+        second = await backfill_rollups(db, progress_defaults=progress_defaults)
+        progress = await db.user_progress.find_one({"user_id": "u1"})
+        day = await db.study_rollups.find_one({"user_id": "u1", "period": "day"})
+        pending = await db.study_sessions.distinct("id", {"rolled_up": False})
+        return first, second, progress, day, pending
+
+    first, second, progress, day, pending = asyncio.run(scenario())
+    assert (first, second) == (1, 0)
+    assert progress["xp"] == 30 and progress["streak_days"] == 1
+    assert day["sessions"] == 1 and day["minutes"] == 30
+    assert pending == ["in-flight"]
+
+
+def test_concurrent_backfills_count_legacy_sessions_once(db):
+    async def scenario():
+        await db.study_sessions.insert_many([session(f"s{i}", "2026-10-16T10:00:00") for i in range(5)])
+        counts = await asyncio.gather(backfill_rollups(db, batch_size=2), backfill_rollups(db, batch_size=2))
+        day = await db.study_rollups.find_one({"user_id": "u1", "period": "day"})
+        leftover = await db.study_sessions.count_documents({"rollup_claim": {"$exists": True}})
+        return counts, day, leftover
+
+    counts, day, leftover = asyncio.run(scenario())
+    assert sum(counts) == 5
+    assert day["sessions"] == 5 and day["minutes"] == 150
+    assert leftover == 0
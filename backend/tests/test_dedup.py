@@ -0,0 +1,32 @@
+import asyncio
+
+from dedup import DedupService, compact_duplicates
+from versions import read_versions
+
+
+def test_compaction_bumps_the_versions_of_affected_users(db):
+    async def scenario():
+        await db.flashcards.insert_many([
+            {"id": "a1", "user_id": "a", "note_id": "n", "question": "What is osmosis?", "created_at": "2024-01-01"},
+            {"id": "a2", "user_id": "a", "note_id": "n", "question": "What is osmosis ?", "created_at": "2024-01-02"},
+            {"id": "b1", "user_id": "b", "note_id": "n", "question": "What is osmosis?", "created_at": "2024-01-01"},
+        ])
+        merged = await compact_duplicates(db, "flashcard")
+        versions = {user: await read_versions(db, user, ["flashcards"]) for user in ("a", "b")}
+        return merged, versions, await db.flashcards.distinct("id")
+
+    merged, versions, remaining = asyncio.run(scenario())
+    assert merged == {"a2": "a1"}
+    assert sorted(remaining) == ["a1", "b1"]
+    assert versions["a"] != ("0",) and versions["b"] == ("0",)
+
+
+def test_indexes_are_bounded_per_kind(db):
+    async def scenario():
+        service = DedupService(max_users=2)
+        for user in ("a", "b", "a", "c"):
+            await service.claim(db, "flashcard", {"id": f"{user}-card", "user_id": user, "note_id": "n",
+                                                  "question": f"What is {user}?"})
+        return list(service.indexes["flashcard"])
+
+    assert asyncio.run(scenario()) == ["a", "c"]
@@ -0,0 +1,139 @@
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+import server
+
+
+def create_card(api, question="What is osmosis?"):
+    response = api.post("/api/flashcards", json={"note_id": "note-1", "question": question, "answer": "Diffusion of water"})
+    assert response.status_code == 200
+    return response.json()["id"]
+
+
+def review(api, *reviews):
+    response = api.post("/api/flashcards/reviews", json={"reviews": list(reviews)})
+    assert response.status_code == 200, response.text
+    return response.json()
+
+
+def card_state(api, card_id):
+    return next(card for card in api.get("/api/flashcards").json() if card["id"] == card_id)
+
+
+def test_retried_batch_is_applied_once(api):
+    card_id = create_card(api)
+    batch = [{"review_id": "r1", "flashcard_id": card_id, "grade": 5}]
+
+    first = review(api, *batch)
+    retry = review(api, *batch)
+
+    assert first["applied"] == 1 and first["duplicates"] == 0
+    assert retry["applied"] == 0 and retry["duplicates"] == 1
+    assert card_state(api, card_id)["repetitions"] == 1
+
+
+def test_duplicate_review_id_within_batch_is_applied_once(api):
+    card_id = create_card(api)
+    result = review(api,
+                    {"review_id": "r1", "flashcard_id": card_id, "grade": 5},
+                    {"review_id": "r1", "flashcard_id": card_id, "grade": 5})
+
+    assert result["applied"] == 1
+    assert result["duplicates"] == 1
+    assert result["dropped"] == []
+    assert card_state(api, card_id)["repetitions"] == 1
+
+
+def test_reviews_are_applied_in_reviewed_at_order(api):
+    card_id = create_card(api)
+    start = datetime(2026, 1, 1, tzinfo=timezone.utc)
+    # Sent out of order: the lapse happened first, the recall a day later
+    result = review(api,
+                    {"review_id": "late", "flashcard_id": card_id, "grade": 5,
+                     "reviewed_at": (start + timedelta(days=1)).isoformat()},
+                    {"review_id": "early", "flashcard_id": card_id, "grade": 1, "reviewed_at": start.isoformat()})
+
+    card = card_state(api, card_id)
+    assert card["repetitions"] == 1 and card["lapses"] == 1
+    assert result["cards"][0]["interval"] == 1
+    assert datetime.fromisoformat(result["cards"][0]["next_review"].replace("Z", "+00:00")) == start + timedelta(days=2)
+
+
+def test_mixed_naive_aware_and_missing_reviewed_at(api):
+    first, second, third = create_card(api, "What is osmosis?"), create_card(api, "What is mitosis?"), create_card(api, "What is meiosis?")
+    result = review(api,
+                    {"review_id": "a", "flashcard_id": first, "grade": 4},
+                    {"review_id": "b", "flashcard_id": second, "grade": 4, "reviewed_at": "2026-10-16T10:00:00"},
+                    {"review_id": "c", "flashcard_id": third, "grade": 4, "reviewed_at": "2026-10-16T12:00:00+02:00"})
+
+    assert result["applied"] == 3
+    next_reviews = {card["flashcard_id"]: card["next_review"] for card in result["cards"]}
+    # Naive timestamps are taken as UTC; every stored date carries an offset
+    assert next_reviews[second].startswith("2026-10-17T10:00:00")
+    assert next_reviews[third].startswith("2026-10-17T10:00:00")
+    for value in next_reviews.values():
+        assert datetime.fromisoformat(value.replace("Z", "+00:00")).tzinfo is not None
+
+
+@pytest.mark.parametrize("reviewed_at", [None, "2100-01-01T00:00:00Z"])
+def test_missing_or_future_reviewed_at_counts_as_now(api, reviewed_at):
+    card_id = create_card(api)
+    before = datetime.now(timezone.utc)
+    entry = {"review_id": "r1", "flashcard_id": card_id, "grade": 5}
+    if reviewed_at:
+        entry["reviewed_at"] = reviewed_at
+    result = review(api, entry)
+
+    next_review = datetime.fromisoformat(result["cards"][0]["next_review"].replace("Z", "+00:00"))
+    assert before + timedelta(days=1) <= next_review <= datetime.now(timezone.utc) + timedelta(days=1)
+
+
+def test_applied_counts_reviews_not_cards(api):
+    card_id = create_card(api)
+    result = review(api,
+                    {"review_id": "r1", "flashcard_id": card_id, "grade": 5},
+                    {"review_id": "r2", "flashcard_id": card_id, "grade": 5},
+                    {"review_id": "r3", "flashcard_id": "missing", "grade": 5})
+
+    assert result["applied"] == 2 and result["not_found"] == ["missing"]
+    assert card_state(api, card_id)["repetitions"] == 2
+
+
+def _interleave_single_reviews(monkeypatch, card_id, times):
+    """Review `card_id` through PATCH right before the next `times` batch writes"""
+    collection_type = type(server.db.flashcards)
+    bulk_write = collection_type.bulk_write
+    remaining = [times]
+
+    async def racing_bulk_write(self, operations, **kwargs):
+        if remaining[0]:
+            remaining[0] -= 1
+            await server.review_flashcard(card_id, True, user_id="tester")
+        return await bulk_write(self, operations, **kwargs)
+
+    monkeypatch.setattr(collection_type, "bulk_write", racing_bulk_write)
+
+
+def test_concurrent_review_is_not_overwritten(api, monkeypatch):
+    card_id = create_card(api)
+    _interleave_single_reviews(monkeypatch, card_id, 1)
+
+    result = review(api, {"review_id": "r1", "flashcard_id": card_id, "grade": 5})
+
+    assert result["applied"] == 1 and result["dropped"] == []
+    # Both the interleaved review and the batch's are counted
+    assert card_state(api, card_id)["repetitions"] == 2
+
+
+def test_persistently_conflicting_reviews_are_reported(api, monkeypatch):
+    card_id, other = create_card(api, "What is osmosis?"), create_card(api, "What is mitosis?")
+    _interleave_single_reviews(monkeypatch, card_id, server.REVIEW_BATCH_ATTEMPTS)
+
+    result = review(api,
+                    {"review_id": "r1", "flashcard_id": card_id, "grade": 5},
+                    {"review_id": "r2", "flashcard_id": other, "grade": 5})
+
+    assert result["applied"] == 1 and result["dropped"] == ["r1"]
+    assert [card["flashcard_id"] for card in result["cards"]] == [other]
+    assert card_state(api, card_id)["repetitions"] == server.REVIEW_BATCH_ATTEMPTS
@@ -0,0 +1,145 @@
+import asyncio
+import json
+
+import pytest
+
+from ai_service import AIService
+from generated_items import ItemStreamParser, flashcard_fields, parse_items, quiz_fields
+from llm_cache import LLMCache
+from llm_gateway import FakeBackend, LLMGateway
+
+CARDS = [{"question": "What is osmosis?", "answer": "Diffusion of water"},
+         {"question": "What is mitosis?", "answer": "Cell division"}]
+
+
+def feed_in_chunks(text: str, size: int):
+    parser = ItemStreamParser()
+    items = []
+    for start in range(0, len(text), size):
+        items.extend(parser.feed(text[start:start + size]))
+    return items + parser.close(), parser
+
+
+def test_plain_array():
+    assert parse_items(json.dumps(CARDS)) == CARDS
+
+
+@pytest.mark.parametrize("size", [1, 3, 17])
+def test_items_are_emitted_across_chunk_boundaries(size):
+    items, parser = feed_in_chunks(json.dumps(CARDS, indent=2), size)
+    assert items == CARDS
+    assert parser.rejected == 0
+
+
+def test_fenced_output_with_prose():
+    text = "Here are your flashcards:\n```json\n" + json.dumps(CARDS) + "\n```\nGood luck!"
+    assert parse_items(text) == CARDS
+
+
+def test_trailing_commas():
+    text = '[{"question": "What is osmosis?", "answer": "Diffusion of water",}, ' \
+           '{"question": "What is mitosis?", "answer": "Cell division",},]'
+    assert parse_items(text) == CARDS
+
+
+def test_truncated_array_keeps_complete_items():
+    text = json.dumps(CARDS)[:-1] + ', {"question": "What is meio'
+    items, parser = feed_in_chunks(text, 8)
+    assert items == CARDS
+    assert parser.rejected == 1
+
+
+def test_malformed_item_is_rejected_and_the_rest_kept():
+    text = '[{"question": "What is osmosis?", "answer": "Diffusion of water"}, {"question": oops}, ' \
+           '{"question": "What is mitosis?", "answer": "Cell division"}]'
+    parser = ItemStreamParser()
+    assert parser.feed(text) + parser.close() == CARDS
+    assert parser.rejected == 1
+
+
+def test_braces_and_quotes_inside_strings():
+    cards = [{"question": 'What does "{x}" mean in ]a set[?', "answer": "A set containing x \\ nothing else"}]
+    assert parse_items(json.dumps(cards)) == cards
+
+
+def test_wrapping_object():
+    assert parse_items("```json\n" + json.dumps({"flashcards": CARDS}) + "\n```") == CARDS
+
+
+def test_lone_object():
+    assert parse_items(json.dumps(CARDS[0])) == [CARDS[0]]
+
+
+def test_no_json():
+    assert parse_items("Sorry, I cannot help with that.") == []
+
+
+def test_flashcard_fields_accepts_alternate_keys():
+    assert flashcard_fields({"Front": "Term", "Back": "Definition"}) == {"question": "Term", "answer": "Definition"}
+    assert flashcard_fields({"question": "Only a question"}) is None
+
+
+@pytest.mark.parametrize("correct, expected", [(2, 2), ("2", 2), ("C", 2), ("c) third", 2), ("third", 2), (7, None)])
+def test_quiz_fields_correct_answer_forms(correct, expected):
+    item = {"question": "Pick the third", "options": ["first", "second", "third", "fourth"], "correct_answer": correct}
+    fields = quiz_fields(item)
+    if expected is None:
+        assert fields is None
+    else:
+        assert fields["correct_answer"] == expected
+
+
+def test_generate_saves_parsed_cards(api, monkeypatch):
+    import server
+
+    note = api.post("/api/notes", json={"title": "Cells", "content": "Osmosis and mitosis.", "subject": "Biology"}).json()
+    raw = "```json\n[" + ", ".join(json.dumps(card) for card in CARDS) + ', {"question": "What is mei'
+
+    async def generate(content, count, bypass_cache=False):
+        return raw
+
+    monkeypatch.setattr(server.ai_service, "generate_flashcards", generate)
+    response = api.post("/api/flashcards/generate", json={"note_id": note["id"], "count": 3})
+
+    assert response.status_code == 200
+    body = response.json()
+    assert [(card["question"], card["answer"]) for card in body["flashcards"]] == [(c["question"], c["answer"]) for c in CARDS]
+    assert body["rejected"] == 1
+    saved = api.get("/api/flashcards").json()
+    assert sorted(card["question"] for card in saved) == sorted(card["question"] for card in CARDS)
+    assert all(card["note_id"] == note["id"] for card in saved)
+
+    # Generating the same cards again saves nothing new
+    again = api.post("/api/flashcards/generate", json={"note_id": note["id"], "count": 3, "bypass_cache": True}).json()
+    assert again["flashcards"] == [] and len(again["duplicates"]) == 2
+    assert len(api.get("/api/flashcards").json()) == 2
+
+
+class ScriptedBackend(FakeBackend):
+    """Answers with the queued responses, in order"""
+
+    def __init__(self, *responses):
+        super().__init__()
+        self.responses = list(responses)
+
+    def respond(self, system_message, prompt):
+        return self.responses.pop(0)
+
+
+@pytest.mark.parametrize("streamed", [False, True])
+def test_unparseable_output_is_not_cached(streamed):
+    backend = ScriptedBackend("Sorry, I cannot help with that.", json.dumps(CARDS), "not asked for")
+    service = AIService(cache=LLMCache(), gateway=LLMGateway(backend))
+
+    async def generate():
+        if not streamed:
+            return await service.generate_flashcards("Osmosis and mitosis.", 2)
+        return "".join([chunk async for chunk in service.stream_flashcards("Osmosis and mitosis.", 2)])
+
+    async def scenario():
+        return [await generate() for _ in range(3)]
+
+    refused, parsed, cached = asyncio.run(scenario())
+    assert parse_items(refused) == []
+    assert parse_items(parsed) == parse_items(cached) == CARDS
+    assert backend.calls == 2
@@ -0,0 +1,89 @@
+import asyncio
+from datetime import datetime, timezone
+
+import pytest
+from fastapi import HTTPException
+from pymongo.errors import AutoReconnect
+
+from due_queue import decode_position, encode_position
+from migrations import DatetimeMigration, completed_migrations, datetime_migration
+
+
+def test_converts_string_timestamps_and_records_completion(db):
+    async def scenario():
+        await db.notes.insert_many([
+            {"id": "n1", "created_at": "2024-01-02T03:04:05", "updated_at": "2024-01-02T03:04:05+02:00"},
+            {"id": "n2", "created_at": datetime(2024, 1, 1, tzinfo=timezone.utc), "updated_at": "2024-01-01T00:00:00Z"},
+        ])
+        migration = DatetimeMigration(batch_size=1)
+        await migration.start(db)
+        await migration._task
+        return migration, await db.notes.find({}, {"_id": 0}).sort("id", 1).to_list(None), await completed_migrations(db)
+
+    migration, notes, completed = asyncio.run(scenario())
+    assert migration.complete and migration.migrated == 2
+    assert notes[0]["created_at"] == datetime(2024, 1, 2, 3, 4, 5, tzinfo=timezone.utc)
+    assert notes[0]["updated_at"] == datetime(2024, 1, 2, 1, 4, 5, tzinfo=timezone.utc)
+    assert notes[1]["updated_at"] == datetime(2024, 1, 1, tzinfo=timezone.utc)
+    assert completed == {DatetimeMigration.name}
+
+
+def test_completed_migration_is_not_probed_again(db):
+    async def scenario():
+        await db.notes.insert_one({"id": "n1", "created_at": "2024-01-02T03:04:05"})
+        migration = DatetimeMigration()
+        await migration.start(db, {DatetimeMigration.name})
+        return migration
+
+    migration = asyncio.run(scenario())
+    assert migration.complete and migration._task is None
+
+
+def test_unparseable_documents_are_skipped_and_keep_the_fallback(db):
+    async def scenario():
+        await db.notes.insert_many([
+            {"id": "bad", "created_at": "last tuesday"},
+            {"id": "good", "created_at": "2024-01-02T03:04:05"},
+        ])
+        migration = DatetimeMigration(batch_size=1)
+        await migration.run(db)
+        return migration, await db.notes.find_one({"id": "good"}), await completed_migrations(db)
+
+    migration, good, completed = asyncio.run(scenario())
+    assert migration.migrated == 1 and migration.skipped == 1
+    assert isinstance(good["created_at"], datetime)
+    assert not migration.complete and completed == set()
+
+
+def test_connection_errors_are_retried():
+    attempts = []
+
+    async def flaky():
+        attempts.append(1)
+        if len(attempts) < 3:
+            raise AutoReconnect("primary stepped down")
+        return "done"
+
+    migration = DatetimeMigration(retry_delay=0)
+    assert asyncio.run(migration._retry(flaky)) == "done"
+    assert len(attempts) == 3
+
+
+def test_persistent_failure_is_recorded():
+    class Broken:
+        def __getitem__(self, name):
+            raise AutoReconnect("no primary")
+
+    migration = DatetimeMigration(max_attempts=2, retry_delay=0)
+    asyncio.run(migration.run(Broken()))
+    assert not migration.complete
+    assert "no primary" in migration.error
+
+
+def test_due_cursor_with_legacy_string_date(monkeypatch):
+    monkeypatch.setattr(datetime_migration, "complete", False)
+    assert decode_position(encode_position((0, "2024-01-02T03:04:05", "card"))) == (0, "2024-01-02T03:04:05", "card")
+
+    monkeypatch.setattr(datetime_migration, "complete", True)
+    with pytest.raises(HTTPException):
+        decode_position(encode_position((0, "2024-01-02T03:04:05", "card")))
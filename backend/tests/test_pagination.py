@@ -0,0 +1,45 @@
+import asyncio
+from datetime import datetime, timezone
+
+import pytest
+
+import pagination
+import server
+
+
+@pytest.fixture
+def uncached(api, monkeypatch):
+    # Every GET reaches the route, rather than the body cached for the ETag by the first one
+    monkeypatch.setattr(server.response_cache, "get", lambda etag: None)
+    return api
+
+
+def seed(api):
+    note = api.post("/api/notes", json={"title": "Cells", "content": "Osmosis and mitosis.", "subject": "Biology"}).json()
+    api.post("/api/flashcards", json={"note_id": note["id"], "question": "What is osmosis?", "answer": "Diffusion"})
+    api.post("/api/tasks", json={"title": "Revise", "description": "Chapter 3", "date": "2026-10-20", "duration": 45})
+    api.post("/api/sessions", json={"subject": "Biology", "duration": 30, "date": "2026-10-16"})
+
+    async def legacy():
+        # Stored before later fields existed, with keys in another order than the model's
+        await server.db.flashcards.insert_one({
+            "created_at": datetime(2024, 1, 2, 3, 4, 5, 678000, tzinfo=timezone.utc), "answer": "Cell division",
+            "question": "What is mitosis?", "note_id": note["id"], "user_id": "tester", "id": "legacy-card",
+            "next_review": datetime(2024, 1, 3, tzinfo=timezone.utc), "ease": 2.5, "interval": 1,
+        })
+
+    asyncio.run(legacy())
+
+
+@pytest.mark.parametrize("path", ["/api/notes", "/api/flashcards", "/api/tasks", "/api/sessions"])
+def test_lean_pages_match_the_response_model_byte_for_byte(uncached, monkeypatch, path):
+    seed(uncached)
+
+    monkeypatch.setattr(pagination, "LEAN_RESPONSES", False)
+    validated = uncached.get(path)
+    monkeypatch.setattr(pagination, "LEAN_RESPONSES", True)
+    lean = uncached.get(path)
+
+    assert validated.status_code == lean.status_code == 200
+    assert validated.json()
+    assert lean.content == validated.content
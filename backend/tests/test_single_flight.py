@@ -0,0 +1,146 @@
+import asyncio
+
+import pytest
+
+from single_flight import SingleFlight
+
+
+def test_concurrent_calls_share_one_execution():
+    async def scenario():
+        flight = SingleFlight()
+        calls = 0
+
+        async def work():
+            nonlocal calls
+            calls += 1
+            await asyncio.sleep(0.01)
+            return "answer"
+
+        results = await asyncio.gather(*(flight.do("key", work) for _ in range(5)))
+        return flight, calls, results
+
+    flight, calls, results = asyncio.run(scenario())
+    assert results == ["answer"] * 5
+    assert calls == 1
+    assert flight.stats() == {"executions": 1, "coalesced": 4, "in_flight": 0}
+
+
+def test_different_keys_are_not_coalesced():
+    async def scenario():
+        flight = SingleFlight()
+
+        async def work(value):
+            await asyncio.sleep(0.01)
+            return value
+
+        results = await asyncio.gather(flight.do("a", lambda: work(1)), flight.do("b", lambda: work(2)))
+        return flight, results
+
+    flight, results = asyncio.run(scenario())
+    assert results == [1, 2]
+    assert flight.executions == 2 and flight.coalesced == 0
+
+
+def test_key_is_released_after_completion():
+    async def scenario():
+        flight = SingleFlight()
+        calls = 0
+
+        async def work():
+            nonlocal calls
+            calls += 1
+            return calls
+
+        return [await flight.do("key", work), await flight.do("key", work)]
+
+    assert asyncio.run(scenario()) == [1, 2]
+
+
+def test_failure_reaches_every_waiter():
+    async def scenario():
+        flight = SingleFlight()
+
+        async def work():
+            await asyncio.sleep(0.01)
+            raise ValueError("upstream failed")
+
+        results = await asyncio.gather(*(flight.do("key", work) for _ in range(3)), return_exceptions=True)
+        return flight, results
+
+    flight, results = asyncio.run(scenario())
+    assert len(results) == 3
+    assert all(isinstance(result, ValueError) and str(result) == "upstream failed" for result in results)
+    assert flight.executions == 1
+    assert flight.stats()["in_flight"] == 0
+
+
+def test_failure_is_not_cached():
+    async def scenario():
+        flight = SingleFlight()
+        attempts = 0
+
+        async def work():
+            nonlocal attempts
+            attempts += 1
+            if attempts == 1:
+                raise ValueError("transient")
+            return "ok"
+
+        with pytest.raises(ValueError):
+            await flight.do("key", work)
+        return await flight.do("key", work)
+
+    assert asyncio.run(scenario()) == "ok"
+
+
+def test_cancelled_waiter_does_not_cancel_shared_call():
+    async def scenario():
+        flight = SingleFlight()
+        release = asyncio.Event()
+        calls = 0
+
+        async def work():
+            nonlocal calls
+            calls += 1
+            await release.wait()
+            return "answer"
+
+        first = asyncio.ensure_future(flight.do("key", work))
+        second = asyncio.ensure_future(flight.do("key", work))
+        await asyncio.sleep(0)
+        first.cancel()
+        await asyncio.sleep(0)
+        release.set()
+        with pytest.raises(asyncio.CancelledError):
+            await first
+        return calls, await second
+
+    assert asyncio.run(scenario()) == (1, "answer")
+
+
+def test_shared_call_is_cancelled_when_last_waiter_leaves():
+    async def scenario():
+        flight = SingleFlight()
+        started = asyncio.Event()
+        cancelled = False
+
+        async def work():
+            nonlocal cancelled
+            started.set()
+            try:
+                await asyncio.sleep(10)
+            except asyncio.CancelledError:
+                cancelled = True
+                raise
+
+        waiters = [asyncio.ensure_future(flight.do("key", work)) for _ in range(2)]
+        await started.wait()
+        for waiter in waiters:
+            waiter.cancel()
+        await asyncio.gather(*waiters, return_exceptions=True)
+        await asyncio.sleep(0)
+        return flight, cancelled
+
+    flight, cancelled = asyncio.run(scenario())
+    assert cancelled
+    assert flight.stats()["in_flight"] == 0
@@ -0,0 +1,73 @@
+import asyncio
+
+from migrations import completed_migrations, run_once
+from search import SearchService
+
+
+def test_run_once_skips_recorded_steps(db):
+    calls = []
+
+    async def step(db):
+        calls.append(1)
+
+    async def scenario():
+        await run_once(db, "backfill", step, await completed_migrations(db))
+        await run_once(db, "backfill", step, await completed_migrations(db))
+        return await completed_migrations(db)
+
+    assert asyncio.run(scenario()) == {"backfill"}
+    assert calls == [1]
+
+
+def test_search_index_is_read_on_first_search(db):
+    async def scenario():
+        service = SearchService()
+        await db.notes.insert_one({"id": "n1", "user_id": "u1", "title": "Osmosis", "content": "water", "subject": "Bio"})
+        await db.notes.insert_one({"id": "n2", "user_id": "u2", "title": "Osmosis", "content": "water", "subject": "Bio"})
+        # Writes for users whose index is not loaded are left to the first read
+        service.index_note({"id": "n1", "user_id": "u1", "title": "Osmosis", "content": "water", "subject": "Bio"})
+        assert service.indexes == {}
+
+        hits = await service.search(db, "u1", "osmosis")
+        return service, hits
+
+    service, hits = asyncio.run(scenario())
+    assert [hit["id"] for hit in hits] == ["n1"]
+    assert list(service.indexes) == ["u1"]
+
+
+def test_writes_during_first_read_are_applied(db):
+    async def scenario():
+        service = SearchService()
+        await db.notes.insert_one({"id": "n1", "user_id": "u1", "title": "Osmosis", "content": "water", "subject": "Bio"})
+        loading = asyncio.ensure_future(service.index_of(db, "u1"))
+        await asyncio.sleep(0)
+        service.index_note({"id": "n2", "user_id": "u1", "title": "Mitosis", "content": "division", "subject": "Bio"})
+        service.remove("u1", "note", "n1")
+        await loading
+        return await service.search(db, "u1", "osmosis mitosis")
+
+    assert [hit["id"] for hit in asyncio.run(scenario())] == ["n2"]
+
+
+def test_search_indexes_are_bounded_and_expire(db):
+    async def scenario():
+        service = SearchService(max_users=2)
+        for user in ("u1", "u2", "u3"):
+            await db.notes.insert_one({"id": f"n-{user}", "user_id": user, "title": "Osmosis", "content": "water"})
+        await service.search(db, "u1", "osmosis")
+        await service.search(db, "u2", "osmosis")
+        await service.search(db, "u1", "osmosis")  # u2 is now least recently searched
+        await service.search(db, "u3", "osmosis")
+        evicted = list(service.indexes)
+
+        # A write served by another worker is only seen once the index is read again
+        await db.notes.insert_one({"id": "n-other", "user_id": "u1", "title": "Osmosis", "content": "elsewhere"})
+        stale = await service.search(db, "u1", "osmosis")
+        service.max_age = 0
+        fresh = await service.search(db, "u1", "osmosis")
+        return evicted, stale, fresh
+
+    evicted, stale, fresh = asyncio.run(scenario())
+    assert evicted == ["u1", "u3"]
+    assert len(stale) == 1 and len(fresh) == 2
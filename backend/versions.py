@@ -0,0 +1,197 @@
+"""Collection version counters and conditional GETs.
+
+Every write endpoint bumps a per-user counter for each collection it changes
+(one `collection_versions` document per user and collection). The GET routes
+in CONDITIONAL_ROUTES are answered by ConditionalGetMiddleware from those
+counters: the ETag is derived from the versions of the collections a route
+reads, a matching If-None-Match gets a 304 after reading only the counters,
+and recent bodies are served from an in-process ResponseCache keyed on the
+same versions, so repeated polling never reaches the collection.
+
+Counters are bumped after the write: a response built in between is cached
+under the old version, which no request asks for once the bump lands. Each
+counter also carries a random epoch, so a counter that is dropped and
+restarts from zero does not reproduce old ETags.
+"""
+import hashlib
+import time
+import uuid
+from collections import OrderedDict
+from datetime import datetime, timezone
+from typing import Callable, Dict, Iterable, Optional, Tuple
+
+from pymongo.errors import DuplicateKeyError
+
+from metrics import REGISTRY, Counter
+from tenancy import DEFAULT_USER_ID, USER_ID_HEADER, USER_ID_RE
+
+# GET path -> collections its response is read from
+CONDITIONAL_ROUTES: Dict[str, Tuple[str, ...]] = {
+    "/api/notes": ("notes",),
+    "/api/flashcards": ("flashcards",),
+    "/api/tasks": ("tasks",),
+    "/api/quiz/questions": ("quiz_questions",),
+    "/api/sessions": ("study_sessions",),
+    "/api/progress": ("user_progress",),
+    "/api/progress/analytics": ("study_rollups",),
+}
+# Responses that also depend on the current date (streaks, "last 30 days")
+DAILY_ROUTES = {"/api/progress", "/api/progress/analytics"}
+
+CONDITIONAL_GETS = REGISTRY.register(Counter(
+    "conditional_get_total", "Conditional GETs by route and outcome", ("route", "result")))
+
+
+async def bump_versions(db, user_id: str, *collections: str):
+    """Record that `user_id`'s documents in `collections` changed"""
+    for collection in collections:
+        update = {"$inc": {"version": 1}, "$setOnInsert": {"epoch": uuid.uuid4().hex[:8]}}
+        try:
+            await db.collection_versions.update_one({"user_id": user_id, "collection": collection}, update, upsert=True)
+        except DuplicateKeyError:
+            # Lost the race to create the counter; it exists now
+            await db.collection_versions.update_one({"user_id": user_id, "collection": collection}, update)
+
+
+async def read_versions(db, user_id: str, collections: Iterable[str]) -> Tuple[str, ...]:
+    """The current `epoch.version` of each collection; "0" for one never written"""
+    collections = tuple(collections)
+    docs = await db.collection_versions.find(
+        {"user_id": user_id, "collection": {"$in": list(collections)}},
+        {"_id": 0, "collection": 1, "version": 1, "epoch": 1},
+    ).to_list(len(collections))
+    current = {doc["collection"]: f"{doc.get('epoch', '')}.{doc['version']}" for doc in docs}
+    return tuple(current.get(collection, "0") for collection in collections)
+
+
+def make_etag(user_id: str, path: str, query: str, versions: Tuple[str, ...], day: Optional[str] = None) -> str:
+    raw = "|".join((user_id, path, query, day or "", *versions))
+    return f'W/"{hashlib.sha256(raw.encode("utf-8")).hexdigest()[:24]}"'
+
+
+def _opaque(tag: str) -> str:
+    tag = tag.strip()
+    return tag[2:] if tag.startswith("W/") else tag
+
+
+def etag_matches(if_none_match: str, etag: str) -> bool:
+    """Weak comparison, as If-None-Match requires"""
+    if if_none_match.strip() == "*":
+        return True
+    return any(_opaque(candidate) == _opaque(etag) for candidate in if_none_match.split(","))
+
+
+class ResponseCache:
+    """Short-lived LRU of response bodies keyed by ETag, bounded in total bytes"""
+
+    def __init__(self, ttl: float = 30.0, max_bytes: int = 64 * 1024 * 1024, max_body_bytes: int = 4 * 1024 * 1024):
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.max_body_bytes = max_body_bytes
+        self._entries: "OrderedDict[str, Tuple[float, list, bytes]]" = OrderedDict()
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, etag: str) -> Optional[Tuple[list, bytes]]:
+        entry = self._entries.get(etag)
+        if entry is None or entry[0] < time.monotonic():
+            if entry is not None:
+                self._drop(etag)
+            self.misses += 1
+            return None
+        self._entries.move_to_end(etag)
+        self.hits += 1
+        return entry[1], entry[2]
+
+    def set(self, etag: str, headers: list, body: bytes):
+        if len(body) > self.max_body_bytes:
+            return
+        if etag in self._entries:
+            self._drop(etag)
+        self._entries[etag] = (time.monotonic() + self.ttl, headers, body)
+        self._bytes += len(body)
+        while self._bytes > self.max_bytes:
+            self._drop(next(iter(self._entries)))
+
+    def _drop(self, etag: str):
+        _, _, body = self._entries.pop(etag)
+        self._bytes -= len(body)
+
+    def stats(self) -> dict:
+        return {"hits": self.hits, "misses": self.misses, "entries": len(self._entries), "bytes": self._bytes}
+
+
+class ConditionalGetMiddleware:
+    """ASGI middleware answering CONDITIONAL_ROUTES with ETags, 304s and cached bodies.
+
+    Must sit inside CORSMiddleware, so 304s and cached responses still get
+    CORS headers for the requesting origin.
+    """
+
+    def __init__(self, app, get_db: Callable, cache: ResponseCache):
+        self.app = app
+        self.get_db = get_db  # the database is only connected on startup
+        self.cache = cache
+        self._routes: Dict[str, object] = {}
+
+    def _route(self, scope, path: str):
+        """The app's GET route for `path`, so responses answered here are still labelled by route"""
+        if path not in self._routes:
+            self._routes[path] = next((route for route in scope["app"].router.routes
+                                       if getattr(route, "path", None) == path and "GET" in getattr(route, "methods", ())),
+                                      None)
+        return self._routes[path]
+
+    async def __call__(self, scope, receive, send):
+        path = scope.get("path")
+        if scope["type"] != "http" or scope["method"] != "GET" or path not in CONDITIONAL_ROUTES:
+            await self.app(scope, receive, send)
+            return
+
+        headers = {name: value for name, value in scope["headers"] if name in (b"x-user-id", b"if-none-match")}
+        user_id = headers.get(b"x-user-id", b"").decode("latin-1").strip() or DEFAULT_USER_ID
+        if not USER_ID_RE.match(user_id):
+            await self.app(scope, receive, send)  # rejected by the current_user dependency
+            return
+
+        versions = await read_versions(self.get_db(), user_id, CONDITIONAL_ROUTES[path])
+        day = datetime.now(timezone.utc).date().isoformat() if path in DAILY_ROUTES else None
+        etag = make_etag(user_id, path, scope.get("query_string", b"").decode("latin-1"), versions, day)
+        validators = [(b"etag", etag.encode("latin-1")), (b"vary", USER_ID_HEADER.encode("latin-1")),
+                      (b"cache-control", b"no-cache")]
+
+        # Set as routing would, for MetricsMiddleware; the app overwrites it on a miss
+        scope["route"] = self._route(scope, path)
+
+        if_none_match = headers.get(b"if-none-match")
+        if if_none_match is not None and etag_matches(if_none_match.decode("latin-1"), etag):
+            CONDITIONAL_GETS.inc((path, "not_modified"))
+            await send({"type": "http.response.start", "status": 304, "headers": validators})
+            await send({"type": "http.response.body", "body": b""})
+            return
+
+        cached = self.cache.get(etag)
+        if cached is not None:
+            CONDITIONAL_GETS.inc((path, "cache_hit"))
+            cached_headers, body = cached
+            await send({"type": "http.response.start", "status": 200, "headers": cached_headers})
+            await send({"type": "http.response.body", "body": body})
+            return
+
+        CONDITIONAL_GETS.inc((path, "miss"))
+        start, chunks = None, []
+
+        async def send_and_capture(message):
+            nonlocal start
+            if message["type"] == "http.response.start":
+                if message["status"] == 200:
+                    message = {**message, "headers": [*message.get("headers", []), *validators]}
+                start = message
+            elif message["type"] == "http.response.body" and start["status"] == 200:
+                chunks.append(message.get("body", b""))
+                if not message.get("more_body", False):
+                    self.cache.set(etag, list(start["headers"]), b"".join(chunks))
+            await send(message)
+
+        await self.app(scope, receive, send_and_capture)
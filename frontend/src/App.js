@@ -72,20 +72,32 @@ function App() {
     return () => clearInterval(interval);
   }, [focusActive, focusTime]);
   
+  // List endpoints return one page at a time; follow X-Next-Cursor until the last page
+  const fetchAllPages = async (path) => {
+    const items = [];
+    let cursor = null;
+    do {
+      const res = await axios.get(`${API}/${path}`, { params: cursor ? { cursor } : {} });
+      items.push(...res.data);
+      cursor = res.headers['x-next-cursor'];
+    } while (cursor);
+    return items;
+  };
+  
   const fetchData = async () => {
     try {
-      const [notesRes, flashcardsRes, tasksRes, sessionsRes, progressRes] = await Promise.all([
-        axios.get(`${API}/notes`),
-        axios.get(`${API}/flashcards`),
-        axios.get(`${API}/tasks`),
-        axios.get(`${API}/sessions`),
+      const [notesData, flashcardsData, tasksData, sessionsData, progressRes] = await Promise.all([
+        fetchAllPages('notes'),
+        fetchAllPages('flashcards'),
+        fetchAllPages('tasks'),
+        fetchAllPages('sessions'),
         axios.get(`${API}/progress`)
       ]);
       
-      setNotes(notesRes.data);
-      setFlashcards(flashcardsRes.data);
-      setTasks(tasksRes.data);
-      setStudySessions(sessionsRes.data);
+      setNotes(notesData);
+      setFlashcards(flashcardsData);
+      setTasks(tasksData);
+      setStudySessions(sessionsData);
       setProgress(progressRes.data);
     } catch (error) {
       console.error('Error fetching data:', error);